@@ -0,0 +1,129 @@
+"""Persistent follower activity cache with incremental refresh"""
+import logging
+import sys
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+
+from database import Database, DatabaseWriter
+from bluesky_service import FollowerRecord
+
+logger = logging.getLogger(__name__)
+
+class ActivityCache:
+    """DID-keyed cache of follower activity, stored in the snapshot database
+
+    A cached entry is reused unless the follower's status could have changed
+    since it was checked:
+    - entries older than the TTL are always refreshed
+    - followers active when checked are refreshed once they get within the
+      refresh margin of the activity window boundary
+    - everyone else (inactive, ghost, disabled) waits for the TTL
+    """
+
+    def __init__(
+            self,
+            db: Database,
+            window_days: int,
+            ttl_hours: float,
+            margin_days: float,
+            now: Optional[datetime] = None,
+            writer: Optional[DatabaseWriter] = None
+    ):
+        self.db = db
+        self.writer = writer
+        self.now = now or datetime.now(timezone.utc)
+        self.window = timedelta(days=window_days)
+        self.ttl = timedelta(hours=ttl_hours)
+        self.margin = timedelta(days=margin_days)
+        self.hits = 0
+        self.misses = 0
+
+    def _run(self, fn, *args):
+        """Run database work directly, or on the writer's thread when there is one"""
+        if self.writer:
+            return self.writer.call(fn, *args)
+        return fn(*args)
+
+    @property
+    def hit_rate(self) -> float:
+        """Percentage of lookups answered from the cache"""
+        total = self.hits + self.misses
+        return (self.hits / total) * 100 if total > 0 else 0
+
+    def seed(self, account_handle: str):
+        """Seed an empty cache from the account's previous snapshot"""
+        seeded = self._run(self.db.seed_activity_cache, account_handle)
+        if seeded:
+            logger.info(f"Seeded activity cache with {seeded} followers from the last snapshot")
+
+    def needs_refresh(self, entry: dict) -> bool:
+        """Check whether a cached entry could be out of date"""
+        checked_at = datetime.fromisoformat(entry["checked_at"])
+        if self.now - checked_at > self.ttl:
+            return True
+
+        if entry["disabled"] or not entry["last_posted_at"]:
+            return False
+
+        posted_at = datetime.fromisoformat(entry["last_posted_at"])
+        # Any newer post would only keep them active
+        if posted_at > self.now - self.window + self.margin:
+            return False
+
+        # Active when checked, but may since have crossed the window boundary
+        return posted_at > checked_at - self.window
+
+    def partition(self, followers) -> tuple[list[FollowerRecord], list]:
+        """Split a page of followers into cached results and followers to look up"""
+        entries = self._run(self.db.get_cached_activity, [follower.did for follower in followers])
+
+        cached = []
+        stale = []
+        for follower in followers:
+            entry = entries.get(follower.did)
+            if entry is None or self.needs_refresh(entry):
+                stale.append(follower)
+                continue
+
+            cached.append(FollowerRecord(
+                did=follower.did,
+                handle=sys.intern(follower.handle),
+                display_name=follower.display_name,
+                last_posted_at=entry["last_posted_at"],
+                posts_count=entry["posts_count"],
+                disabled=entry["disabled"]
+            ))
+
+        self.hits += len(cached)
+        self.misses += len(stale)
+        return cached, stale
+
+    def known(self, followers) -> list[FollowerRecord]:
+        """Unsampled records of followers skipped by sampling, with any activity cached for them
+
+        Entries are used however old they are and nothing is looked up, so
+        snapshots keep the last activity known for followers outside the sample.
+        """
+        entries = self._run(self.db.get_cached_activity, [follower.did for follower in followers])
+
+        records = []
+        for follower in followers:
+            entry = entries.get(follower.did) or {}
+            records.append(FollowerRecord(
+                did=follower.did,
+                handle=sys.intern(follower.handle),
+                display_name=follower.display_name,
+                last_posted_at=entry.get("last_posted_at"),
+                posts_count=entry.get("posts_count"),
+                disabled=entry.get("disabled", False),
+                sampled=False
+            ))
+        return records
+
+    def store(self, followers: list[FollowerRecord]):
+        """Record freshly looked-up activity"""
+        checked_at = self.now.isoformat()
+        self._run(self.db.save_activity, [
+            (follower.did, follower.last_posted_at, follower.posts_count, follower.disabled, checked_at)
+            for follower in followers
+        ])
@@ -1,110 +1,439 @@
 """Analytics and reporting for follower data."""
 import logging
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timezone
+from math import ceil, sqrt
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Callable, Iterable, Optional
 
-from bluesky_service import FollowerData, is_active_in_window
+import cohorts
+import report_format
+from bluesky_service import FollowerData, FollowerRecord
 from config import config
+from database import Database
+from sampling import ActivitySample
 
 logger = logging.getLogger(__name__)
 
+# Windows, in days, of the activity histogram stored with every snapshot
+ACTIVITY_WINDOWS = (7, 31, 90, 365)
+
+SECONDS_PER_DAY = 86400
+
+# Followers are split into this many strata by position in the follower list, which
+# runs newest first, so sampled estimates are weighted across every follow age
+SAMPLE_STRATA = 10
+
+# Normal quantile of the 95% confidence intervals of sampled estimates
+CONFIDENCE_Z = 1.96
+
 class FollowerStats(BaseModel):
     """Statistics about followers"""
     total_followers: int = Field(..., ge=0, description="Total followers account has")
     enabled_count: int = Field(..., ge=0, description="Accounts still enabled")
     disabled_count: int = Field(..., ge=0, description="Accounts disabled or deleted")
     active_count: int = Field(..., ge=0, description="Number of accounts which posted recently")
+    inactive_count: int = Field(default=0, ge=0, description="Number of accounts which posted, but not recently")
     ghost_count: int = Field(..., ge=0, description="Number of accounts that have never posted")
     active_percentage: float = Field(..., ge=0, description="Percentage of active followers")
+    activity: dict[str, int] = Field(default_factory=dict, description="Followers who posted within each window by days, plus never_posted")
+    estimated: bool = Field(default=False, description="Counts are estimated from a sample of followers rather than exact")
+    sample_size: int = Field(default=0, ge=0, description="Followers whose activity was looked up")
+    intervals: dict[str, tuple[float, float]] = Field(default_factory=dict, description="95% confidence intervals of estimated counts, as percentages of total followers")
+
+class Relationships(BaseModel):
+    """Mutual and one-way follows between an account and its followers at one snapshot"""
+    mutuals_count: int = Field(..., ge=0, description="Followers the account follows back")
+    followers_only_count: int = Field(..., ge=0, description="Followers the account doesn't follow back")
+    following_only_count: int = Field(..., ge=0, description="Accounts followed that don't follow back")
+    mutuals: dict[str, str] = Field(default_factory=dict, description="Mutuals by did:handle, up to the report's limit")
+    followers_only: dict[str, str] = Field(default_factory=dict, description="Followers not followed back by did:handle, up to the report's limit")
+    following_only: dict[str, str] = Field(default_factory=dict, description="Accounts not following back by did:handle, up to the report's limit")
 
 class SnapshotReport(BaseModel):
     """Complete report for a snapshot"""
     stats: FollowerStats = Field(..., description="Stats for followers")
     new_followers: dict[str, str] = Field(..., description="List of new followers by did:handle")
     unfollowers: dict[str, str] = Field(..., description="List of users who unfollowed by did:handle")
+    renamed: dict[str, tuple[str, str]] = Field(default_factory=dict, description="Followers who changed handle by did:(previous handle, handle)")
     follows_count: int = Field(..., ge=0, description="Number of follows account has")
+    relationships: Optional[Relationships] = Field(default=None, description="Mutuals and one-way follows, None if follows weren't collected")
 
-class AnalyticsService:
-    """Service for analyzing follower data"""
+class ChurnPoint(BaseModel):
+    """Followers gained and lost at one snapshot"""
+    snapshot_id: int
+    timestamp: str
+    followers: int = Field(..., ge=0, description="Followers in the snapshot")
+    gained: int = Field(..., ge=0, description="Followers not in the previous snapshot")
+    lost: int = Field(..., ge=0, description="Followers of the previous snapshot no longer following")
+    churn_rate: float = Field(..., ge=0, description="Share of the previous snapshot's followers lost")
+
+class CohortRetention(BaseModel):
+    """How long the followers first seen in one snapshot kept following"""
+    snapshot_id: int = Field(..., description="Snapshot the cohort was first seen in")
+    timestamp: str
+    size: int = Field(..., ge=0, description="Followers in the cohort")
+    retained: list[int] = Field(..., description="Cohort followers still following 0, 1, 2... snapshots later")
+    retention: list[float] = Field(..., description="retained as a share of the cohort size")
+
+class CohortReport(BaseModel):
+    """Churn, retention and returning followers across an account's snapshot history"""
+    churn: list[ChurnPoint] = Field(default_factory=list)
+    cohorts: list[CohortRetention] = Field(default_factory=list)
+    returning: dict[str, str] = Field(default_factory=dict, description="Current followers who left and came back by did:handle")
+
+def to_epoch_seconds(last_posted_at: str) -> float:
+    """Parse an ISO 8601 timestamp to epoch seconds, treating naive times as UTC"""
+    posted_at = datetime.fromisoformat(last_posted_at)
+    if posted_at.tzinfo is None:
+        posted_at = posted_at.replace(tzinfo=timezone.utc)
+    return posted_at.timestamp()
+
+class ActivityHistogram:
+    """Counts of followers by how long ago they last posted
+
+    Cutoffs are worked out once from a fixed reference time, so every
+    follower of a run is measured against the same moment, and each
+    follower costs one parse and one binary search over the cutoffs however
+    many windows there are.
+    """
+
+    def __init__(self, windows: Iterable[int] = ACTIVITY_WINDOWS, now: Optional[float] = None):
+        self.windows = sorted(set(windows))
+        self.now = time.time() if now is None else now
+        # Oldest cutoff first; a post after cutoffs[i] falls inside windows[-1 - i]
+        self.cutoffs = [self.now - days * SECONDS_PER_DAY for days in reversed(self.windows)]
+        # bins[0] posted before every cutoff, bins[-1] within the shortest window
+        self.bins = [0] * (len(self.windows) + 1)
+
+    def add(self, timestamps: array):
+        """Bin a column of last-post times in epoch seconds"""
+        bins = self.bins
+        cutoffs = self.cutoffs
+        for timestamp in timestamps:
+            bins[bisect_left(cutoffs, timestamp)] += 1
+
+    def within(self, days: int) -> int:
+        """Followers who posted within one of the histogram's windows"""
+        index = len(self.windows) - self.windows.index(days)
+        return sum(self.bins[index:])
+
+    def counts(self) -> dict[str, int]:
+        """Followers who posted within each window, keyed by days"""
+        return {str(days): self.within(days) for days in self.windows}
+
+class Stratum:
+    """Running counts for one stretch of the follower list"""
+    __slots__ = ("followers", "sampled", "enabled", "ghost", "histogram")
+
+    def __init__(self, histogram: ActivityHistogram):
+        self.followers = 0  # Every follower seen in the stratum
+        self.sampled = 0  # Followers whose activity was looked up
+        self.enabled = 0
+        self.ghost = 0
+        self.histogram = histogram
+
+class StatsAccumulator:
+    """Folds follower pages into running statistics
+
+    Only counts are kept, so memory stays constant however many followers
+    are added.
+
+    Followers skipped by sampling are counted but not classified. Counts
+    are kept per stratum of stratum_size followers, in list order, and each
+    stratum's sampled shares are scaled up to the stratum, so every follow
+    age weighs in by its size whatever its luck in the draw. When every
+    follower was looked up the estimates are the exact counts.
+    """
+
+    def __init__(self, now: Optional[float] = None, stratum_size: Optional[int] = None):
+        self.now = time.time() if now is None else now
+        # The configured activity window is always one of the histogram's
+        self.windows = sorted({*ACTIVITY_WINDOWS, config.ACTIVITY_WINDOW_DAYS})
+        self.stratum_size = stratum_size
+        self.position = 0
+        self.strata: list[Stratum] = []
+
+    @classmethod
+    def for_followers(cls, total_followers: int, now: Optional[float] = None) -> "StatsAccumulator":
+        """Accumulator splitting an account's followers into SAMPLE_STRATA strata"""
+        return cls(now, stratum_size=max(ceil(total_followers / SAMPLE_STRATA), 1))
+
+    def _stratum(self) -> tuple[Stratum, float]:
+        """Stratum of the next follower, and the position at which it ends"""
+        index = self.position // self.stratum_size if self.stratum_size else 0
+        while len(self.strata) <= index:
+            self.strata.append(Stratum(ActivityHistogram(self.windows, self.now)))
+        end = (index + 1) * self.stratum_size if self.stratum_size else float("inf")
+        return self.strata[index], end
+
+    @property
+    def estimated(self) -> bool:
+        """Some followers were skipped by sampling"""
+        return any(stratum.sampled < stratum.followers for stratum in self.strata)
+
+    @property
+    def sample_size(self) -> int:
+        return sum(stratum.sampled for stratum in self.strata)
+
+    @property
+    def enabled_count(self) -> int:
+        return round(self._estimate(lambda stratum: stratum.enabled)[0])
+
+    @property
+    def ghost_count(self) -> int:
+        return round(self._estimate(lambda stratum: stratum.ghost)[0])
+
+    @property
+    def active_count(self) -> int:
+        return round(self._estimate(self._active)[0])
+
+    @property
+    def inactive_count(self) -> int:
+        return round(self._estimate(self._inactive)[0])
 
     @staticmethod
-    def calculate_stats(total_followers: int, followers: list[FollowerData]) -> FollowerStats:
-        """Calculate statistics from follower data"""
-        enabled_count = len(followers)
-        disabled_count = total_followers - enabled_count
-        active_count = 0
-        ghost_count = 0
+    def _active(stratum: Stratum) -> int:
+        return stratum.histogram.within(config.ACTIVITY_WINDOW_DAYS)
 
+    @staticmethod
+    def _inactive(stratum: Stratum) -> int:
+        return stratum.enabled - stratum.ghost - StatsAccumulator._active(stratum)
+
+    def add(self, followers: Iterable[FollowerData | FollowerRecord]):
+        """Fold a page of followers into the running counts
+
+        Disabled accounts and posts counts come from the batched profile
+        lookups, so ghosts are accounts with no posts at all, while accounts
+        that posted outside the activity window count as inactive.
+        """
+        stratum = None
+        end = 0
+        timestamps = array("d")
         for follower in followers:
-            if follower.last_posted_at:
-                if is_active_in_window(follower.last_posted_at, config.ACTIVITY_WINDOW_DAYS):
-                    active_count += 1
-                else:
-                    ghost_count += 1
-        
+            if self.position >= end:
+                if stratum:
+                    stratum.histogram.add(timestamps)
+                    timestamps = array("d")
+                stratum, end = self._stratum()
+
+            self.position += 1
+            stratum.followers += 1
+            if not follower.sampled:
+                continue
+
+            stratum.sampled += 1
+            if follower.disabled:
+                continue
+
+            stratum.enabled += 1
+
+            if follower.posts_count == 0 or not follower.last_posted_at:
+                stratum.ghost += 1
+            else:
+                timestamps.append(to_epoch_seconds(follower.last_posted_at))
+
+        if stratum:
+            stratum.histogram.add(timestamps)
+
+    def _estimate(self, count: Callable[[Stratum], int]) -> tuple[float, float]:
+        """Estimated total of a count over sampled followers, and its variance
+
+        Each stratum's sampled share is scaled to the stratum's size, with
+        the finite population correction, so fully looked-up strata add
+        their exact count and no variance. A stratum with nobody sampled
+        borrows the share of the whole sample.
+        """
+        sampled = self.sample_size
+        overall = sum(count(stratum) for stratum in self.strata) / sampled if sampled else 0.0
+
+        total = 0.0
+        variance = 0.0
+        for stratum in self.strata:
+            if not stratum.sampled:
+                total += overall * stratum.followers
+                continue
+
+            share = count(stratum) / stratum.sampled
+            total += share * stratum.followers
+            if 1 < stratum.sampled < stratum.followers:
+                variance += (
+                    stratum.followers ** 2 * (1 - stratum.sampled / stratum.followers)
+                    * share * (1 - share) / (stratum.sampled - 1)
+                )
+        return total, variance
+
+    def to_dict(self) -> dict:
+        """Running counts, for checkpointing an in-progress snapshot"""
+        return {
+            "now": self.now,
+            "windows": self.windows,
+            "stratum_size": self.stratum_size,
+            "position": self.position,
+            "strata": [
+                {
+                    "followers": stratum.followers,
+                    "sampled": stratum.sampled,
+                    "enabled": stratum.enabled,
+                    "ghost": stratum.ghost,
+                    "bins": stratum.histogram.bins,
+                }
+                for stratum in self.strata
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, counts: dict) -> "StatsAccumulator":
+        """Restore running counts saved with to_dict
+
+        The restored accumulator keeps the reference time of the run that
+        started the snapshot, so a resumed snapshot is measured consistently.
+        """
+        accumulator = cls(now=counts.get("now"), stratum_size=counts.get("stratum_size"))
+        accumulator.position = counts.get("position", 0)
+
+        # Counts saved before strata were kept cover one exact stratum
+        saved_strata = counts.get("strata")
+        if saved_strata is None:
+            enabled = counts.get("enabled_count", 0)
+            saved_strata = [{"followers": enabled, "sampled": enabled, "enabled": enabled,
+                             "ghost": counts.get("ghost_count", 0), **counts}]
+            accumulator.position = enabled
+
+        for saved in saved_strata:
+            stratum = Stratum(ActivityHistogram(accumulator.windows, accumulator.now))
+            stratum.followers = saved["followers"]
+            stratum.sampled = saved["sampled"]
+            stratum.enabled = saved["enabled"]
+            stratum.ghost = saved["ghost"]
+            accumulator._restore_bins(stratum.histogram, counts.get("windows"), saved)
+            accumulator.strata.append(stratum)
+        return accumulator
+
+    @staticmethod
+    def _restore_bins(histogram: ActivityHistogram, windows: Optional[list[int]], saved: dict):
+        if windows == histogram.windows:
+            histogram.bins = list(saved["bins"])
+            return
+
+        # Counts saved by an older version, or under another activity window, can't be
+        # split exactly; file each group just inside the oldest edge of its range
+        if "bins" in saved:
+            previous = ActivityHistogram(windows, histogram.now)
+            edges = [previous.cutoffs[0] - 1] + [cutoff + 1 for cutoff in previous.cutoffs]
+            groups = zip(edges, saved["bins"])
+        else:
+            cutoff = histogram.now - config.ACTIVITY_WINDOW_DAYS * SECONDS_PER_DAY
+            groups = [(cutoff + 1, saved.get("active_count", 0)), (cutoff - 1, saved.get("inactive_count", 0))]
+        for edge, count in groups:
+            histogram.bins[bisect_left(histogram.cutoffs, edge)] += count
+
+    def result(self, total_followers: int) -> FollowerStats:
+        """Final statistics for an account with total_followers followers
+
+        Estimated statistics carry 95% confidence intervals, as percentages
+        of total_followers, for the active, inactive, ghost and disabled
+        counts.
+        """
+        enabled, enabled_variance = self._estimate(lambda stratum: stratum.enabled)
+        ghost, ghost_variance = self._estimate(lambda stratum: stratum.ghost)
+        active, active_variance = self._estimate(self._active)
+        inactive, inactive_variance = self._estimate(self._inactive)
+
+        disabled_count = max(total_followers - round(enabled), 0)
+        active_count = round(active)
+        ghost_count = round(ghost)
         active_percentage = (active_count / total_followers) * 100 if total_followers > 0 else 0
 
+        activity = {
+            str(days): round(self._estimate(lambda stratum: stratum.histogram.within(days))[0])
+            for days in self.windows
+        }
+
+        intervals = {}
+        if self.estimated:
+            intervals = {
+                "active": _interval(active, active_variance, total_followers),
+                "inactive": _interval(inactive, inactive_variance, total_followers),
+                "ghost": _interval(ghost, ghost_variance, total_followers),
+                # Disabled followers are the ones not estimated to be enabled
+                "disabled": _interval(total_followers - enabled, enabled_variance, total_followers),
+            }
+
         return FollowerStats(
             total_followers=total_followers,
-            enabled_count=enabled_count,
+            enabled_count=round(enabled),
             disabled_count=disabled_count,
             active_count=active_count,
+            inactive_count=max(round(inactive), 0),
             ghost_count=ghost_count,
-            active_percentage=active_percentage
+            active_percentage=active_percentage,
+            activity={**activity, "never_posted": ghost_count},
+            estimated=self.estimated,
+            sample_size=self.sample_size,
+            intervals=intervals
         )
 
+def _interval(count: float, variance: float, total_followers: int) -> tuple[float, float]:
+    """95% confidence interval of an estimated count, as percentages of total_followers"""
+    if total_followers <= 0:
+        return 0.0, 0.0
+    margin = CONFIDENCE_Z * sqrt(variance)
+    lower = max(count - margin, 0) / total_followers * 100
+    upper = min(count + margin, total_followers) / total_followers * 100
+    return round(lower, 2), round(upper, 2)
+
+class AnalyticsService:
+    """Service for analyzing follower data"""
+
+    @staticmethod
+    def calculate_stats(
+            total_followers: int,
+            followers: list[FollowerData | FollowerRecord],
+            sample: Optional[ActivitySample] = None
+    ) -> FollowerStats:
+        """Calculate statistics from follower data
+
+        Followers fetched with sampling are estimated from the sampled ones.
+        Passing a sample estimates from just the followers it contains, as a
+        sampled snapshot would have.
+        """
+        accumulator = StatsAccumulator.for_followers(total_followers)
+        if sample:
+            followers = (
+                follower if follower.sampled and sample.contains(follower.did)
+                else FollowerRecord(did=follower.did, handle=follower.handle, sampled=False)
+                for follower in followers
+            )
+        accumulator.add(followers)
+        return accumulator.result(total_followers)
+
+    @staticmethod
+    def cohort_report(db: Database, account_handle: str, max_cohorts: int = 12) -> CohortReport:
+        """Churn at every snapshot, retention of the latest max_cohorts follow cohorts and returning followers"""
+        report = cohorts.report(db, account_handle, max_cohorts)
+        return CohortReport(
+            churn=report["churn"],
+            cohorts=report["cohorts"],
+            returning=dict(db.get_followers_by_id(report["returning"]).values())
+        )
+
+    @staticmethod
+    def relationships(db: Database, snapshot_id: int, limit: int = 1000) -> Optional[Relationships]:
+        """Mutuals, followers not followed back and accounts not following back at a snapshot
+
+        Counts are exact; each list holds up to limit accounts. None if the
+        snapshot's follows were not stored.
+        """
+        report = cohorts.relationship_report(db, snapshot_id, limit)
+        return Relationships(**report) if report else None
+
     @staticmethod
     def format_report(report: SnapshotReport) -> str:
         """Format a report as a string"""
-        lines = [
-            "=" * 50,
-            "FOLLOWER REPORT",
-            "=" * 50,
-            "",
-            f"Total Followers: {report.stats.total_followers}",
-            f"Follows: {report.follows_count}",
-            "",
-            "=" * 50,
-            "FOLLOWER BREAKDOWN",
-            "=" * 50,
-            f"Enabled Accounts: {report.stats.enabled_count}",
-            f"Disabled Accounts: {report.stats.disabled_count}",
-            f"Active (posted in last {config.ACTIVITY_WINDOW_DAYS} days): {report.stats.active_count}",
-            f"Active Percentage: {report.stats.active_percentage:.2f}%",
-            f"Never Posted: {report.stats.ghost_count}",
-            "",
-        ]
-
-        if report.new_followers:
-            lines.extend([
-                "=" * 50,
-                f"NEW FOLLOWERS ({len(report.new_followers)})",
-                "=" * 50,
-            ])
-            for did, handle in report.new_followers.items():
-                lines.append(f"  + {handle}")
-            lines.append("")
-
-        if report.new_followers:
-            lines.extend([
-                "=" * 50,
-                f"UNFOLLOWS ({len(report.unfollowers)})",
-                "=" * 50,
-            ])
-            for did, handle in report.unfollowers.items():
-                lines.append(f"  - {handle}")
-            lines.append("")
-
-        if not report.new_followers and not report.unfollowers:
-            lines.extend([
-                "=" * 50,
-                "CHANGES",
-                "=" * 50,
-                "No new followers or unfollows since last snapshot.",
-                ""
-            ])
-        
-        return "\n".join(lines)
+        return report_format.format_report(report.model_dump(), config.ACTIVITY_WINDOW_DAYS)
 
     @staticmethod
     def print_report(report: SnapshotReport):
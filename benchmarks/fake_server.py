@@ -0,0 +1,346 @@
+"""Local stand-in for the Bluesky XRPC endpoints the tracker uses
+
+Serves app.bsky.actor.getProfile, app.bsky.actor.getProfiles,
+app.bsky.graph.getFollowers, app.bsky.graph.getFollows and
+app.bsky.feed.getAuthorFeed for a
+synthetic account whose followers are generated on the fly, so graphs of
+any size cost no memory. Every response waits `latency` seconds and
+carries ratelimit-* headers, like the real service, and failures can be
+injected ahead of the next responses with inject(). Any handle and
+password can log in with com.atproto.server.createSession, and sessions
+are refreshed with com.atproto.server.refreshSession.
+
+    python -m benchmarks.fake_server --followers 100000 --latency 0.05
+    BSKY_SERVICE_URL=http://127.0.0.1:2583 python main.py
+"""
+import argparse
+import base64
+import json
+import math
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional
+from urllib.parse import urlparse, parse_qs
+
+TARGET_DID = "did:plc:benchmarktarget0000000000"
+TARGET_HANDLE = "target.bench.test"
+
+# Followed accounts that never follow back are numbered from here, clear of any follower
+NON_FOLLOWER_START = 10 ** 12
+
+# Account every session belongs to, whatever handle logged in
+SESSION_DID = "did:plc:benchmarksession00000000"
+
+# A syntactically valid CID for the synthetic posts
+POST_CID = "bafyreie5737gdxlw5i64vzichcalba3z2v5n6icifvx5xytvske7mr3hpm"
+
+class FakeGraph:
+    """Deterministic synthetic followers of one account
+
+    Follower i is disabled if i % 10 == 9, has never posted if i % 10 == 3,
+    and otherwise last posted (i * 7) % 60 days ago, so about 60% of
+    followers are active in a 31 day window. Each generation drops the
+    oldest `churn` followers, adds as many new ones and renames one in
+    fifty, to give consecutive snapshots something to diff.
+
+    The account follows `follows_count` accounts: half are its oldest
+    current followers, and half never follow it back.
+    """
+
+    def __init__(self, size: int, churn: float = 0.01, generation: int = 0, follows_count: int = 150):
+        self.size = size
+        self.churn = churn
+        self.generation = generation
+        self.follows_count = follows_count
+        self.now = datetime.now(timezone.utc)
+
+    @property
+    def start(self) -> int:
+        return self.generation * int(self.size * self.churn)
+
+    def did(self, i: int) -> str:
+        return f"did:plc:{i:024d}"
+
+    def index(self, did: str) -> Optional[int]:
+        try:
+            return int(did.rsplit(":", 1)[-1])
+        except ValueError:
+            return None
+
+    def handle(self, i: int) -> str:
+        renamed = self.generation if i % 50 == 0 else 0
+        return f"user{i}-{renamed}.bench.test" if renamed else f"user{i}.bench.test"
+
+    def disabled(self, i: int) -> bool:
+        return i % 10 == 9
+
+    def posts_count(self, i: int) -> int:
+        return 0 if i % 10 == 3 else 1 + i % 500
+
+    def last_posted_at(self, i: int) -> str:
+        posted_at = self.now - timedelta(days=(i * 7) % 60, minutes=i % 1440)
+        return posted_at.isoformat().replace("+00:00", "Z")
+
+    def followers(self, cursor: int, limit: int) -> tuple[list[int], Optional[int]]:
+        """Follower indexes of one page, and the cursor of the next"""
+        first = self.start + cursor
+        last = min(self.start + self.size, first + limit)
+        next_cursor = cursor + limit if last < self.start + self.size else None
+        return list(range(first, last)), next_cursor
+
+    def follows(self, cursor: int, limit: int) -> tuple[list[int], Optional[int]]:
+        """Indexes of the accounts followed on one page, and the cursor of the next"""
+        last = min(self.follows_count, cursor + limit)
+        follows = [self.start + j // 2 if j % 2 == 0 else NON_FOLLOWER_START + j for j in range(cursor, last)]
+        return follows, last if last < self.follows_count else None
+
+    def profile_view(self, i: int) -> dict:
+        return {"did": self.did(i), "handle": self.handle(i), "displayName": f"User {i}"}
+
+class FakeAtprotoServer:
+    """Threaded HTTP server for a FakeGraph, usable as a context manager"""
+
+    def __init__(
+            self,
+            graph: FakeGraph,
+            latency: float = 0.0,
+            rate_limit: int = 3000,
+            window: float = 300.0,
+            host: str = "127.0.0.1",
+            port: int = 0,
+            token_ttl: float = 7200.0
+    ):
+        self.graph = graph
+        self.token_ttl = token_ttl
+        self.logins = 0
+        self.refreshes = 0
+        self.session_handle = None
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.window = window
+        self.requests = 0
+        self.rate_limited = 0
+        self.faults = deque()
+        self._lock = threading.Lock()
+        self._window_start = time.time()
+        self._window_count = 0
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeAtprotoServer":
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.stop()
+
+    def inject(self, *faults):
+        """Answer the next requests with these faults, in order
+
+        A fault is an HTTP status to answer with, or "disconnect" to close
+        the connection without answering.
+        """
+        with self._lock:
+            self.faults.extend(faults)
+
+    def _next_fault(self):
+        with self._lock:
+            return self.faults.popleft() if self.faults else None
+
+    def _spend(self) -> tuple[int, float]:
+        """Count a request against the current window, returning (remaining, reset time)"""
+        with self._lock:
+            now = time.time()
+            if now - self._window_start >= self.window:
+                self._window_start = now
+                self._window_count = 0
+            self._window_count += 1
+            self.requests += 1
+            remaining = self.rate_limit - self._window_count
+            if remaining < 0:
+                self.rate_limited += 1
+            return remaining, self._window_start + self.window
+
+    def session(self, handle: str) -> dict:
+        """Access and refresh tokens for a new session; only their expiry is ever read"""
+        now = int(time.time())
+
+        def token(scope: str, ttl: float) -> str:
+            parts = [{"alg": "HS256", "typ": "JWT"}, {"scope": scope, "sub": SESSION_DID, "iat": now, "exp": now + int(ttl)}]
+            encoded = (base64.urlsafe_b64encode(json.dumps(part).encode()).rstrip(b"=").decode() for part in parts)
+            return ".".join([*encoded, "c2lnbmF0dXJl"])
+
+        self.session_handle = handle
+        return {
+            "did": SESSION_DID,
+            "handle": handle,
+            "accessJwt": token("com.atproto.access", self.token_ttl),
+            "refreshJwt": token("com.atproto.refresh", self.token_ttl * 10),
+        }
+
+    def respond_post(self, method: str, body: dict) -> tuple[int, dict]:
+        if method == "com.atproto.server.createSession":
+            with self._lock:
+                self.logins += 1
+            return 200, self.session(body["identifier"])
+
+        if method == "com.atproto.server.refreshSession":
+            with self._lock:
+                self.refreshes += 1
+            return 200, self.session(self.session_handle or "benchmark.test")
+
+        return 501, {"error": "MethodNotImplemented", "message": f"{method} is not implemented"}
+
+    def respond(self, method: str, params: dict) -> tuple[int, dict]:
+        graph = self.graph
+        if method == "app.bsky.actor.getProfile":
+            actor = params["actor"][0]
+            if actor in (SESSION_DID, self.session_handle):
+                return 200, {"did": SESSION_DID, "handle": self.session_handle, "followersCount": 0, "followsCount": 0}
+            if actor in (TARGET_DID, TARGET_HANDLE):
+                return 200, {
+                    "did": TARGET_DID,
+                    "handle": TARGET_HANDLE,
+                    "followersCount": graph.size,
+                    "followsCount": graph.follows_count,
+                }
+            i = graph.index(actor)
+            if i is None or graph.disabled(i):
+                return 400, {"error": "AccountDeactivated", "message": "Account is deactivated"}
+            return 200, {**graph.profile_view(i), "postsCount": graph.posts_count(i)}
+
+        if method == "app.bsky.actor.getProfiles":
+            profiles = []
+            for actor in params.get("actors", []):
+                i = graph.index(actor)
+                if i is not None and not graph.disabled(i):
+                    profiles.append({**graph.profile_view(i), "postsCount": graph.posts_count(i)})
+            return 200, {"profiles": profiles}
+
+        if method == "app.bsky.graph.getFollowers":
+            cursor = int(params.get("cursor", ["0"])[0])
+            limit = int(params.get("limit", ["50"])[0])
+            followers, next_cursor = graph.followers(cursor, limit)
+            body = {
+                "subject": {"did": TARGET_DID, "handle": TARGET_HANDLE},
+                "followers": [graph.profile_view(i) for i in followers],
+            }
+            if next_cursor is not None:
+                body["cursor"] = str(next_cursor)
+            return 200, body
+
+        if method == "app.bsky.graph.getFollows":
+            cursor = int(params.get("cursor", ["0"])[0])
+            limit = int(params.get("limit", ["50"])[0])
+            follows, next_cursor = graph.follows(cursor, limit)
+            body = {
+                "subject": {"did": TARGET_DID, "handle": TARGET_HANDLE},
+                "follows": [graph.profile_view(i) for i in follows],
+            }
+            if next_cursor is not None:
+                body["cursor"] = str(next_cursor)
+            return 200, body
+
+        if method == "app.bsky.feed.getAuthorFeed":
+            actor = params["actor"][0]
+            i = graph.index(actor)
+            if i is None or graph.disabled(i):
+                return 400, {"error": "AccountDeactivated", "message": "Account is deactivated"}
+            if graph.posts_count(i) == 0:
+                return 200, {"feed": []}
+            posted_at = graph.last_posted_at(i)
+            return 200, {"feed": [{"post": {
+                "uri": f"at://{actor}/app.bsky.feed.post/{i}",
+                "cid": POST_CID,
+                "author": graph.profile_view(i),
+                "record": {"$type": "app.bsky.feed.post", "text": "benchmark", "createdAt": posted_at},
+                "indexedAt": posted_at,
+            }}]}
+
+        return 501, {"error": "MethodNotImplemented", "message": f"{method} is not implemented"}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                self.reply(url.path.rsplit("/", 1)[-1], lambda method: server.respond(method, parse_qs(url.query)))
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                self.reply(urlparse(self.path).path.rsplit("/", 1)[-1], lambda method: server.respond_post(method, body))
+
+            def reply(self, method: str, respond):
+                remaining, reset_at = server._spend()
+                fault = server._next_fault()
+
+                if server.latency:
+                    time.sleep(server.latency)
+
+                if fault == "disconnect":
+                    self.close_connection = True
+                    return
+                if fault is not None:
+                    status, body = fault, {"error": "InjectedFault", "message": f"Injected {fault} response"}
+                elif remaining < 0:
+                    status, body = 429, {"error": "RateLimitExceeded", "message": "Rate Limit Exceeded"}
+                else:
+                    status, body = respond(method)
+
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.send_header("ratelimit-limit", str(server.rate_limit))
+                self.send_header("ratelimit-remaining", str(max(remaining, 0)))
+                # Whole seconds like the real service, rounded up so the window never resets later than told
+                self.send_header("ratelimit-reset", str(math.ceil(reset_at)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a synthetic follower graph over XRPC")
+    parser.add_argument("--followers", type=int, default=10_000)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before each response")
+    parser.add_argument("--rate-limit", type=int, default=3000, help="Requests allowed per window")
+    parser.add_argument("--window", type=float, default=300.0, help="Rate limit window in seconds")
+    parser.add_argument("--generation", type=int, default=0, help="Churn the graph this many times")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2583)
+    args = parser.parse_args()
+
+    graph = FakeGraph(args.followers, generation=args.generation)
+    server = FakeAtprotoServer(graph, args.latency, args.rate_limit, args.window, args.host, args.port)
+    print(f"Serving {args.followers:,} followers of {TARGET_HANDLE} ({TARGET_DID}) on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
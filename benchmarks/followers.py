@@ -0,0 +1,91 @@
+"""Benchmark the memory and build cost of follower representations
+
+Builds every follower of a synthetic account as a validated FollowerData
+model and as a compact FollowerRecord, the way the fetch loop does, and
+reports build throughput, memory held per follower (measured with
+tracemalloc, including the strings each follower owns) and the throughput
+of folding the list into statistics.
+
+    python -m benchmarks.followers --sizes 100000 1000000
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+# Benchmarks run offline, so any credentials will do
+os.environ.setdefault("BSKY_HANDLE", "benchmark.test")
+os.environ.setdefault("BSKY_APP_PASSWORD", "benchmark")
+os.environ.setdefault("BSKY_TARGET_HANDLE", "target.bench.test")
+
+from bluesky_service import FollowerData, FollowerRecord
+from analytics import StatsAccumulator
+
+def build_models(size: int) -> list[FollowerData]:
+    followers = []
+    for i in range(size):
+        follower = FollowerData(did=f"did:plc:{i:024d}", handle=f"user{i}.bsky.social", display_name=f"User {i}")
+        follower.posts_count = i % 500
+        if follower.posts_count:
+            follower.last_posted_at = f"2024-05-{1 + i % 28:02d}T12:00:00.000Z"
+        followers.append(follower)
+    return followers
+
+def build_records(size: int) -> list[FollowerRecord]:
+    followers = []
+    for i in range(size):
+        follower = FollowerRecord(did=f"did:plc:{i:024d}", handle=sys.intern(f"user{i}.bsky.social"),
+                                  display_name=f"User {i}")
+        follower.posts_count = i % 500
+        if follower.posts_count:
+            follower.last_posted_at = f"2024-05-{1 + i % 28:02d}T12:00:00.000Z"
+        followers.append(follower)
+    return followers
+
+REPRESENTATIONS = {
+    "FollowerData": build_models,
+    "FollowerRecord": build_records,
+}
+
+def measure(build, size: int) -> dict:
+    gc.collect()
+    started = time.perf_counter()
+    followers = build(size)
+    build_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    StatsAccumulator().add(followers)
+    stats_seconds = time.perf_counter() - started
+    del followers
+
+    gc.collect()
+    tracemalloc.start()
+    followers = build(size)
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del followers
+
+    return {
+        "build_per_second": size / build_seconds,
+        "stats_per_second": size / stats_seconds,
+        "bytes_per_follower": held / size,
+        "total_mib": held / 2 ** 20,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark follower representations")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    args = parser.parse_args()
+
+    print(f"{'followers':>10}  {'representation':<16} {'built/s':>10} {'stats/s':>10} {'bytes each':>11} {'total MiB':>10}")
+    for size in args.sizes:
+        for name, build in REPRESENTATIONS.items():
+            result = measure(build, size)
+            print(f"{size:>10,}  {name:<16} {result['build_per_second']:>10,.0f} {result['stats_per_second']:>10,.0f} "
+                  f"{result['bytes_per_follower']:>11,.0f} {result['total_mib']:>10,.1f}")
+
+
+if __name__ == "__main__":
+    main()
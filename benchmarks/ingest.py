@@ -0,0 +1,76 @@
+"""Benchmark snapshot ingest throughput
+
+Writes synthetic snapshots of each size into a scratch database and
+reports followers per second for the first snapshot of an account (every
+follower new) and for a follow-up snapshot (1% churn, 5% of followers
+with a new last post date), for each write strategy.
+
+    python -m benchmarks.ingest --sizes 10000 100000 1000000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import database
+from database import Database
+
+STRATEGIES = {
+    "batches of 100, default pragmas": {"chunk_size": 100, "commit_chunks": True, "default_pragmas": True},
+    "batches of 100": {"chunk_size": 100, "commit_chunks": True},
+    "bulk": {},
+    "bulk, deferred indexes": {"defer_indexes": True},
+}
+
+def followers(size: int, generation: int):
+    """Synthetic (did, handle, last_posted_at, display_name) rows; later generations churn a little"""
+    start = generation * size // 100
+    for i in range(start, start + size):
+        day = 1 + (i + (generation if i % 20 == 0 else 0)) % 28
+        yield f"did:plc:{i:024d}", f"user{i}.bsky.social", f"2024-05-{day:02d}T12:00:00+00:00", f"User {i}"
+
+def write_snapshot(db: Database, size: int, generation: int, chunk_size: int = database.BULK_CHUNK_SIZE,
+                   commit_chunks: bool = False, defer_indexes: bool = False) -> tuple[float, float]:
+    """Write one snapshot, returning (ingest seconds, finalize seconds)"""
+    snapshot_id = db.create_snapshot("bench.bsky.social", size, 0, 0, 0, status="in_progress")
+
+    started = time.perf_counter()
+    if defer_indexes:
+        with db.deferred_indexes():
+            db.bulk_add_followers(snapshot_id, followers(size, generation), chunk_size, commit_chunks)
+    else:
+        db.bulk_add_followers(snapshot_id, followers(size, generation), chunk_size, commit_chunks)
+    db.conn.commit()
+    ingested = time.perf_counter()
+
+    db.close_memberships(snapshot_id)
+    db.save_snapshot_changes(snapshot_id)
+    db.complete_snapshot(snapshot_id)
+    return ingested - started, time.perf_counter() - ingested
+
+def run(size: int, strategy: dict, directory: str) -> list[tuple[float, float]]:
+    database.DB_PATH = os.path.join(directory, f"bench-{size}-{len(os.listdir(directory))}.db")
+    options = dict(strategy)
+    with Database() as db:
+        if options.pop("default_pragmas", False):
+            db.cur.execute("PRAGMA journal_mode=DELETE")
+            db.cur.execute("PRAGMA synchronous=FULL")
+            db.cur.execute("PRAGMA cache_size=-2000")
+        return [write_snapshot(db, size, generation, **options) for generation in range(2)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark snapshot ingest throughput")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--strategies", nargs="+", choices=list(STRATEGIES), default=list(STRATEGIES))
+    args = parser.parse_args()
+
+    print(f"{'followers':>10}  {'strategy':<32} {'first rows/s':>13} {'next rows/s':>12} {'finalize s':>11}")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            for name in args.strategies:
+                (first, _), (second, finalize) = run(size, STRATEGIES[name], directory)
+                print(f"{size:>10,}  {name:<32} {size / first:>13,.0f} {size / second:>12,.0f} {finalize:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
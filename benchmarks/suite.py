@@ -0,0 +1,168 @@
+"""End-to-end benchmarks against a local fake AT Protocol server
+
+Each run starts a FakeAtprotoServer, then for every graph size times:
+- BlueskyService.fetch_all_followers over HTTP, including activity lookups
+- AnalyticsService.calculate_stats on the fetched followers
+- SnapshotService.create_snapshot for the first snapshot and a churned one
+- Database.get_follower_changes for the churned snapshot
+
+Results are written as JSON, and two result files can be compared:
+
+    python -m benchmarks.suite run --sizes 1000 10000 --latency 0.01 --output after.json
+    python -m benchmarks.suite compare before.json after.json
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from benchmarks.fake_server import FakeAtprotoServer, FakeGraph, TARGET_DID
+
+# Benchmarks run offline, so any credentials will do
+os.environ.setdefault("BSKY_HANDLE", "benchmark.test")
+os.environ.setdefault("BSKY_APP_PASSWORD", "benchmark")
+os.environ.setdefault("BSKY_TARGET_HANDLE", "target.bench.test")
+
+import database
+from config import config
+from database import Database
+from bluesky_service import BlueskyService, FollowerData
+from analytics import AnalyticsService
+from snapshot_service import SnapshotService
+
+def graph_followers(graph: FakeGraph) -> list[FollowerData]:
+    """The followers fetch_all_followers would return for a graph, without the HTTP"""
+    followers = []
+    cursor = 0
+    while cursor is not None:
+        page, cursor = graph.followers(cursor, 100)
+        for i in page:
+            follower = FollowerData(did=graph.did(i), handle=graph.handle(i), display_name=f"User {i}")
+            if graph.disabled(i):
+                follower.disabled = True
+            else:
+                follower.posts_count = graph.posts_count(i)
+                if follower.posts_count:
+                    follower.last_posted_at = graph.last_posted_at(i)
+            followers.append(follower)
+    return followers
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+def result(name: str, size: int, seconds: float, **extra) -> dict:
+    return {"name": name, "size": size, "seconds": round(seconds, 6),
+            "per_second": round(size / seconds, 1) if seconds else None, **extra}
+
+def run_size(size: int, latency: float, directory: str) -> list[dict]:
+    results = []
+    graph = FakeGraph(size)
+
+    with FakeAtprotoServer(graph, latency=latency, rate_limit=max(3000, size * 2)) as server:
+        config.BSKY_SERVICE_URL = server.url
+        bluesky = BlueskyService()
+        profile = bluesky.get_profile(TARGET_DID)
+
+        followers, seconds = timed(bluesky.fetch_all_followers, TARGET_DID)
+        results.append(result("fetch_all_followers", size, seconds, requests=server.requests))
+
+    stats, seconds = timed(AnalyticsService.calculate_stats, profile.followers_count, followers)
+    results.append(result("calculate_stats", size, seconds))
+
+    database.DB_PATH = os.path.join(directory, f"bench-{size}.db")
+    with Database() as db:
+        snapshot_service = SnapshotService(db)
+        _, seconds = timed(snapshot_service.create_snapshot, profile, followers, stats)
+        results.append(result("create_snapshot", size, seconds))
+
+        # A second snapshot with some churn, so there are changes to read
+        graph.generation = 1
+        churned = graph_followers(graph)
+        snapshot_id, seconds = timed(snapshot_service.create_snapshot, profile, churned, stats)
+        results.append(result("create_snapshot (repeat)", size, seconds))
+
+        changes, seconds = timed(db.get_follower_changes, snapshot_id)
+        results.append(result("get_follower_changes", size, seconds, changes=sum(len(c) for c in changes)))
+
+    return results
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    meta = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "latency": args.latency,
+        "fetch_concurrency": config.FETCH_CONCURRENCY,
+    }
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            for entry in run_size(size, args.latency, directory):
+                print(f"{entry['name']:<26} {size:>9,} {entry['seconds']:>10.3f}s {entry['per_second'] or 0:>12,.0f}/s")
+                results.append(entry)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2)
+    print(f"Results written to {args.output}")
+
+def compare(args) -> int:
+    """Print the change in time for every benchmark in both files; non-zero if any regressed"""
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = {(r["name"], r["size"]): r for r in json.load(f)["results"]}
+    with open(args.current, encoding="utf-8") as f:
+        current = {(r["name"], r["size"]): r for r in json.load(f)["results"]}
+
+    regressed = False
+    print(f"{'benchmark':<26} {'size':>9} {'before':>10} {'after':>10} {'change':>8}")
+    for key in [key for key in baseline if key in current]:
+        before, after = baseline[key]["seconds"], current[key]["seconds"]
+        change = (after - before) / before * 100 if before else 0.0
+        flag = ""
+        if change > args.threshold:
+            flag = "  REGRESSED"
+            regressed = True
+        print(f"{key[0]:<26} {key[1]:>9,} {before:>9.3f}s {after:>9.3f}s {change:>+7.1f}%{flag}")
+
+    return 1 if regressed else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the tracker against a local fake AT Protocol server")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks and write results to JSON")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000])
+    run_parser.add_argument("--latency", type=float, default=0.01, help="Seconds the fake server waits per request")
+    run_parser.add_argument("--output", default="benchmark-results.json")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=10.0,
+                                help="Percent slowdown reported as a regression")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,67 @@
 """Bluesky  API service layer"""
 import logging
+import os
+import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from dataclasses import dataclass
 from typing import Optional
 from datetime import datetime, timezone, timedelta
 from pydantic import BaseModel, Field
 
 from atproto import IdResolver, Client, models
+from atproto_client import exceptions
 
 from config import config
+from metrics import PhaseTimer, phase
+from rate_limiter import RateLimitController, RateLimitedRequest
+from sampling import ActivitySample
 
 logger = logging.getLogger(__name__)
 
+# app.bsky.actor.getProfiles accepts at most 25 actors per call
+PROFILES_BATCH_SIZE = 25
+
 class FollowerData(BaseModel):
     """Structured Follower data"""
     did: str = Field(..., description="AT Protocol DID")
     handle: str = Field(..., description="AT Protocol user handle")
     display_name: Optional[str] = Field(default=None, description="Display name of user")
     last_posted_at: Optional[str] = Field(default=None, description="Last time user posted")
+    posts_count: Optional[int] = Field(default=None, description="Number of posts user has made, if known")
+    disabled: bool = Field(default=False, description="Account is deleted, deactivated or suspended")
+    sampled: bool = Field(default=True, description="Activity was looked up, False when sampling skipped the follower")
+
+@dataclass(slots=True)
+class FollowerRecord:
+    """Compact follower used on the bulk fetch and snapshot path
+
+    Holds the same fields as FollowerData without validation or a
+    per-instance __dict__, and with interned handles, so hundreds of
+    thousands of them stay cheap to build and hold. Values come from API
+    responses that were already validated; to_model() gives the validated
+    FollowerData returned to callers.
+    """
+    did: str
+    handle: str
+    display_name: Optional[str] = None
+    last_posted_at: Optional[str] = None
+    posts_count: Optional[int] = None
+    disabled: bool = False
+    sampled: bool = True
+
+    def to_model(self) -> FollowerData:
+        return FollowerData(
+            did=self.did,
+            handle=self.handle,
+            display_name=self.display_name,
+            last_posted_at=self.last_posted_at,
+            posts_count=self.posts_count,
+            disabled=self.disabled,
+            sampled=self.sampled
+        )
 
 class ProfileStats(BaseModel):
     """Profile Statistics"""
@@ -29,12 +74,41 @@ class BlueskyService:
     """Service for interacting with Bluesky API"""
 
     def __init__(self):
-        self.client = Client()
+        # Every request made by the client goes through the shared rate limit controller
+        self.rate_limiter = RateLimitController(
+            fallback_rate=config.REQUESTS_PER_SECOND,
+            fallback_burst=config.REQUESTS_BURST,
+            max_retries=config.MAX_RETRIES,
+            base_delay=config.RETRY_DELAY
+        )
+        self.client = Client(base_url=config.BSKY_SERVICE_URL, request=RateLimitedRequest(self.rate_limiter))
         self.resolver = IdResolver()
         self._authenticated = False
+        self._session_lock = threading.Lock()
+        self._resolved = {}  # handle -> (did, monotonic time resolved)
+
+        # The client refreshes its tokens as they near expiry; keep every new session.
+        # Callbacks must be plain functions, bound methods are silently ignored.
+        self.client.on_session_change(lambda event, session: self._save_session(session.export()))
 
     def authenticate(self) -> bool:
-        """Authenticate with Bluesky"""
+        """Authenticate with Bluesky, resuming the saved session when there is one
+
+        createSession is tightly rate limited, so a password login is only
+        made when no session was saved in BSKY_SESSION_FILE, or it can no
+        longer be refreshed or belongs to another account.
+        """
+        session_string = self._load_session()
+        if session_string:
+            try:
+                self.client.login(session_string=session_string)
+                if self.client.me.handle == config.BSKY_HANDLE:
+                    self._authenticated = True
+                    logger.info(f"Resumed saved session for {config.BSKY_HANDLE}")
+                    return True
+            except Exception as e:
+                logger.info(f"Saved session could not be resumed, logging in again: {e}")
+
         try:
             self.client.login(login=config.BSKY_HANDLE, password=config.BSKY_APP_PASSWORD)
             self._authenticated = True
@@ -43,52 +117,110 @@ class BlueskyService:
         except Exception as e:
             logger.error(f"Authentication failed: {e}")
             return False
-        
+
+    def _load_session(self) -> Optional[str]:
+        if not config.BSKY_SESSION_FILE:
+            return None
+        try:
+            with open(config.BSKY_SESSION_FILE) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _save_session(self, session_string: str):
+        """Write the session to BSKY_SESSION_FILE, readable only by the owner"""
+        if not config.BSKY_SESSION_FILE:
+            return
+        with self._session_lock:
+            partial = f"{config.BSKY_SESSION_FILE}.tmp"
+            fd = os.open(partial, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                f.write(session_string)
+            os.replace(partial, config.BSKY_SESSION_FILE)
+        logger.debug("Saved session")
+
     def resolve_handle(self, handle: str) -> Optional[str]:
-        """Resolve AT protocol handle to a DID"""
+        """Resolve AT protocol handle to a DID
+
+        Resolutions are kept for HANDLE_CACHE_TTL_MINUTES, so a long-running
+        process doesn't resolve its tracked accounts again on every run.
+        """
+        cached = self._resolved.get(handle)
+        if cached and time.monotonic() - cached[1] < config.HANDLE_CACHE_TTL_MINUTES * 60:
+            return cached[0]
+
         try:
             did = self.resolver.handle.resolve(handle)
             logger.debug(f"Resolved {handle} to {did}")
-            return did
         except Exception as e:
             logger.error(f"Failed to resolve handle: {handle}")
             return None
 
+        if did:
+            self._resolved[handle] = (did, time.monotonic())
+        return did
+
     def get_profile(self, did: str) -> Optional[ProfileStats]:
         """Get profile information for a DID"""
-        for attempt in range(config.MAX_RETRIES):
-            try:
-                params = models.AppBskyActorGetProfile.Params(actor=did)
-                profile = self.client.app.bsky.actor.get_profile(params)
-
-                return ProfileStats(
-                    handle=profile.handle,
-                    did=profile.did,
-                    followers_count=profile.followers_count or 0,
-                    follows_count=profile.follows_count or 0
-                )
-            except Exception as e:
-                logger.warning(f"Attempt {attempt + 1}/{config.MAX_RETRIES} failed for profile {did}: {e}")
-                if attempt < config.MAX_RETRIES - 1:
-                    time.sleep(config.RETRY_DELAY)
-                else:
-                    logger.error(f"Failed to get profile for {did} after {config.MAX_RETRIES} attempts")
-                    return None    
-            
+        try:
+            params = models.AppBskyActorGetProfile.Params(actor=did)
+            profile = self.client.app.bsky.actor.get_profile(params)
+
+            return ProfileStats(
+                handle=profile.handle,
+                did=profile.did,
+                followers_count=profile.followers_count or 0,
+                follows_count=profile.follows_count or 0
+            )
+        except Exception as e:
+            logger.error(f"Failed to get profile for {did}: {e}")
+            return None
+
+    def get_profiles(self, dids: list[str]) -> Optional[dict]:
+        """Get detailed profiles for up to PROFILES_BATCH_SIZE DIDs, keyed by DID
+
+        Accounts that are deleted, deactivated or suspended are left out of
+        the response, so they are missing from the returned dict.
+        """
+        try:
+            params = models.AppBskyActorGetProfiles.Params(actors=dids)
+            response = self.client.app.bsky.actor.get_profiles(params)
+
+            return {profile.did: profile for profile in response.profiles}
+        except Exception as e:
+            logger.error(f"Failed to get {len(dids)} profiles: {e}")
+            return None
 
     def get_last_post(self, did: str) -> Optional[str]:
-        """Get the timestamp of the last post for a DID"""
+        """Get the timestamp of the last post for a DID
+
+        Returns None when the account has no posts or its feed is not
+        available to us (blocked or taken down). Any other failure is
+        raised, rather than being counted as an account that never posted.
+        """
         try:
             params = models.AppBskyFeedGetAuthorFeed.Params(actor=did, filter=None, limit=1)
             feed = self.client.app.bsky.feed.get_author_feed(params)
-
-            if feed and feed.feed:
-                return feed.feed[0].post.indexed_at
-            return None
-        except Exception as e:
-            logger.debug(f"Error getting last post for {did}: {e}")
+        except exceptions.BadRequestError as e:
+            logger.debug(f"Feed unavailable for {did}: {e}")
             return None
+
+        if feed and feed.feed:
+            return feed.feed[0].post.indexed_at
+        return None
     
+    def get_relationships(self, did: str, others: list[str]) -> dict:
+        """Map up to 30 DIDs to the URI of their follow record for did, or None if they don't follow it"""
+        params = models.AppBskyGraphGetRelationships.Params(actor=did, others=others)
+        response = self.client.app.bsky.graph.get_relationships(params)
+
+        relationships = {other: None for other in others}
+        for relationship in response.relationships:
+            # Accounts that no longer exist come back as NotFoundActor
+            if isinstance(relationship, models.AppBskyGraphDefs.Relationship):
+                relationships[relationship.did] = relationship.followed_by
+        return relationships
+
     def get_followers(self, did: str, cursor: Optional[str] = None, limit: int = 100):
         """Get followers for a DID with optional cursor for pagination"""
         try:
@@ -100,43 +232,184 @@ class BlueskyService:
             logger.error(f"Failed to get followers for {did}: {e}")
             raise
 
-    def fetch_all_followers(self, did: str, progress_callback=None) -> list[FollowerData]:
-        """Fetch all followers for a DID with progress tracking"""
-        all_followers = []
+    def get_follows(self, did: str, cursor: Optional[str] = None, limit: int = 100):
+        """Get the accounts a DID follows with optional cursor for pagination"""
+        try:
+            params = models.AppBskyGraphGetFollows.Params(actor=did, cursor=cursor, limit=limit)
+            return self.client.app.bsky.graph.get_follows(params)
+        except Exception as e:
+            logger.error(f"Failed to get follows for {did}: {e}")
+            raise
+
+    def iter_follows(self, did: str, timer: Optional[PhaseTimer] = None):
+        """Yield (FollowerRecords, next_cursor) for the accounts a DID follows, one page at a time
+
+        Only identities are kept; the activity of followed accounts is never
+        looked up. Time spent paginating is added to the timer's
+        fetch_follows phase. Like iter_followers, a page that cannot be
+        fetched raises.
+        """
         cursor = None
-        processed = 0
-         
         while True:
-            try:
-                # If we can't get the followers there's no work to do
-                followers = self.get_followers(did, cursor, config.REPORT_LIMIT)
-            except Exception as e:
-                logger.error(f"Failed to fetch followers: {e}")
+            with phase(timer, "fetch_follows"):
+                follows = self.get_follows(did, cursor, config.REPORT_LIMIT)
+
+            yield [
+                FollowerRecord(did=follow.did, handle=sys.intern(follow.handle), display_name=follow.display_name)
+                for follow in follows.follows
+            ], follows.cursor
+
+            if not follows.cursor:
                 break
 
-            processed += config.REPORT_LIMIT
+            cursor = follows.cursor
 
-            for follower in followers.followers:
-                last_posted_at = self.get_last_post(follower.did)
-                
-                follower_data = FollowerData(
-                    did=follower.did,
-                    handle=follower.handle,
-                    display_name=follower.display_name,
-                    last_posted_at=last_posted_at
-                )
+    def resolve_activity(self, followers, executor: ThreadPoolExecutor, on_resolved=None) -> list[FollowerRecord]:
+        """Resolve posting activity for a page of followers
 
-                all_followers.append(follower_data)
+        Posts counts come from batched profile lookups first. Ghost and
+        disabled accounts are settled from those alone, and only accounts
+        that have posted get an author feed lookup for their last post.
+        """
+        dids = [follower.did for follower in followers]
+        batches = [dids[i:i + PROFILES_BATCH_SIZE] for i in range(0, len(dids), PROFILES_BATCH_SIZE)]
 
-                if progress_callback:
-                    progress_callback(processed, len(all_followers))
+        profiles = {}
+        unresolved = set()
+        for batch, result in zip(batches, executor.map(self.get_profiles, batches)):
+            if result is None:
+                # Fall back to feed lookups for the whole batch
+                unresolved.update(batch)
+            else:
+                profiles.update(result)
 
-            if not followers.cursor:
-                break
+        resolved = []
+        lookups = {}
+        for follower in followers:
+            follower_data = FollowerRecord(
+                did=follower.did,
+                handle=sys.intern(follower.handle),
+                display_name=follower.display_name
+            )
+
+            if follower.did in unresolved:
+                lookups[executor.submit(self.get_last_post, follower.did)] = follower_data
+            elif follower.did not in profiles:
+                follower_data.disabled = True
+            else:
+                follower_data.posts_count = profiles[follower.did].posts_count or 0
+                if follower_data.posts_count > 0:
+                    lookups[executor.submit(self.get_last_post, follower.did)] = follower_data
+
+            if follower_data.disabled or follower_data.posts_count == 0:
+                if on_resolved:
+                    on_resolved()
+
+            resolved.append(follower_data)
+
+        for future in as_completed(lookups):
+            lookups[future].last_posted_at = future.result()
+            if on_resolved:
+                on_resolved()
+
+        return resolved
 
-            cursor = followers.cursor
-            time.sleep(config.RATE_LIMIT_DELAY)
+    def iter_followers(
+            self,
+            did: str,
+            progress_callback=None,
+            activity_cache=None,
+            cursor: Optional[str] = None,
+            executor: Optional[ThreadPoolExecutor] = None,
+            timer: Optional[PhaseTimer] = None,
+            sample: Optional[ActivitySample] = None
+    ):
+        """Yield (FollowerRecords, next_cursor) for a DID one resolved page at a time
 
+        Activity for each page is resolved on a pool of FETCH_CONCURRENCY
+        workers, all drawing from the same rate limiter; pass an executor to
+        share one pool between several accounts instead. When an activity
+        cache is given, only followers it cannot answer are looked up.
+        Passing a cursor from an earlier run resumes pagination there.
+        Time spent paginating, in the cache and on lookups is added to the
+        timer's fetch_followers, activity_cache and activity_lookups phases.
+
+        With a sample, only sampled followers have their activity resolved;
+        the rest are yielded with sampled=False and whatever activity the
+        cache last knew for them.
+
+        A page that cannot be fetched raises rather than ending the
+        iteration early, so callers never mistake a partial list for a
+        complete one.
+        """
+        processed = 0
+        completed = 0
+
+        def on_resolved():
+            nonlocal completed
+            completed += 1
+            if progress_callback:
+                progress_callback(processed, completed)
+
+        pool = nullcontext(executor) if executor else ThreadPoolExecutor(max_workers=config.FETCH_CONCURRENCY)
+        with pool as executor:
+            while True:
+                with phase(timer, "fetch_followers"):
+                    followers = self.get_followers(did, cursor, config.REPORT_LIMIT)
+
+                processed += config.REPORT_LIMIT
+
+                page = followers.followers
+                skipped = []
+                if sample:
+                    page, skipped = sample.split(page)
+                    if activity_cache:
+                        with phase(timer, "activity_cache"):
+                            skipped = activity_cache.known(skipped)
+                    else:
+                        skipped = [
+                            FollowerRecord(did=follower.did, handle=sys.intern(follower.handle),
+                                           display_name=follower.display_name, sampled=False)
+                            for follower in skipped
+                        ]
+                    for _ in skipped:
+                        on_resolved()
+
+                cached = []
+                if activity_cache:
+                    with phase(timer, "activity_cache"):
+                        cached, page = activity_cache.partition(page)
+                    for _ in cached:
+                        on_resolved()
+
+                with phase(timer, "activity_lookups"):
+                    resolved = self.resolve_activity(page, executor, on_resolved)
+
+                if activity_cache:
+                    with phase(timer, "activity_cache"):
+                        activity_cache.store(resolved)
+
+                if cached or skipped:
+                    # Put cached, skipped and looked-up followers back in page order
+                    by_did = {follower.did: follower for follower in skipped + cached + resolved}
+                    resolved = [by_did[follower.did] for follower in followers.followers]
+
+                yield resolved, followers.cursor
+
+                if not followers.cursor:
+                    break
+
+                cursor = followers.cursor
+
+    def fetch_all_followers(self, did: str, progress_callback=None, activity_cache=None) -> list[FollowerData]:
+        """Fetch all followers for a DID with progress tracking
+
+        Pages are yielded as FollowerRecords; they are validated into
+        FollowerData only here, once the whole list is returned.
+        """
+        all_followers = []
+        for page, _ in self.iter_followers(did, progress_callback, activity_cache):
+            all_followers.extend(follower.to_model() for follower in page)
         return all_followers
 
 def is_active_in_window(last_posted_at: Optional[str], days: int = 31) -> bool:
@@ -0,0 +1,272 @@
+"""Command line reports straight from the snapshot database
+
+    python cli.py show                  # latest report of every account
+    python cli.py show 42               # report of snapshot 42
+    python cli.py diff 40 42            # followers gained and lost between two snapshots
+    python cli.py list --limit 10       # recent snapshots
+    python cli.py export 42 --format csv --output followers.csv
+    python cli.py snapshot              # take new snapshots (same as main.py)
+    python cli.py prune                 # archive old snapshots' follower detail and shrink the database
+    python cli.py restore 42            # put snapshot 42's archived followers back
+    python cli.py vacuum                # one-off rebuild letting prune shrink an older database
+
+Every command but snapshot works from followers_cache.db and the archive
+files prune writes alone: the API client, pydantic and the configuration
+(and so the credentials it requires) are only imported by snapshot, so
+reports print in a few tens of milliseconds. Reports open the database
+read-only; only prune, restore and vacuum write to it.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from contextlib import contextmanager
+
+import cohorts
+import database
+import report_format
+import retention
+from database import Database, EXPORT_FIELDS, SCHEMA_VERSION
+
+# Activity window assumed for snapshots taken before the window was stored with them
+DEFAULT_WINDOW_DAYS = 31
+
+# Commands that change the database, which open it writable and migrate it first
+WRITING_COMMANDS = ("prune", "restore", "vacuum")
+
+@contextmanager
+def open_database(command: str):
+    """The existing database, read-only unless the command writes to it"""
+    if not os.path.exists(database.DB_PATH):
+        sys.exit(f"No database at {database.DB_PATH}, run `python cli.py snapshot` to take a snapshot first")
+    if command in WRITING_COMMANDS:
+        with Database() as db:
+            yield db
+        return
+
+    db = Database.open_reader()
+    try:
+        db.cur.execute("PRAGMA user_version")
+        if db.cur.fetchone()[0] < SCHEMA_VERSION:
+            sys.exit(f"{database.DB_PATH} was written by an older version, "
+                     f"run `python cli.py snapshot` to upgrade it first")
+        yield db
+    finally:
+        db.conn.close()
+
+def load_report(db: Database, snapshot: dict) -> dict:
+    """Rebuild a snapshot's report as a dict shaped like SnapshotReport.model_dump()"""
+    total = snapshot["total_followers"]
+    disabled = snapshot["disabled_count"]
+    sampling = snapshot["sampling"] or {}
+    if snapshot["archive"]:
+        # Thinned out by retention, but its changes were archived with its followers
+        changes = archived_detail(snapshot)["changes"]
+        new_followers, unfollowers, renamed = changes["new_followers"], changes["unfollowers"], changes["renamed"]
+        relationships = None
+    else:
+        new_followers, unfollowers, renamed = db.get_follower_changes(snapshot["id"])
+        relationships = cohorts.relationship_report(db, snapshot["id"])
+    return {
+        "stats": {
+            "total_followers": total,
+            "enabled_count": snapshot["enabled_count"] if snapshot["enabled_count"] is not None else total - disabled,
+            "disabled_count": disabled,
+            "active_count": snapshot["active_count"],
+            "ghost_count": snapshot["never_posted_count"],
+            "active_percentage": (snapshot["active_count"] / total) * 100 if total > 0 else 0,
+            "estimated": snapshot["estimated"],
+            "sample_size": sampling.get("sample_size", 0),
+            "intervals": sampling.get("intervals", {}),
+        },
+        "new_followers": new_followers,
+        "unfollowers": unfollowers,
+        "renamed": renamed,
+        "follows_count": snapshot["follows_count"] or 0,
+        "relationships": relationships,
+    }
+
+def archived_detail(snapshot: dict) -> dict:
+    """An archived snapshot's changes and follows, without replaying its followers"""
+    try:
+        detail = retention.read_archive(snapshot["archive"], snapshot["id"], with_followers=False)
+    except OSError as e:
+        sys.exit(f"Snapshot {snapshot['id']} is archived, but its archive can't be read: {e}")
+    if not detail:
+        sys.exit(f"Snapshot {snapshot['id']} is missing from its archive {snapshot['archive']}")
+    return detail
+
+def window_days(snapshot: dict) -> int:
+    """Activity window a snapshot's active followers were counted in"""
+    if snapshot["activity_window_days"]:
+        return snapshot["activity_window_days"]
+    return int(os.environ.get("ACTIVITY_WINDOW_DAYS", DEFAULT_WINDOW_DAYS))
+
+def get_snapshot(db: Database, snapshot_id: int) -> dict:
+    snapshot = db.get_snapshot(snapshot_id)
+    if not snapshot:
+        sys.exit(f"No complete snapshot {snapshot_id}")
+    return snapshot
+
+def get_detailed_snapshot(db: Database, snapshot_id: int) -> dict:
+    """A complete snapshot whose followers are in the database, not archived"""
+    snapshot = get_snapshot(db, snapshot_id)
+    if snapshot["archive"]:
+        sys.exit(f"The followers of snapshot {snapshot_id} are archived in {snapshot['archive']}, "
+                 f"run `python cli.py restore {snapshot_id}` first")
+    return snapshot
+
+def show(db: Database, args):
+    if args.snapshot_id is not None:
+        snapshots = [get_snapshot(db, args.snapshot_id)]
+    else:
+        snapshots = [
+            snapshot for snapshot in db.get_latest_snapshots()
+            if not args.account or snapshot["account_handle"] == args.account
+        ]
+        if not snapshots:
+            sys.exit("No snapshots yet, run `python cli.py snapshot` to take one")
+
+    for position, snapshot in enumerate(snapshots):
+        if position:
+            print("\n")
+        if len(snapshots) > 1:
+            print(snapshot["account_handle"])
+        print(report_format.format_report(load_report(db, snapshot), window_days(snapshot)))
+
+def diff(db: Database, args):
+    before = get_detailed_snapshot(db, args.before)
+    after = get_detailed_snapshot(db, args.after)
+    gained, lost = cohorts.diff(db.get_snapshot_bitmap(before["id"]), db.get_snapshot_bitmap(after["id"]))
+
+    handles = {}
+    for name, bitmap in (("gained", gained), ("lost", lost)):
+        ids = cohorts.members(bitmap)
+        followers = db.get_followers_by_id(ids[:args.limit]).values()
+        handles[name] = dict(sorted(followers, key=lambda follower: (follower[1] or "").lower()))
+
+    print(report_format.format_diff(before, after, handles["gained"], handles["lost"],
+                                    gained.bit_count(), lost.bit_count()))
+
+def list_snapshots(db: Database, args):
+    for snapshot in db.get_recent_snapshots(args.limit, args.account):
+        estimated = " (estimated)" if snapshot["estimated"] else ""
+        archived = " (archived)" if snapshot["archive"] else ""
+        print(f"{snapshot['id']:>6}  {snapshot['timestamp']}  {snapshot['account_handle']}  "
+              f"{snapshot['total_followers']} followers, {snapshot['active_count']} active{estimated}{archived}")
+
+def export(db: Database, args):
+    get_detailed_snapshot(db, args.snapshot_id)
+    output = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        if args.format == "ndjson":
+            for follower in db.iter_snapshot_followers(args.snapshot_id):
+                output.write(json.dumps(follower) + "\n")
+        else:
+            writer = csv.DictWriter(output, fieldnames=EXPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(db.iter_snapshot_followers(args.snapshot_id))
+    finally:
+        if args.output:
+            output.close()
+
+def prune(db: Database, args):
+    policy = retention.RetentionPolicy(args.full_days, args.thin_days, args.archive_days)
+    service = retention.RetentionService(db, policy, args.archive_dir)
+    if args.dry_run:
+        for account_handle, batches in service.plan().items():
+            snapshot_ids = [snapshot_id for batch in batches for snapshot_id in batch]
+            print(f"{account_handle}: would archive {len(snapshot_ids)} snapshots to {len(batches)} files "
+                  f"({snapshot_ids[0]} to {snapshot_ids[-1]})")
+        return
+
+    summary = service.run(vacuum=not args.no_vacuum)
+    print(f"Archived {summary['snapshots']} snapshots to {summary['archives']} files in {args.archive_dir}, "
+          f"deleted {summary['memberships']} memberships and {summary['followers']} followers, "
+          f"freed {summary['pages']} pages")
+    if not args.no_vacuum and not db.incremental_vacuum_enabled():
+        print("Freed pages stay in the database file for reuse; run `python cli.py vacuum` once to let prune shrink it")
+
+def restore(db: Database, args):
+    service = retention.RetentionService(db)
+    for snapshot_id in args.snapshot_ids:
+        snapshot = get_snapshot(db, snapshot_id)
+        if not snapshot["archive"]:
+            print(f"Snapshot {snapshot_id} is not archived")
+            continue
+        service.restore(snapshot_id)
+        print(f"Restored snapshot {snapshot_id} from {snapshot['archive']}")
+
+def vacuum(db: Database, args):
+    if not db.enable_incremental_vacuum():
+        print("The database already uses incremental vacuum")
+        return
+    print("Rebuilt the database with incremental vacuum, prune now hands freed space back to the filesystem")
+
+def snapshot(args):
+    # The only command that talks to the network, and so loads the credentials
+    import main
+    main.main()
+
+def main():
+    parser = argparse.ArgumentParser(description="Follower reports from the snapshot database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    show_parser = subparsers.add_parser("show", help="Print the report of a snapshot, by default the latest of each account")
+    show_parser.add_argument("snapshot_id", type=int, nargs="?")
+    show_parser.add_argument("--account", help="Only show this account's latest report")
+
+    diff_parser = subparsers.add_parser("diff", help="Followers gained and lost between any two snapshots")
+    diff_parser.add_argument("before", type=int)
+    diff_parser.add_argument("after", type=int)
+    diff_parser.add_argument("--limit", type=int, default=1000, help="Most followers to list each way")
+
+    list_parser = subparsers.add_parser("list", help="List recent snapshots, newest first")
+    list_parser.add_argument("--limit", type=int, default=30)
+    list_parser.add_argument("--account")
+
+    export_parser = subparsers.add_parser("export", help="Write every follower of a snapshot")
+    export_parser.add_argument("snapshot_id", type=int)
+    export_parser.add_argument("--format", choices=("ndjson", "csv"), default="ndjson")
+    export_parser.add_argument("--output", help="File to write to instead of standard output")
+
+    subparsers.add_parser("snapshot", help="Take new snapshots of the tracked accounts")
+
+    prune_parser = subparsers.add_parser("prune", help="Archive the follower detail of old snapshots and shrink the database")
+    prune_parser.add_argument("--full-days", type=float, default=retention.DEFAULT_FULL_DAYS,
+                              help="Days snapshots keep every follower in the database")
+    prune_parser.add_argument("--thin-days", type=int, default=retention.DEFAULT_THIN_DAYS,
+                              help="Older snapshots are thinned to the latest of every this many days")
+    prune_parser.add_argument("--archive-days", type=float, default=retention.DEFAULT_ARCHIVE_DAYS,
+                              help="Days after which snapshots keep only their totals, 0 to keep the thinned ones")
+    prune_parser.add_argument("--archive-dir", default=retention.DEFAULT_ARCHIVE_DIR)
+    prune_parser.add_argument("--dry-run", action="store_true", help="Only print what would be archived")
+    prune_parser.add_argument("--no-vacuum", action="store_true", help="Leave freed pages in the database file")
+
+    restore_parser = subparsers.add_parser("restore", help="Put archived snapshots' followers back in the database")
+    restore_parser.add_argument("snapshot_ids", type=int, nargs="+")
+
+    subparsers.add_parser("vacuum", help="Rebuild a database created before retention, so prune can shrink it; "
+                                         "needs as much free disk again and blocks snapshots while it runs")
+
+    args = parser.parse_args()
+
+    if args.command == "snapshot":
+        snapshot(args)
+        return
+
+    commands = {
+        "show": show, "diff": diff, "list": list_snapshots, "export": export,
+        "prune": prune, "restore": restore, "vacuum": vacuum,
+    }
+    try:
+        with open_database(args.command) as db:
+            commands[args.command](db, args)
+    except BrokenPipeError:
+        # The output was piped into something that stopped reading, like head
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Cohort, churn, retention and mutuals analysis over snapshot follower bitmaps
+
+Every function works on bitmaps as returned by Database.get_snapshot_bitmap,
+Database.iter_snapshot_bitmaps and Database.get_snapshot_follows_bitmap:
+Python ints with bit i set when the account with followers.id i is present. Set operations are single bitwise
+operations and counts are int.bit_count(), so comparing snapshots costs the
+same however many followers changed.
+"""
+from typing import Iterable
+
+def members(bitmap: int) -> list[int]:
+    """followers.id of every follower in a bitmap, in ascending order"""
+    ids = []
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+    for index, byte in enumerate(data):
+        if byte:
+            base = index * 8
+            ids.extend(base + bit for bit in range(8) if byte >> bit & 1)
+    return ids
+
+def diff(before: int, after: int) -> tuple[int, int]:
+    """(gained, lost) bitmaps between two snapshots, which need not be consecutive"""
+    return after & ~before, before & ~after
+
+def relationships(followers: int, follows: int) -> tuple[int, int, int]:
+    """(mutuals, followers only, following only) bitmaps from a snapshot's followers and follows"""
+    return followers & follows, followers & ~follows, follows & ~followers
+
+def churn(snapshots: Iterable[tuple[int, str, int]]) -> list[dict]:
+    """Followers gained and lost at each snapshot, and the share of the previous followers lost"""
+    points = []
+    previous = None
+    for snapshot_id, timestamp, bitmap in snapshots:
+        if previous is not None:
+            gained, lost = diff(previous, bitmap)
+            previous_count = previous.bit_count()
+            points.append({
+                "snapshot_id": snapshot_id,
+                "timestamp": timestamp,
+                "followers": bitmap.bit_count(),
+                "gained": gained.bit_count(),
+                "lost": lost.bit_count(),
+                "churn_rate": round(lost.bit_count() / previous_count, 6) if previous_count else 0.0,
+            })
+        previous = bitmap
+    return points
+
+def retention(snapshots: Iterable[tuple[int, str, int]], first_cohort_id: int = 0) -> list[dict]:
+    """Retention curve of every follow cohort from first_cohort_id on
+
+    A snapshot's cohort is the followers seen in it for the first time.
+    retained[k] is how many of the cohort still follow k snapshots later,
+    so retained[0] is the cohort size. Earlier snapshots are still read, so
+    followers returning from before first_cohort_id are not counted as new.
+    """
+    cohorts = []
+    seen = 0
+    for snapshot_id, timestamp, bitmap in snapshots:
+        for cohort in cohorts:
+            cohort["retained"].append((cohort["bitmap"] & bitmap).bit_count())
+
+        new = bitmap & ~seen
+        seen |= bitmap
+        if snapshot_id >= first_cohort_id:
+            cohorts.append({"snapshot_id": snapshot_id, "timestamp": timestamp, "bitmap": new,
+                            "retained": [new.bit_count()]})
+
+    return [
+        {
+            "snapshot_id": cohort["snapshot_id"],
+            "timestamp": cohort["timestamp"],
+            "size": cohort["retained"][0],
+            "retained": cohort["retained"],
+            "retention": [round(count / cohort["retained"][0], 4) if cohort["retained"][0] else 0.0
+                          for count in cohort["retained"]],
+        }
+        for cohort in cohorts
+    ]
+
+def returning(snapshots: Iterable[tuple[int, str, int]]) -> int:
+    """Bitmap of followers in the latest snapshot who were missing from an earlier one after first following"""
+    seen = 0
+    left = 0
+    bitmap = 0
+    for _, _, bitmap in snapshots:
+        left |= seen & ~bitmap
+        seen |= bitmap
+    return bitmap & left
+
+def report(db, account_handle: str, max_cohorts: int = 12) -> dict:
+    """Churn at every snapshot, retention of the latest max_cohorts follow cohorts and returning followers
+
+    Reads the account's bitmaps from a Database; returning followers are
+    given as followers.id values.
+    """
+    snapshot_ids = db.get_account_snapshot_ids(account_handle)
+    first_cohort_id = snapshot_ids[-max_cohorts] if len(snapshot_ids) >= max_cohorts else 0
+    return {
+        "churn": churn(db.iter_snapshot_bitmaps(account_handle)),
+        "cohorts": retention(db.iter_snapshot_bitmaps(account_handle), first_cohort_id),
+        "returning": members(returning(db.iter_snapshot_bitmaps(account_handle))),
+    }
+
+def relationship_report(db, snapshot_id: int, limit: int = 1000) -> dict | None:
+    """Counts of mutuals and one-way follows at a snapshot, and up to limit of each by did:handle
+
+    Reads both bitmaps from a Database; None if the snapshot's follows
+    were not stored. Lists are ordered by handle.
+    """
+    followers = db.get_snapshot_bitmap(snapshot_id)
+    follows = db.get_snapshot_follows_bitmap(snapshot_id)
+    if followers is None or follows is None:
+        return None
+
+    report = {}
+    for name, bitmap in zip(("mutuals", "followers_only", "following_only"), relationships(followers, follows)):
+        ids = members(bitmap)
+        accounts = db.get_followers_by_id(ids[:limit]).values()
+        report[f"{name}_count"] = len(ids)
+        report[name] = dict(sorted(accounts, key=lambda account: (account[1] or "").lower()))
+    return report
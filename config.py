@@ -9,15 +9,48 @@ class Config(BaseSettings):
     BSKY_HANDLE: str
     BSKY_APP_PASSWORD: str
     BSKY_TARGET_HANDLE: str
+    BSKY_TARGET_HANDLES: str = Field(default="", description="Comma separated handles to track alongside BSKY_TARGET_HANDLE")
     
     # API settings (with defaults)
+    BSKY_SERVICE_URL: str = Field(default="https://bsky.social", description="Base URL of the Bluesky service to talk to")
     REPORT_LIMIT: int = Field(default=100, gt=0, le=100, description="Number of followers to fetch per request")
-    RATE_LIMIT_DELAY: float = Field(default=0.05, ge=0, description="Delay between API requests in seconds, to avoid rate limiting")
     MAX_RETRIES: int = Field(default=3, gt=0, description="API request maximum number of retries on failure")
-    RETRY_DELAY: float = Field(default=1.0, ge=0, description="Maximum delay between API request retries, in seconds")
+    RETRY_DELAY: float = Field(default=1.0, ge=0, description="Base delay for exponential backoff between retries, in seconds")
+    FETCH_CONCURRENCY: int = Field(default=4, gt=0, description="Number of per-follower lookups to run in parallel")
+    ACCOUNT_CONCURRENCY: int = Field(default=2, gt=0, description="Number of accounts snapshotted at the same time")
+    # Bluesky documents a budget of 3000 requests per 5 minutes; until the server reports its own, the
+    # fallback bucket holds that whole window, so concurrent lookups aren't held to the sustained rate
+    REQUESTS_PER_SECOND: float = Field(default=10.0, gt=0, description="Sustained request rate used until the server reports its rate limit budget")
+    REQUESTS_BURST: int = Field(default=3000, gt=0, description="Requests sent as fast as the workers allow before REQUESTS_PER_SECOND applies")
+    BSKY_SESSION_FILE: str = Field(default=".bsky_session", description="File the login session is kept in between runs, empty to log in every run")
+    HANDLE_CACHE_TTL_MINUTES: float = Field(default=60, ge=0, description="Minutes a resolved handle is reused by a long-running process")
+
+    # Daemon settings
+    DAEMON_INTERVAL_MINUTES: float = Field(default=60, gt=0, description="Minutes between the starts of daemon snapshot runs")
+    DAEMON_JITTER_MINUTES: float = Field(default=5, ge=0, description="Up to this many minutes are randomly added to or taken from each interval")
+    DAEMON_RETENTION: bool = Field(default=True, description="Archive old snapshots' follower detail by the retention settings after each daemon run")
+
+    # Retention settings
+    RETENTION_FULL_DAYS: float = Field(default=30, ge=0, description="Days snapshots keep every follower in the database")
+    RETENTION_THIN_DAYS: int = Field(default=7, gt=0, description="Older snapshots are thinned to the latest of every this many days")
+    RETENTION_ARCHIVE_DAYS: float = Field(default=0, ge=0, description="Days after which snapshots keep only their totals in the database, 0 to keep the thinned ones")
+    RETENTION_ARCHIVE_DIR: str = Field(default="archive", description="Directory archived follower detail is written to")
+
+    # Follow event stream settings
+    JETSTREAM_URL: str = Field(default="wss://jetstream2.us-east.bsky.network/subscribe", description="Jetstream endpoint to read follow events from")
 
     # Activity settings
     ACTIVITY_WINDOW_DAYS: int = Field(default=31, gt=0, description="Days to consider for active users")
+    ACTIVITY_CACHE_TTL_HOURS: float = Field(default=72, ge=0, description="Hours before a cached follower activity lookup is refreshed")
+    ACTIVITY_REFRESH_MARGIN_DAYS: float = Field(default=2, ge=0, description="Cached active followers this close to the window boundary are refreshed")
+    ACTIVITY_SAMPLE_RATE: float = Field(default=0, ge=0, le=1, description="Share of followers whose activity is looked up, estimating the rest; 0 looks up everyone")
+    ACTIVITY_SAMPLE_ROTATION: int = Field(default=4, gt=0, description="Snapshots over which the activity sample is entirely replaced")
+
+    @property
+    def target_handles(self) -> list[str]:
+        """Every handle to track, BSKY_TARGET_HANDLE first, without duplicates"""
+        handles = [self.BSKY_TARGET_HANDLE] + self.BSKY_TARGET_HANDLES.split(",")
+        return list(dict.fromkeys(handle.strip() for handle in handles if handle.strip()))
 
     model_config = SettingsConfigDict(
         env_file=".env",
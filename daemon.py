@@ -0,0 +1,151 @@
+"""Long-running snapshot daemon
+
+Snapshots every tracked account on an interval from one process, so the
+login session, the API client and its open HTTP connections, resolved
+handles and the database connection are reused from run to run instead
+of being rebuilt by a fresh `python main.py` each time. Between runs, old
+snapshots' follower detail is archived by the retention settings.
+
+    python daemon.py
+    python daemon.py --interval 30 --jitter 2
+"""
+import argparse
+import logging
+import random
+import signal
+import sys
+import threading
+import time
+from typing import Optional
+
+from config import config
+from database import Database
+from bluesky_service import BlueskyService
+from scheduler import SnapshotScheduler, AccountResult
+from metrics import registry
+from retention import RetentionPolicy, RetentionService
+
+logger = logging.getLogger(__name__)
+
+class SnapshotDaemon:
+    """Snapshots the tracked accounts every interval seconds until stopped
+
+    Each run starts interval seconds after the previous one started, give
+    or take up to jitter seconds, so several daemons sharing an API budget
+    don't settle into firing at the same moment. Setting the stop event
+    ends the run in flight once its snapshots are checkpointed. With a
+    retention service, retention runs after each snapshot run, so the two
+    never compete for the database.
+    """
+
+    def __init__(
+            self,
+            bluesky: BlueskyService,
+            db: Database,
+            interval: float,
+            jitter: float = 0.0,
+            stop: Optional[threading.Event] = None,
+            retention: Optional[RetentionService] = None
+    ):
+        self.bluesky = bluesky
+        self.db = db
+        self.interval = interval
+        self.jitter = jitter
+        self.stop = stop or threading.Event()
+        self.retention = retention
+        self.runs = 0
+
+    def next_delay(self) -> float:
+        """Seconds from the start of one run to the start of the next"""
+        return max(self.interval + random.uniform(-self.jitter, self.jitter), 0.0)
+
+    def run_once(self) -> list[AccountResult]:
+        """Snapshot every tracked account once"""
+        try:
+            scheduler = SnapshotScheduler(self.bluesky, self.db, stop=self.stop)
+            jobs = scheduler.plan(config.target_handles)
+            if not jobs:
+                logger.error("No accounts to track")
+                return []
+            results = scheduler.run(jobs)
+        finally:
+            # Add this run's API and database metrics to the totals served at /metrics
+            self.db.add_metrics(registry.drain())
+
+        for result in results:
+            if result.report:
+                logger.info(
+                    f"Snapshot {result.snapshot_id} of {result.job.profile.handle}: "
+                    f"{result.stats.total_followers} followers, +{len(result.report.new_followers)} "
+                    f"/ -{len(result.report.unfollowers)}"
+                )
+            else:
+                logger.error(f"Snapshot of {result.job.handle} did not complete")
+        return results
+
+    def run(self):
+        """Run snapshots on the interval until the stop event is set"""
+        while not self.stop.is_set():
+            started = time.monotonic()
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.exception(f"Snapshot run failed: {e}")
+            self.runs += 1
+
+            if self.retention and not self.stop.is_set():
+                try:
+                    self.retention.run()
+                except Exception as e:
+                    self.db.conn.rollback()
+                    logger.exception(f"Retention failed: {e}")
+
+            delay = self.next_delay() - (time.monotonic() - started)
+            if not self.stop.is_set():
+                logger.info(f"Next snapshot run in {max(delay, 0) / 60:.1f} minutes")
+            self.stop.wait(max(delay, 0))
+
+        logger.info(f"Snapshot daemon stopped after {self.runs} runs")
+
+def main():
+    parser = argparse.ArgumentParser(description="Snapshot the tracked accounts on an interval")
+    parser.add_argument("--interval", type=float, default=config.DAEMON_INTERVAL_MINUTES,
+                        help="Minutes between the starts of runs")
+    parser.add_argument("--jitter", type=float, default=config.DAEMON_JITTER_MINUTES,
+                        help="Up to this many minutes are randomly added to or taken from each interval")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler(),
+            logging.FileHandler('follower_tracker.log')
+        ]
+    )
+
+    stop = threading.Event()
+
+    def shutdown(signum, frame):
+        # Snapshots in flight stop after their current page, which is already checkpointed
+        logger.info(f"Received {signal.Signals(signum).name}, stopping after the pages in flight")
+        stop.set()
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, shutdown)
+
+    bluesky = BlueskyService()
+    if not bluesky.authenticate():
+        logger.error("Failed to authenticate with Bluesky")
+        sys.exit(1)
+
+    with Database() as db:
+        retention = None
+        if config.DAEMON_RETENTION:
+            policy = RetentionPolicy(config.RETENTION_FULL_DAYS, config.RETENTION_THIN_DAYS, config.RETENTION_ARCHIVE_DAYS)
+            retention = RetentionService(db, policy, config.RETENTION_ARCHIVE_DIR)
+        SnapshotDaemon(bluesky, db, args.interval * 60, args.jitter * 60, stop, retention).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,107 @@
+import json
+import logging
+import queue
+import re
 import sqlite3
+import threading
+import zlib
 import datetime
+from concurrent.futures import Future
+from contextlib import contextmanager
+from itertools import islice
+from typing import Iterable
 from datetime import timezone, datetime
 
+from metrics import timed, DB_DURATION
+
+logger = logging.getLogger(__name__)
+
 DB_PATH = "followers_cache.db"
 
+# Page cache of each pooled read-only connection, in KiB
+READER_CACHE_KIB = 32 * 1024
+
+# Page cache of a writing connection, in KiB; large snapshots touch many index pages
+WRITER_CACHE_KIB = 64 * 1024
+
+# Followers handed to add_followers at a time by bulk_add_followers
+BULK_CHUNK_SIZE = 10_000
+
+# Secondary membership indexes, which bulk loads may drop and rebuild once at the end.
+# idx_memberships_keyset walks an account's memberships in id order, for keyset pagination.
+MEMBERSHIP_INDEXES = {
+    "idx_memberships_account":
+        "CREATE INDEX IF NOT EXISTS idx_memberships_account ON follower_memberships(account_handle, start_snapshot_id)",
+    "idx_memberships_follower":
+        "CREATE INDEX IF NOT EXISTS idx_memberships_follower ON follower_memberships(follower_id)",
+    "idx_memberships_keyset":
+        "CREATE INDEX IF NOT EXISTS idx_memberships_keyset ON follower_memberships(account_handle, id)",
+}
+
+# Bumped whenever an existing database needs a migration; stored in PRAGMA user_version
+SCHEMA_VERSION = 11
+
+# Every this many snapshots of an account a full follower bitmap is stored; the ones in
+# between only store the XOR against the previous snapshot's bitmap
+BITMAP_KEYFRAME_INTERVAL = 32
+
+# Column of each bitmap table counting the bits set
+BITMAP_COUNT_COLUMNS = {"snapshot_bitmaps": "follower_count", "snapshot_follows": "follows_count"}
+
+# Snapshot rollup resolutions, finest first: the SQL giving the start of the period a
+# timestamp falls in ({column} is the timestamp), and the modifier to the next period's start.
+# Weeks start on Monday.
+ROLLUP_RESOLUTIONS = {
+    "day": ("date({column})", "+1 day"),
+    "week": ("date({column}, 'weekday 0', '-6 days')", "+7 days"),
+    "month": ("date({column}, 'start of month')", "+1 month"),
+}
+
+# Points of the finest fitting resolution read per series point before downsampling
+SERIES_OVERSAMPLE = 4
+
+# Prefix lengths the follower search index keeps extra entries for, so the first few
+# characters typed into a search box don't have to merge every longer term
+SEARCH_PREFIX_INDEXES = "1 2 3"
+
+# Matches ranked per search; short prefixes can match most followers, and ranking all of
+# them would take far longer than a typeahead lookup may
+SEARCH_CANDIDATES = 1000
+
+# Columns of a snapshot row as read by _snapshot_from_row
+SNAPSHOT_COLUMNS = """
+    id, timestamp, account_handle, total_followers, active_count, never_posted_count, disabled_count,
+    activity_histogram, sampling, enabled_count, follows_count, activity_window_days, archive
+"""
+
+# Follower fields written by exports, in order
+EXPORT_FIELDS = ["did", "handle", "display_name", "last_posted_at"]
+
+# Followers present in a snapshot, rebuilt from memberships and attribute changes.
+# Takes the snapshot id as its only parameter.
+SNAPSHOT_MEMBERS_SQL = """
+    SELECT m.id AS membership_id, f.did AS did, a.handle AS handle, a.last_posted_at AS last_posted_at, a.display_name AS display_name
+    FROM snapshots s
+    JOIN follower_memberships m
+        ON m.account_handle = s.account_handle
+        AND m.start_snapshot_id <= s.id
+        AND (m.end_snapshot_id IS NULL OR m.end_snapshot_id > s.id)
+    JOIN followers f ON f.id = m.follower_id
+    JOIN follower_attributes a
+        ON a.membership_id = m.id
+        AND a.snapshot_id = (
+            SELECT MAX(snapshot_id) FROM follower_attributes
+            WHERE membership_id = m.id AND snapshot_id <= s.id
+        )
+    WHERE s.id = ?
+"""
+
 class Database():
 
+    # False while migrating a database from before snapshots could be archived, whose
+    # backfills run before the archive column exists
+    archive_column = True
+
     def _init_tables(self):
 
         self.cur.execute("""
@@ -20,32 +116,340 @@ class Database():
                 )                    
         """)
 
+        # Follower dimension: one row per DID seen following or being followed by a tracked account,
+        # holding the latest known attributes
         self.cur.execute("""
-        CREATE TABLE IF NOT EXISTS snapshot_followers (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+        CREATE TABLE IF NOT EXISTS followers (
+                    id INTEGER PRIMARY KEY,
+                    did TEXT UNIQUE NOT NULL,
+                    handle TEXT,
+                    display_name TEXT
+                )
+        """)
+
+        # Full-text index over the latest handle and display name of each follower. It reads its
+        # content from followers, and add_followers indexes new and changed followers as it upserts them.
+        self.cur.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS followers_fts USING fts5(
+                    handle,
+                    display_name,
+                    content='followers',
+                    content_rowid='id',
+                    prefix='{SEARCH_PREFIX_INDEXES}'
+                )
+        """)
+
+        # A membership is one unbroken run of snapshots in which a DID follows an account.
+        # end_snapshot_id is the first snapshot the follower was missing from.
+        self.cur.execute("""
+        CREATE TABLE IF NOT EXISTS follower_memberships (
+                    id INTEGER PRIMARY KEY,
+                    account_handle TEXT,
+                    follower_id INTEGER,
+                    start_snapshot_id INTEGER,
+                    end_snapshot_id INTEGER,
+                    last_seen_snapshot_id INTEGER,
+                    FOREIGN KEY (follower_id) REFERENCES followers(id)
+                )
+        """)
+
+        self.cur.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_open_memberships
+            ON follower_memberships(account_handle, follower_id) WHERE end_snapshot_id IS NULL
+        """)
+
+        for index_sql in MEMBERSHIP_INDEXES.values():
+            self.cur.execute(index_sql)
+
+        # Attribute values per membership, written only for snapshots where they changed
+        self.cur.execute("""
+        CREATE TABLE IF NOT EXISTS follower_attributes (
+                    membership_id INTEGER,
+                    snapshot_id INTEGER,
+                    handle TEXT,
+                    display_name TEXT,
+                    last_posted_at TEXT,
+                    PRIMARY KEY (membership_id, snapshot_id),
+                    FOREIGN KEY (membership_id) REFERENCES follower_memberships(id)
+                ) WITHOUT ROWID
+        """)
+
+        # Follower changes against the previous complete snapshot, written when a snapshot completes.
+        # change is 'follow', 'unfollow' or 'rename'; previous_handle is only set for renames.
+        self.cur.execute("""
+        CREATE TABLE IF NOT EXISTS snapshot_changes (
                     snapshot_id INTEGER,
                     did TEXT,
+                    change TEXT,
                     handle TEXT,
+                    previous_handle TEXT,
+                    PRIMARY KEY (snapshot_id, did),
+                    FOREIGN KEY (snapshot_id) REFERENCES snapshots(id)
+                ) WITHOUT ROWID
+        """)
+
+        self.cur.execute("""
+        CREATE TABLE IF NOT EXISTS activity_cache (
+                    did TEXT PRIMARY KEY,
                     last_posted_at TEXT,
-                    display_name TEXT,
+                    posts_count INTEGER,
+                    disabled INTEGER DEFAULT 0,
+                    checked_at TEXT
+                )
+        """)
+
+        # Follow and unfollow events for tracked accounts, ingested from the firehose
+        self.cur.execute("""
+        CREATE TABLE IF NOT EXISTS follow_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    account_handle TEXT,
+                    follower_did TEXT,
+                    event TEXT,
+                    rkey TEXT,
+                    time_us INTEGER
+                )
+        """)
+
+        self.cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_follow_events ON follow_events(account_handle, time_us)
+        """)
+
+        # Follow records pointing at tracked accounts, so deletes (which only carry the rkey) can be matched
+        self.cur.execute("""
+        CREATE TABLE IF NOT EXISTS follow_records (
+                    follower_did TEXT,
+                    rkey TEXT,
+                    subject_did TEXT,
+                    PRIMARY KEY (follower_did, rkey)
+                ) WITHOUT ROWID
+        """)
+
+        self.cur.execute("""
+        CREATE TABLE IF NOT EXISTS stream_cursors (
+                    name TEXT PRIMARY KEY,
+                    time_us INTEGER
+                )
+        """)
+
+        # Followers of each complete snapshot as a zlib compressed bitmap of followers.id, bit i set
+        # when follower i is present. base_snapshot_id is the previous snapshot the bitmap is XORed
+        # against, NULL for a full bitmap; depth counts the deltas since the last full one.
+        self.cur.execute("""
+        CREATE TABLE IF NOT EXISTS snapshot_bitmaps (
+                    snapshot_id INTEGER PRIMARY KEY,
+                    base_snapshot_id INTEGER,
+                    depth INTEGER,
+                    follower_count INTEGER,
+                    bitmap BLOB,
                     FOREIGN KEY (snapshot_id) REFERENCES snapshots(id)
-                )            
+                )
+        """)
+
+        # Accounts followed by the tracked account at each complete snapshot, stored like
+        # snapshot_bitmaps over the same followers.id values, so the two sets can be compared directly
+        self.cur.execute("""
+        CREATE TABLE IF NOT EXISTS snapshot_follows (
+                    snapshot_id INTEGER PRIMARY KEY,
+                    base_snapshot_id INTEGER,
+                    depth INTEGER,
+                    follows_count INTEGER,
+                    bitmap BLOB,
+                    FOREIGN KEY (snapshot_id) REFERENCES snapshots(id)
+                )
+        """)
+
+        self.cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_snapshots_account_time ON snapshots(account_handle, timestamp)
         """)
 
+        # Per account aggregates of complete snapshots by day, week and month, kept up to date as
+        # snapshots complete. period is the first day of the period; total_followers and active_count
+        # are those of the period's latest snapshot.
         self.cur.execute("""
-            CREATE INDEX IF NOT EXISTS idx_snapshot_followers ON snapshot_followers(snapshot_id, did)
+        CREATE TABLE IF NOT EXISTS snapshot_rollups (
+                    account_handle TEXT,
+                    resolution TEXT,
+                    period TEXT,
+                    snapshot_count INTEGER,
+                    min_followers INTEGER,
+                    max_followers INTEGER,
+                    last_snapshot_id INTEGER,
+                    total_followers INTEGER,
+                    active_count INTEGER,
+                    PRIMARY KEY (account_handle, resolution, period)
+                ) WITHOUT ROWID
+        """)
+
+        # Running totals of the counters and histograms in metrics.registry, added to after each run.
+        # labels is the JSON object of the sample's labels.
+        self.cur.execute("""
+        CREATE TABLE IF NOT EXISTS metrics (
+                    name TEXT,
+                    labels TEXT,
+                    value REAL,
+                    PRIMARY KEY (name, labels)
+                ) WITHOUT ROWID
         """)
 
         self.conn.commit()
 
+        self.cur.execute("PRAGMA user_version")
+        version = self.cur.fetchone()[0]
+        # Step n brings the schema from version n - 1 to n
+        migrations = [
+            self._migrate_snapshot_followers,
+            self._add_snapshot_progress,
+            self._backfill_snapshot_changes,
+            self._add_snapshot_timings,
+            self._add_activity_histogram,
+            self._refresh_rollups,
+            self._backfill_snapshot_bitmaps,
+            self._add_snapshot_sampling,
+            self._build_follower_search,
+            self._add_snapshot_report_fields,
+            self._add_snapshot_archive,
+        ]
+        self.archive_column = version >= 11
+        for step in range(version, SCHEMA_VERSION):
+            # Each step commits with the version it reaches, so an upgrade that fails
+            # part way carries on from the failed step next time
+            self.cur.execute("BEGIN")
+            try:
+                vacuum = migrations[step]()
+                self.cur.execute(f"PRAGMA user_version = {step + 1}")
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+            if vacuum:
+                # Steps that free a lot of space return True; VACUUM can't run in their transaction
+                self.conn.execute("VACUUM")
+
+    def _add_snapshot_progress(self):
+        """Track in-progress snapshots and their resume point"""
+        # Snapshots taken before this existed were always complete
+        self.cur.execute("ALTER TABLE snapshots ADD COLUMN status TEXT NOT NULL DEFAULT 'complete'")
+        self.cur.execute("ALTER TABLE snapshots ADD COLUMN cursor TEXT")
+        self.cur.execute("ALTER TABLE snapshots ADD COLUMN progress TEXT")
+
+    def _add_snapshot_timings(self):
+        """Keep the wall time of each snapshot phase, as a JSON object of phase -> seconds"""
+        self.cur.execute("ALTER TABLE snapshots ADD COLUMN timings TEXT")
+
+    def _add_activity_histogram(self):
+        """Keep how many followers posted within each activity window, as a JSON object"""
+        self.cur.execute("ALTER TABLE snapshots ADD COLUMN activity_histogram TEXT")
+
+    def _migrate_snapshot_followers(self):
+        """One-shot migration of full per-snapshot follower copies to delta storage"""
+        self.cur.execute("""
+                    SELECT name FROM sqlite_master
+                    WHERE type = 'table' AND name = 'snapshot_followers'
+                    """)
+        if not self.cur.fetchone():
+            return
+
+        self.cur.execute("SELECT id FROM snapshots ORDER BY id ASC")
+        snapshot_ids = [r[0] for r in self.cur.fetchall()]
+        logger.info(f"Migrating {len(snapshot_ids)} snapshots to delta follower storage")
+
+        read_cur = self.conn.cursor()
+        for snapshot_id in snapshot_ids:
+            read_cur.execute("""
+                        SELECT did, handle, last_posted_at, display_name
+                        FROM snapshot_followers
+                        WHERE snapshot_id = ?
+                        ORDER BY id ASC
+                        """, (snapshot_id,))
+            while True:
+                rows = read_cur.fetchmany(1000)
+                if not rows:
+                    break
+                self.add_followers(snapshot_id, rows)
+            self.close_memberships(snapshot_id)
+
+        self.cur.execute("DROP TABLE snapshot_followers")
+        logger.info("Follower storage migration complete")
+        # Hand the space used by the old copies back to the filesystem
+        return True
+
+    def _backfill_snapshot_changes(self):
+        """Materialize follower changes for snapshots taken before they were stored"""
+        self.cur.execute("SELECT id FROM snapshots WHERE status = 'complete' ORDER BY id")
+        snapshot_ids = [row[0] for row in self.cur.fetchall()]
+        for snapshot_id in snapshot_ids:
+            self.save_snapshot_changes(snapshot_id)
+        if snapshot_ids:
+            logger.info(f"Stored follower changes for {len(snapshot_ids)} existing snapshots")
+
+    def _add_snapshot_sampling(self):
+        """Mark snapshots whose statistics were estimated from a sample, NULL when exact"""
+        self.cur.execute("ALTER TABLE snapshots ADD COLUMN sampling TEXT")
+
+    def _add_snapshot_report_fields(self):
+        """Keep the rest of what a report shows, so it can be printed from the database alone
+
+        NULL for snapshots taken before these were kept.
+        """
+        self.cur.execute("ALTER TABLE snapshots ADD COLUMN enabled_count INTEGER")
+        self.cur.execute("ALTER TABLE snapshots ADD COLUMN follows_count INTEGER")
+        self.cur.execute("ALTER TABLE snapshots ADD COLUMN activity_window_days INTEGER")
+
+    def _add_snapshot_archive(self):
+        """Track snapshots whose follower detail was moved to an archive file by retention
+
+        archive is the file's path, NULL while the detail is in the database;
+        pinned snapshots were restored from an archive and keep their detail.
+        """
+        self.cur.execute("ALTER TABLE snapshots ADD COLUMN archive TEXT")
+        self.cur.execute("ALTER TABLE snapshots ADD COLUMN pinned INTEGER NOT NULL DEFAULT 0")
+        self.archive_column = True
+
+    def _build_follower_search(self):
+        """Index the followers stored before the search index existed"""
+        self.cur.execute("INSERT INTO followers_fts (followers_fts) VALUES ('rebuild')")
+
+    def _backfill_snapshot_bitmaps(self):
+        """Store follower bitmaps for snapshots taken before they were kept"""
+        self.cur.execute("SELECT id FROM snapshots WHERE status = 'complete' ORDER BY id")
+        snapshot_ids = [row[0] for row in self.cur.fetchall()]
+        for snapshot_id in snapshot_ids:
+            self.save_snapshot_bitmap(snapshot_id)
+        if snapshot_ids:
+            logger.info(f"Stored follower bitmaps for {len(snapshot_ids)} existing snapshots")
+
     def __enter__(self):
         self.conn = sqlite3.connect(DB_PATH)
         self.cur = self.conn.cursor()
+        # Only takes effect on a new database (`python cli.py vacuum` converts existing ones),
+        # so archiving old snapshots can hand their pages back to the filesystem
+        self.cur.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        # Let readers (the web interface) keep reading while a snapshot is written
+        self.cur.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode NORMAL only syncs at checkpoints; a power cut can lose the
+        # last commits but never corrupts the database
+        self.cur.execute("PRAGMA synchronous=NORMAL")
+        self.cur.execute(f"PRAGMA cache_size = -{WRITER_CACHE_KIB}")
+        self.cur.execute("PRAGMA temp_store=MEMORY")
         self._init_tables()
         return self
+
+    @classmethod
+    def open_reader(cls) -> "Database":
+        """Open a read-only handle on an existing database, skipping schema setup"""
+        db = cls()
+        db.conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, check_same_thread=False)
+        db.cur = db.conn.cursor()
+        # Readers are long lived, so a bigger page cache stays warm between requests
+        db.cur.execute(f"PRAGMA cache_size = -{READER_CACHE_KIB}")
+        return db
     
     def __exit__(self, exc_type, exc_value, exc_tb):
-        self.conn.commit()
+        # Never commit half-written work from a failed or interrupted run
+        if exc_type is None:
+            self.conn.commit()
+        else:
+            self.conn.rollback()
         self.conn.close()
 
     def create_snapshot(self, 
@@ -53,50 +457,442 @@ class Database():
                         total_followers: int, 
                         active_count: int, 
                         never_posted_count: int, 
-                        disabled_count: int):
+                        disabled_count: int,
+                        status: str = "complete"):
         self.cur.execute("""
-                    INSERT INTO snapshots (account_handle, total_followers, active_count, never_posted_count, disabled_count)
-                    VALUES (?, ?, ?, ?, ?)
-                    """, (account_handle, total_followers, active_count, never_posted_count, disabled_count,)
+                    INSERT INTO snapshots (account_handle, total_followers, active_count, never_posted_count, disabled_count, status)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """, (account_handle, total_followers, active_count, never_posted_count, disabled_count, status,)
                     )
         self.conn.commit()
         return self.cur.lastrowid
     
-    def get_follower_changes(self, snapshot_id: int, account_handle: str):
-        """Compare current snapshot to previous snapshot"""
-        cur = self.cur
+    def update_snapshot_stats(self,
+                              snapshot_id: int,
+                              total_followers: int,
+                              active_count: int,
+                              never_posted_count: int,
+                              disabled_count: int,
+                              activity_histogram: str | None = None,
+                              sampling: str | None = None,
+                              enabled_count: int | None = None,
+                              follows_count: int | None = None,
+                              activity_window_days: int | None = None):
+        """Store final statistics; sampling is the JSON sample details of estimated statistics, None when exact
 
-        cur.execute("""
-                    SELECT id FROM snapshots
-                    WHERE id < ? AND account_handle = ?
+        Not committed here; complete_snapshot commits them with the rest of the snapshot.
+        """
+        self.cur.execute("""
+                    UPDATE snapshots
+                    SET total_followers = ?, active_count = ?, never_posted_count = ?, disabled_count = ?,
+                        activity_histogram = ?, sampling = ?, enabled_count = ?, follows_count = ?,
+                        activity_window_days = ?
+                    WHERE id = ?
+                    """, (total_followers, active_count, never_posted_count, disabled_count, activity_histogram,
+                          sampling, enabled_count, follows_count, activity_window_days, snapshot_id,)
+                    )
+
+    def save_checkpoint(self, snapshot_id: int, cursor: str | None, progress: str):
+        """Store the resume point of an in-progress snapshot
+
+        Not committed here, so the checkpoint lands in the same transaction
+        as the followers it covers.
+        """
+        self.cur.execute("""
+                    UPDATE snapshots SET cursor = ?, progress = ?
+                    WHERE id = ?
+                    """, (cursor, progress, snapshot_id,))
+
+    def save_snapshot_timings(self, snapshot_id: int, timings: str):
+        """Store the JSON phase timings of a snapshot"""
+        self.cur.execute("UPDATE snapshots SET timings = ? WHERE id = ?", (timings, snapshot_id))
+        self.conn.commit()
+
+    def get_latest_snapshot_timings(self) -> dict[str, str]:
+        """JSON phase timings of each account's latest complete snapshot, keyed by handle"""
+        self.cur.execute("""
+                    SELECT account_handle, timings FROM snapshots
+                    WHERE id IN (
+                        SELECT MAX(id) FROM snapshots
+                        WHERE status = 'complete' AND timings IS NOT NULL
+                        GROUP BY account_handle
+                    )
+                    """)
+        return dict(self.cur.fetchall())
+
+    def add_metrics(self, samples: list[tuple]):
+        """Add (name, labels, value) samples to the stored running totals"""
+        self.cur.executemany("""
+            INSERT INTO metrics (name, labels, value) VALUES (?, ?, ?)
+            ON CONFLICT(name, labels) DO UPDATE SET value = value + excluded.value
+            """, samples)
+        self.conn.commit()
+
+    def get_metrics(self) -> list[tuple]:
+        """Every stored (name, labels, value) metric sample"""
+        self.cur.execute("SELECT name, labels, value FROM metrics")
+        return self.cur.fetchall()
+
+    def complete_snapshot(self, snapshot_id: int):
+        self.cur.execute("""
+                    UPDATE snapshots SET status = 'complete', cursor = NULL, progress = NULL
+                    WHERE id = ?
+                    """, (snapshot_id,))
+        self.refresh_snapshot_rollups(snapshot_id)
+        self.conn.commit()
+
+    def refresh_snapshot_rollups(self, snapshot_id: int):
+        """Recompute the day, week and month rollups a snapshot falls in
+
+        Call after a snapshot completes or is removed; not committed here.
+        """
+        self.cur.execute("SELECT account_handle, timestamp FROM snapshots WHERE id = ?", (snapshot_id,))
+        row = self.cur.fetchone()
+        if row:
+            self._refresh_rollups(*row)
+
+    def _refresh_rollups(self, account_handle: str | None = None, timestamp: str | None = None):
+        """Rebuild rollups from the snapshots table
+
+        With an account and timestamp, only the periods containing that
+        timestamp are rebuilt, reading just their snapshots through the
+        (account_handle, timestamp) index; otherwise everything is.
+        """
+        for resolution, (period_sql, next_period) in ROLLUP_RESOLUTIONS.items():
+            period_of = period_sql.format(column="timestamp")
+            if account_handle is None:
+                self.cur.execute("DELETE FROM snapshot_rollups WHERE resolution = ?", (resolution,))
+                where, params = "", ()
+            else:
+                self.cur.execute(f"SELECT {period_sql.format(column='?')}", (timestamp,))
+                period = self.cur.fetchone()[0]
+                self.cur.execute("""
+                    DELETE FROM snapshot_rollups WHERE account_handle = ? AND resolution = ? AND period = ?
+                    """, (account_handle, resolution, period))
+                where = "AND account_handle = ? AND timestamp >= ? AND timestamp < date(?, ?)"
+                params = (account_handle, period, period, next_period)
+
+            self.cur.execute(f"""
+                INSERT INTO snapshot_rollups (account_handle, resolution, period, snapshot_count,
+                                              min_followers, max_followers, last_snapshot_id, total_followers, active_count)
+                SELECT g.account_handle, ?, g.period, g.snapshot_count, g.min_followers, g.max_followers,
+                       s.id, s.total_followers, s.active_count
+                FROM (
+                    SELECT account_handle, {period_of} AS period, COUNT(*) AS snapshot_count,
+                           MIN(total_followers) AS min_followers, MAX(total_followers) AS max_followers,
+                           MAX(id) AS last_id
+                    FROM snapshots
+                    WHERE status = 'complete' {where}
+                    GROUP BY account_handle, period
+                ) g
+                JOIN snapshots s ON s.id = g.last_id
+                """, (resolution, *params))
+
+    def get_in_progress_snapshot(self, account_handle: str):
+        """Return the unfinished snapshot for an account, if there is one"""
+        self.cur.execute("""
+                    SELECT id, cursor, progress FROM snapshots
+                    WHERE account_handle = ? AND status = 'in_progress'
                     ORDER BY id DESC
                     LIMIT 1
-                    """, (snapshot_id, account_handle,))
-        
-        prev_snapshot = cur.fetchone()
-        # If there is no previous snapshot, return nothing
-        if not prev_snapshot:
-            return {}, {}
-        
-        prev_id = prev_snapshot[0]
-
-        # Current EXCEPT previous
-        cur.execute("""
-                    SELECT did, handle FROM snapshot_followers WHERE snapshot_id = ?
-                    EXCEPT
-                    SELECT did, handle FROM snapshot_followers WHERE snapshot_id = ?
-                    """, (snapshot_id, prev_id))
-        new_followers = {row[0]: row[1] for row in cur.fetchall()}
-
-        # Previous EXCEPT current
-        cur.execute("""
-                    SELECT did, handle FROM snapshot_followers WHERE snapshot_id = ?
-                    EXCEPT
-                    SELECT did, handle FROM snapshot_followers WHERE snapshot_id = ?
-                    """, (prev_id, snapshot_id))
-        unfollowed = {row[0]: row[1] for row in cur.fetchall()}
+                    """, (account_handle,))
+        row = self.cur.fetchone()
+        if not row:
+            return None
+        return {"id": row[0], "cursor": row[1], "progress": row[2]}
 
-        return new_followers, unfollowed
+    def get_previous_snapshot_id(self, snapshot_id: int) -> int | None:
+        """Id of the complete snapshot of the same account taken before this one
+
+        Snapshots whose follower detail is archived are skipped, so changes
+        and bitmap deltas are always against one that still has it.
+        """
+        detailed = "AND prev.archive IS NULL" if self.archive_column else ""
+        self.cur.execute(f"""
+                    SELECT prev.id FROM snapshots s
+                    JOIN snapshots prev
+                        ON prev.account_handle = s.account_handle
+                        AND prev.id < s.id
+                        AND prev.status = 'complete'
+                        {detailed}
+                    WHERE s.id = ?
+                    ORDER BY prev.id DESC
+                    LIMIT 1
+                    """, (snapshot_id,))
+        row = self.cur.fetchone()
+        return row[0] if row else None
+
+    @timed(DB_DURATION, operation="save_snapshot_bitmap")
+    def save_snapshot_bitmap(self, snapshot_id: int):
+        """Store the follower bitmap of a snapshot
+
+        Stored as the XOR against the previous snapshot's bitmap, which only
+        has the followers who came or went set, unless the previous one is
+        missing or BITMAP_KEYFRAME_INTERVAL deltas away from a full bitmap.
+        Not committed here.
+        """
+        self.cur.execute("""
+                    SELECT m.follower_id FROM snapshots s
+                    JOIN follower_memberships m
+                        ON m.account_handle = s.account_handle
+                        AND m.start_snapshot_id <= s.id
+                        AND (m.end_snapshot_id IS NULL OR m.end_snapshot_id > s.id)
+                    WHERE s.id = ?
+                    """, (snapshot_id,))
+        self._save_bitmap("snapshot_bitmaps", snapshot_id, _bitmap_from_ids(row[0] for row in self.cur))
+
+    def get_snapshot_bitmap(self, snapshot_id: int) -> int | None:
+        """Follower bitmap of a snapshot as an int, bit i set for followers.id i; None if not stored"""
+        return self._load_bitmap("snapshot_bitmaps", snapshot_id)
+
+    @timed(DB_DURATION, operation="save_snapshot_follows")
+    def save_snapshot_follows(self, snapshot_id: int, follows: list[tuple]):
+        """Store the (did, handle, display_name) accounts followed at a snapshot
+
+        Followed accounts get a followers row like any follower, and are
+        stored as a bitmap over the same ids as the snapshot's followers, so
+        mutuals are a bitwise AND. Deltas and keyframes work as in
+        save_snapshot_bitmap. Not committed here.
+        """
+        follower_ids = {}
+        for batch in _chunks(follows, BULK_CHUNK_SIZE):
+            follower_ids.update(self._upsert_followers({did: (did, handle, None, display_name)
+                                                        for did, handle, display_name in batch}))
+        self._save_bitmap("snapshot_follows", snapshot_id, _bitmap_from_ids(follower_ids.values()))
+
+    def get_snapshot_follows_bitmap(self, snapshot_id: int) -> int | None:
+        """Bitmap of the accounts followed at a snapshot, bit i set for followers.id i; None if not stored"""
+        return self._load_bitmap("snapshot_follows", snapshot_id)
+
+    def _save_bitmap(self, table: str, snapshot_id: int, bitmap: int):
+        """Store a snapshot's full bitmap in a bitmap table, as a delta when _delta_bitmap allows"""
+        stored, base_id, depth = self._delta_bitmap(table, snapshot_id, bitmap)
+        self.cur.execute(f"""
+            INSERT OR REPLACE INTO {table} (snapshot_id, base_snapshot_id, depth, {BITMAP_COUNT_COLUMNS[table]}, bitmap)
+            VALUES (?, ?, ?, ?, ?)
+            """, (snapshot_id, base_id, depth, bitmap.bit_count(), _encode_bitmap(stored)))
+
+    def _delta_bitmap(self, table: str, snapshot_id: int, bitmap: int) -> tuple[int, int | None, int]:
+        """(stored bitmap, base_snapshot_id, depth) to save a snapshot's bitmap to a bitmap table as
+
+        The XOR against the previous snapshot's bitmap, unless that one is
+        missing or BITMAP_KEYFRAME_INTERVAL deltas away from a full bitmap.
+        """
+        prev_id = self.get_previous_snapshot_id(snapshot_id)
+        if prev_id is not None:
+            self.cur.execute(f"SELECT depth FROM {table} WHERE snapshot_id = ?", (prev_id,))
+            row = self.cur.fetchone()
+            if row and row[0] + 1 < BITMAP_KEYFRAME_INTERVAL:
+                return bitmap ^ self._load_bitmap(table, prev_id), prev_id, row[0] + 1
+        return bitmap, None, 0
+
+    def _load_bitmap(self, table: str, snapshot_id: int) -> int | None:
+        """Apply a snapshot's chain of deltas in a bitmap table back to its full bitmap"""
+        bitmap = 0
+        while snapshot_id is not None:
+            self.cur.execute(f"SELECT base_snapshot_id, bitmap FROM {table} WHERE snapshot_id = ?", (snapshot_id,))
+            row = self.cur.fetchone()
+            if not row:
+                return None
+            snapshot_id = row[0]
+            bitmap ^= _decode_bitmap(row[1])
+        return bitmap
+
+    def iter_snapshot_bitmaps(self, account_handle: str):
+        """Yield (snapshot_id, timestamp, bitmap) for an account's complete snapshots, oldest first
+
+        Deltas are applied to the bitmap of the snapshot before, so walking
+        the whole history decodes each stored bitmap once. Snapshots whose
+        follower detail is archived have no bitmap and are left out.
+        """
+        return self._iter_bitmaps("snapshot_bitmaps", account_handle)
+
+    def iter_snapshot_follows_bitmaps(self, account_handle: str):
+        """Yield (snapshot_id, timestamp, bitmap) of the accounts followed, like iter_snapshot_bitmaps"""
+        return self._iter_bitmaps("snapshot_follows", account_handle)
+
+    def _iter_bitmaps(self, table: str, account_handle: str):
+        rows = self.conn.cursor()
+        rows.execute(f"""
+                    SELECT s.id, s.timestamp, b.base_snapshot_id, b.bitmap
+                    FROM snapshots s
+                    JOIN {table} b ON b.snapshot_id = s.id
+                    WHERE s.account_handle = ? AND s.status = 'complete'
+                    ORDER BY s.id
+                    """, (account_handle,))
+        prev_id, bitmap = None, 0
+        for snapshot_id, timestamp, base_id, stored in rows:
+            if base_id is None:
+                bitmap = _decode_bitmap(stored)
+            elif base_id == prev_id:
+                bitmap ^= _decode_bitmap(stored)
+            else:
+                bitmap = self._load_bitmap(table, snapshot_id)
+            prev_id = snapshot_id
+            yield snapshot_id, timestamp, bitmap
+
+    def get_account_snapshot_ids(self, account_handle: str) -> list[int]:
+        """Ids of an account's complete snapshots, oldest first"""
+        self.cur.execute("""
+                    SELECT id FROM snapshots
+                    WHERE account_handle = ? AND status = 'complete'
+                    ORDER BY id
+                    """, (account_handle,))
+        return [row[0] for row in self.cur.fetchall()]
+
+    def get_followers_by_id(self, follower_ids: list[int]) -> dict[int, tuple[str, str]]:
+        """Map followers.id values to (did, latest known handle)"""
+        followers = {}
+        for batch in _chunks(follower_ids, 500):
+            self.cur.execute(f"""
+                        SELECT id, did, handle FROM followers
+                        WHERE id IN ({",".join("?" * len(batch))})
+                        """, batch)
+            followers.update((r[0], (r[1], r[2])) for r in self.cur.fetchall())
+        return followers
+
+    def search_followers(self, query: str, account_handle: str | None = None, limit: int = 20) -> list[dict]:
+        """Followers whose latest handle or display name matches a search, best matches first
+
+        Every word of the query must start a word of the handle or display
+        name, so a partly typed query already matches. The best ranked of
+        the first SEARCH_CANDIDATES matches are returned, which is every
+        match once a few letters are typed. With account_handle, only
+        followers who ever followed that account are searched; without it,
+        accounts that were only ever followed match too, with no history.
+        Each result carries its follow history from get_follow_history.
+        """
+        match = _search_query(query)
+        if not match:
+            return []
+
+        account_filter = """
+            AND EXISTS (
+                SELECT 1 FROM follower_memberships m
+                WHERE m.follower_id = followers_fts.rowid AND m.account_handle = ?
+            )
+        """ if account_handle else ""
+        self.cur.execute(f"""
+                    SELECT f.id, f.did, f.handle, f.display_name
+                    FROM (
+                        SELECT rowid, rank FROM followers_fts
+                        WHERE followers_fts MATCH ? {account_filter}
+                        LIMIT ?
+                    ) c
+                    JOIN followers f ON f.id = c.rowid
+                    ORDER BY c.rank
+                    LIMIT ?
+                    """, (match, *([account_handle] if account_handle else []), SEARCH_CANDIDATES, limit))
+        rows = self.cur.fetchall()
+
+        history = self.get_follow_history([r[0] for r in rows], account_handle)
+        return [
+            {"did": r[1], "handle": r[2], "display_name": r[3], "accounts": history.get(r[0], [])}
+            for r in rows
+        ]
+
+    def get_follow_history(self, follower_ids: list[int], account_handle: str | None = None) -> dict[int, list[dict]]:
+        """When followers first and last followed each account, and whether they still do, by followers.id
+
+        first_seen and last_seen are the times of the first and latest
+        snapshots the follower was in; follows counts separate runs of
+        following, so a follower who left and came back has two.
+        """
+        history = {}
+        for batch in _chunks(follower_ids, 500):
+            # Unary + keeps the planner on the follower index rather than scanning the account's memberships
+            account_filter = "AND +account_handle = ?" if account_handle else ""
+            self.cur.execute(f"""
+                        SELECT h.follower_id, h.account_handle, first.timestamp, last.timestamp, h.following, h.follows
+                        FROM (
+                            SELECT follower_id, account_handle,
+                                   MIN(start_snapshot_id) AS first_snapshot_id,
+                                   MAX(last_seen_snapshot_id) AS last_snapshot_id,
+                                   MAX(end_snapshot_id IS NULL) AS following,
+                                   COUNT(*) AS follows
+                            FROM follower_memberships
+                            WHERE follower_id IN ({",".join("?" * len(batch))}) {account_filter}
+                            GROUP BY follower_id, account_handle
+                        ) h
+                        JOIN snapshots first ON first.id = h.first_snapshot_id
+                        JOIN snapshots last ON last.id = h.last_snapshot_id
+                        ORDER BY h.account_handle
+                        """, (*batch, account_handle) if account_handle else batch)
+            for r in self.cur.fetchall():
+                history.setdefault(r[0], []).append({
+                    "account_handle": r[1],
+                    "first_seen": r[2],
+                    "last_seen": r[3],
+                    "following": bool(r[4]),
+                    "follows": r[5],
+                })
+        return history
+
+    @timed(DB_DURATION, operation="save_snapshot_changes")
+    def save_snapshot_changes(self, snapshot_id: int):
+        """Diff a snapshot against the previous one by DID and store the result
+
+        A follower whose handle changed between the two is a rename, not an
+        unfollow and a new follow. Not committed here, so the changes land
+        with the snapshot that completes them.
+        """
+        self.cur.execute("DELETE FROM snapshot_changes WHERE snapshot_id = ?", (snapshot_id,))
+
+        # The first snapshot of an account has nothing to compare against
+        prev_id = self.get_previous_snapshot_id(snapshot_id)
+        if prev_id is None:
+            return
+
+        # Index both memberships by DID so each side of the diff is a lookup, not a scan
+        for table, members_of in (("current_members", snapshot_id), ("previous_members", prev_id)):
+            self.cur.execute(f"DROP TABLE IF EXISTS temp.{table}")
+            self.cur.execute(f"CREATE TEMP TABLE {table} (did TEXT PRIMARY KEY, handle TEXT) WITHOUT ROWID")
+            self.cur.execute(f"""
+                    INSERT OR REPLACE INTO {table} (did, handle)
+                    SELECT did, handle FROM ({SNAPSHOT_MEMBERS_SQL})
+                    """, (members_of,))
+
+        self.cur.execute("""
+                    INSERT INTO snapshot_changes (snapshot_id, did, change, handle, previous_handle)
+                    SELECT ?, c.did, 'follow', c.handle, NULL
+                    FROM current_members c
+                    WHERE NOT EXISTS (SELECT 1 FROM previous_members p WHERE p.did = c.did)
+                    UNION ALL
+                    SELECT ?, c.did, 'rename', c.handle, p.handle
+                    FROM current_members c
+                    JOIN previous_members p ON p.did = c.did
+                    WHERE p.handle IS NOT c.handle
+                    UNION ALL
+                    SELECT ?, p.did, 'unfollow', p.handle, NULL
+                    FROM previous_members p
+                    WHERE NOT EXISTS (SELECT 1 FROM current_members c WHERE c.did = p.did)
+                    """, (snapshot_id, snapshot_id, snapshot_id))
+
+        self.cur.execute("DROP TABLE temp.current_members")
+        self.cur.execute("DROP TABLE temp.previous_members")
+
+    def get_follower_changes(self, snapshot_id: int):
+        """Return (new followers, unfollows, renames) since the previous snapshot
+
+        New followers and unfollows map DID to handle; renames map DID to
+        (previous handle, handle).
+        """
+        self.cur.execute("""
+                    SELECT did, change, handle, previous_handle FROM snapshot_changes
+                    WHERE snapshot_id = ?
+                    ORDER BY handle COLLATE NOCASE
+                    """, (snapshot_id,))
+
+        new_followers, unfollowed, renamed = {}, {}, {}
+        for did, change, handle, previous_handle in self.cur.fetchall():
+            if change == "follow":
+                new_followers[did] = handle
+            elif change == "unfollow":
+                unfollowed[did] = handle
+            else:
+                renamed[did] = (previous_handle, handle)
+
+        return new_followers, unfollowed, renamed
 
     def add_follower(self, 
                      snapshot_id: int | None, 
@@ -104,13 +900,190 @@ class Database():
                      handle: str, 
                      last_posted_at: str | None, 
                      display_name: str | None):
-        self.cur.execute("""
-            INSERT INTO snapshot_followers (snapshot_id, did, handle, last_posted_at, display_name)
-            VALUES (?, ?, ?, ?, ?)
-            """, (snapshot_id, did, handle, last_posted_at, display_name,)
-            )
+        self.add_followers(snapshot_id, [(did, handle, last_posted_at, display_name)])
         # commit at the _end_ of the snapshot, not per-follower
 
+    @timed(DB_DURATION, operation="add_followers")
+    def add_followers(self, snapshot_id: int, followers: list[tuple]):
+        """Record (did, handle, last_posted_at, display_name) rows as present in a snapshot
+
+        Only new memberships and changed attributes are written. Call
+        close_memberships once every follower of the snapshot has been added.
+        """
+        if not followers:
+            return
+
+        self.cur.execute("SELECT account_handle FROM snapshots WHERE id = ?", (snapshot_id,))
+        account_handle = self.cur.fetchone()[0]
+
+        # Latest row wins if a DID appears more than once
+        rows = {row[0]: row for row in followers}
+        follower_ids = self._upsert_followers(rows)
+
+        memberships = self._open_memberships(account_handle, list(follower_ids.values()))
+        new_members = [fid for fid in follower_ids.values() if fid not in memberships]
+        if new_members:
+            self.cur.executemany("""
+                INSERT INTO follower_memberships (account_handle, follower_id, start_snapshot_id, last_seen_snapshot_id)
+                VALUES (?, ?, ?, ?)
+                """, ((account_handle, fid, snapshot_id, snapshot_id) for fid in new_members))
+            memberships.update(self._open_memberships(account_handle, new_members))
+
+        self.cur.executemany("""
+            UPDATE follower_memberships SET last_seen_snapshot_id = ? WHERE id = ?
+            """, ((snapshot_id, membership_id) for membership_id in memberships.values()))
+
+        # Compare against the values this snapshot would otherwise inherit
+        current = self._attributes_at(list(memberships.values()), snapshot_id)
+
+        changes = []
+        for did, handle, last_posted_at, display_name in rows.values():
+            membership_id = memberships[follower_ids[did]]
+            if current.get(membership_id) != (handle, last_posted_at, display_name):
+                changes.append((membership_id, snapshot_id, handle, display_name, last_posted_at))
+
+        self.cur.executemany("""
+            INSERT OR REPLACE INTO follower_attributes (membership_id, snapshot_id, handle, display_name, last_posted_at)
+            VALUES (?, ?, ?, ?, ?)
+            """, changes)
+
+    def _attributes_at(self, membership_ids: list[int], snapshot_id: int) -> dict[int, tuple]:
+        """(handle, last_posted_at, display_name) of memberships as of a snapshot, by membership id"""
+        current = {}
+        for batch in _chunks(membership_ids, 500):
+            self.cur.execute(f"""
+                        SELECT a.membership_id, a.handle, a.last_posted_at, a.display_name
+                        FROM follower_attributes a
+                        WHERE a.membership_id IN ({",".join("?" * len(batch))})
+                        AND a.snapshot_id = (
+                            SELECT MAX(snapshot_id) FROM follower_attributes
+                            WHERE membership_id = a.membership_id AND snapshot_id <= ?
+                        )
+                        """, (*batch, snapshot_id))
+            current.update((r[0], r[1:]) for r in self.cur.fetchall())
+        return current
+
+    def _upsert_followers(self, rows: dict[str, tuple]) -> dict[str, int]:
+        """Insert or update the followers rows of (did, handle, last_posted_at, display_name) rows keyed by DID
+
+        Returns followers.id by DID. New and renamed followers are indexed
+        for search. Not committed here.
+        """
+        dids = list(rows)
+
+        existing = {}
+        for batch in _chunks(dids, 500):
+            self.cur.execute(f"""
+                        SELECT did, id, handle, display_name FROM followers
+                        WHERE did IN ({",".join("?" * len(batch))})
+                        """, batch)
+            existing.update((r[0], r[1:]) for r in self.cur.fetchall())
+
+        self.cur.executemany("""
+            INSERT INTO followers (did, handle, display_name)
+            VALUES (?, ?, ?)
+            ON CONFLICT(did) DO UPDATE SET
+                handle = excluded.handle,
+                display_name = excluded.display_name
+            WHERE handle IS NOT excluded.handle OR display_name IS NOT excluded.display_name
+            """, ((did, handle, display_name) for did, handle, _, display_name in rows.values()))
+
+        follower_ids = {did: values[0] for did, values in existing.items()}
+        for batch in _chunks([did for did in dids if did not in existing], 500):
+            self.cur.execute(f"""
+                        SELECT did, id FROM followers
+                        WHERE did IN ({",".join("?" * len(batch))})
+                        """, batch)
+            follower_ids.update(self.cur.fetchall())
+
+        self._index_followers(rows, existing, follower_ids)
+        return follower_ids
+
+    def _index_followers(self, rows: dict[str, tuple], existing: dict[str, tuple], follower_ids: dict[str, int]):
+        """Add new followers, and the new handle or display name of changed ones, to the search index
+
+        Indexing a whole batch from here costs a fraction of doing it row by
+        row from triggers. existing holds (id, handle, display_name) as
+        stored before the batch was upserted.
+        """
+        stale = []
+        fresh = []
+        for did, (_, handle, _, display_name) in rows.items():
+            if did in existing:
+                follower_id, previous_handle, previous_display_name = existing[did]
+                if (previous_handle, previous_display_name) == (handle, display_name):
+                    continue
+                stale.append((follower_id, previous_handle, previous_display_name))
+            fresh.append((follower_ids[did], handle, display_name))
+
+        self.cur.executemany("""
+            INSERT INTO followers_fts (followers_fts, rowid, handle, display_name) VALUES ('delete', ?, ?, ?)
+            """, stale)
+        self.cur.executemany("""
+            INSERT INTO followers_fts (rowid, handle, display_name) VALUES (?, ?, ?)
+            """, fresh)
+
+    @timed(DB_DURATION, operation="bulk_add_followers")
+    def bulk_add_followers(
+            self,
+            snapshot_id: int,
+            followers: Iterable[tuple],
+            chunk_size: int = BULK_CHUNK_SIZE,
+            commit_chunks: bool = False
+    ) -> int:
+        """Add any number of (did, handle, last_posted_at, display_name) rows to a snapshot
+
+        Rows are consumed lazily, chunk_size at a time, so followers can be
+        a generator. Nothing is committed unless commit_chunks is set, so by
+        default the whole snapshot is one transaction. Returns the number of
+        rows added.
+        """
+        followers = iter(followers)
+        added = 0
+        while chunk := list(islice(followers, chunk_size)):
+            self.add_followers(snapshot_id, chunk)
+            added += len(chunk)
+            if commit_chunks:
+                self.conn.commit()
+        return added
+
+    @contextmanager
+    def deferred_indexes(self):
+        """Drop the secondary membership indexes for a bulk load and rebuild them after
+
+        If the load fails and is rolled back, the indexes are recreated the
+        next time the database is opened.
+        """
+        for name in MEMBERSHIP_INDEXES:
+            self.cur.execute(f"DROP INDEX IF EXISTS {name}")
+        try:
+            yield
+        finally:
+            for index_sql in MEMBERSHIP_INDEXES.values():
+                self.cur.execute(index_sql)
+
+    def _open_memberships(self, account_handle: str, follower_ids: list[int]):
+        """Map follower id to its open membership id for an account"""
+        memberships = {}
+        for batch in _chunks(follower_ids, 500):
+            self.cur.execute(f"""
+                        SELECT follower_id, id FROM follower_memberships
+                        WHERE account_handle = ? AND end_snapshot_id IS NULL
+                        AND follower_id IN ({",".join("?" * len(batch))})
+                        """, (account_handle, *batch))
+            memberships.update(self.cur.fetchall())
+        return memberships
+
+    @timed(DB_DURATION, operation="close_memberships")
+    def close_memberships(self, snapshot_id: int):
+        """End the memberships of followers that were not seen in a snapshot"""
+        self.cur.execute("""
+            UPDATE follower_memberships SET end_snapshot_id = ?
+            WHERE account_handle = (SELECT account_handle FROM snapshots WHERE id = ?)
+            AND end_snapshot_id IS NULL
+            AND last_seen_snapshot_id < ?
+            """, (snapshot_id, snapshot_id, snapshot_id))
+
     def get_last_snapshot(self):
         snapshot = self.get_recent_snapshots(limit=1)
         return snapshot[0]
@@ -118,40 +1091,71 @@ class Database():
     def get_last_snapshot_id(self):
         self.cur.execute("""
                         SELECT id FROM snapshots
+                        WHERE status = 'complete'
                         ORDER BY timestamp DESC
                         LIMIT 1
                         """)
         return self.cur.fetchone()[0]
 
         
-    def get_recent_snapshots(self, limit: int = 30):
+    def get_data_version(self) -> tuple:
+        """Cheap fingerprint of what the dashboard shows
+
+        Changes whenever a snapshot completes, is removed, archived or
+        restored, or a follow event arrives, so rendered pages can be cached
+        until it does.
+        """
         self.cur.execute("""
-                    SELECT id, timestamp, account_handle, total_followers, active_count, never_posted_count, disabled_count
+                    SELECT
+                        (SELECT COUNT(*) FROM snapshots WHERE status = 'complete'),
+                        (SELECT MAX(id) FROM snapshots WHERE status = 'complete'),
+                        (SELECT MAX(id) FROM follow_events),
+                        (SELECT COUNT(*) FROM snapshots WHERE archive IS NOT NULL)
+                    """)
+        return tuple(value or 0 for value in self.cur.fetchone())
+
+    def get_snapshot(self, snapshot_id: int):
+        """Return a complete snapshot by id, or None"""
+        self.cur.execute(f"""
+                    SELECT {SNAPSHOT_COLUMNS}
                     FROM snapshots
+                    WHERE id = ? AND status = 'complete'
+                    """, (snapshot_id,))
+        r = self.cur.fetchone()
+        return _snapshot_from_row(r) if r else None
+
+    def get_recent_snapshots(self, limit: int = 30, account_handle: str | None = None):
+        """Latest complete snapshots first, of every account or just account_handle"""
+        account_filter = "AND account_handle = ?" if account_handle else ""
+        self.cur.execute(f"""
+                    SELECT {SNAPSHOT_COLUMNS}
+                    FROM snapshots
+                    WHERE status = 'complete' {account_filter}
                     ORDER BY timestamp DESC
                     LIMIT ?
-                    """, (limit,))
-        rows = self.cur.fetchall()
-        return [
-            {
-                "id": r[0],
-                "timestamp": r[1],
-                "account_handle": r[2],
-                "total_followers": r[3],
-                "active_count": r[4],
-                "never_posted_count": r[5],
-                "disabled_count": r[6],
-            }
-            for r in rows
-        ]
+                    """, (account_handle, limit) if account_handle else (limit,))
+        return [_snapshot_from_row(r) for r in self.cur.fetchall()]
+
+    def get_latest_snapshots(self):
+        """Latest complete snapshot of each account, by account handle"""
+        self.cur.execute(f"""
+                    SELECT {SNAPSHOT_COLUMNS}
+                    FROM snapshots
+                    WHERE id IN (
+                        SELECT MAX(id) FROM snapshots
+                        WHERE status = 'complete'
+                        GROUP BY account_handle
+                    )
+                    ORDER BY account_handle
+                    """)
+        return [_snapshot_from_row(r) for r in self.cur.fetchall()]
 
     def get_snapshot_followers(self, 
                                snapshot_id: int, limit: int = 200, 
                                offset: int = 0):
-        self.cur.execute("""
+        self.cur.execute(f"""
                         SELECT did, handle, last_posted_at, display_name
-                        FROM snapshot_followers
-                        WHERE snapshot_id = ?
+                        FROM ({SNAPSHOT_MEMBERS_SQL})
                         ORDER BY handle COLLATE NOCASE
                         LIMIT ? OFFSET ?
                         """, (snapshot_id, limit, offset))
@@ -161,17 +1165,821 @@ class Database():
             for r in rows
         ]
 
-    def get_snapshot_series(self, account_handle: str, limit: int = 100):
-        """Return chronological series for charing: oldest->newest."""
-        self.cur.execute("""
-            SELECT 
-                         strftime('%Y-%m-%d', timestamp) as date, 
-                         total_followers, 
-                         active_count
-            FROM snapshots
-            WHERE account_handle = ?
-            ORDER BY timestamp ASC
-            LIMIT ?                 
-        """, (account_handle, limit,))
+    def get_snapshot_followers_page(self, snapshot_id: int, cursor: int = 0, limit: int = 200):
+        """Return (followers, next_cursor) for one page of a snapshot
+
+        Pages are keyed on membership id rather than an offset, so every
+        page is an index range scan however deep it is. Pass the returned
+        cursor to get the next page; it is None after the last one.
+        """
+        self.cur.execute(f"""
+                        SELECT membership_id, did, handle, last_posted_at, display_name
+                        FROM ({SNAPSHOT_MEMBERS_SQL})
+                        WHERE membership_id > ?
+                        ORDER BY membership_id
+                        LIMIT ?
+                        """, (snapshot_id, cursor, limit + 1))
         rows = self.cur.fetchall()
-        return [{"timestamp": r[0], "total_followers": r[1], "active_count": r[2]} for r in rows]
\ No newline at end of file
+
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return [
+            {"did": r[1], "handle": r[2], "last_posted_at": r[3], "display_name": r[4]}
+            for r in rows[:limit]
+        ], next_cursor
+
+    def iter_snapshot_followers(self, snapshot_id: int, batch_size: int = 1000):
+        """Yield every follower of a snapshot, reading one page at a time"""
+        cursor = 0
+        while cursor is not None:
+            followers, cursor = self.get_snapshot_followers_page(snapshot_id, cursor, batch_size)
+            yield from followers
+
+    def get_detailed_snapshots(self) -> list[tuple]:
+        """(id, account_handle, timestamp, pinned) of complete snapshots whose follower detail is stored, oldest first"""
+        self.cur.execute("""
+                    SELECT id, account_handle, timestamp, pinned FROM snapshots
+                    WHERE status = 'complete' AND archive IS NULL
+                    ORDER BY id
+                    """)
+        return self.cur.fetchall()
+
+    def iter_followers_since(self, snapshot_id: int, since_id: int):
+        """Yield (did, handle, last_posted_at, display_name) of a snapshot's followers who were missing
+        from an earlier snapshot of the account, or whose attributes changed since it"""
+        rows = self.conn.cursor()
+        rows.execute("""
+                    SELECT f.did, a.handle, a.last_posted_at, a.display_name
+                    FROM snapshots s
+                    JOIN follower_memberships m
+                        ON m.account_handle = s.account_handle
+                        AND m.start_snapshot_id <= s.id
+                        AND (m.end_snapshot_id IS NULL OR m.end_snapshot_id > s.id)
+                    JOIN followers f ON f.id = m.follower_id
+                    JOIN follower_attributes a
+                        ON a.membership_id = m.id
+                        AND a.snapshot_id = (
+                            SELECT MAX(snapshot_id) FROM follower_attributes
+                            WHERE membership_id = m.id AND snapshot_id <= s.id
+                        )
+                    WHERE s.id = ? AND (
+                        m.start_snapshot_id > ?
+                        OR EXISTS (
+                            SELECT 1 FROM follower_attributes c
+                            WHERE c.membership_id = m.id AND c.snapshot_id > ? AND c.snapshot_id <= s.id
+                        )
+                    )
+                    """, (snapshot_id, since_id, since_id))
+        yield from rows
+
+    def iter_followers_gone(self, snapshot_id: int, since_id: int):
+        """Yield the DIDs of followers in an earlier snapshot of the account whose run of following ended by this one
+
+        A follower who came back in between is also yielded by
+        iter_followers_since.
+        """
+        rows = self.conn.cursor()
+        rows.execute("""
+                    SELECT f.did FROM follower_memberships m
+                    JOIN followers f ON f.id = m.follower_id
+                    WHERE m.account_handle = (SELECT account_handle FROM snapshots WHERE id = ?)
+                    AND m.start_snapshot_id <= ? AND m.end_snapshot_id > ? AND m.end_snapshot_id <= ?
+                    """, (snapshot_id, since_id, since_id, snapshot_id))
+        for row in rows:
+            yield row[0]
+
+    def get_follower_rows(self, follower_ids: list[int]) -> list[tuple]:
+        """(did, handle, display_name) of followers by followers.id"""
+        rows = []
+        for batch in _chunks(follower_ids, 500):
+            self.cur.execute(f"""
+                        SELECT did, handle, display_name FROM followers
+                        WHERE id IN ({",".join("?" * len(batch))})
+                        """, batch)
+            rows.extend(self.cur.fetchall())
+        return rows
+
+    @timed(DB_DURATION, operation="remove_snapshot_detail")
+    def remove_snapshot_detail(self, snapshot_ids: list[int], archive: str) -> int:
+        """Drop the follower detail of some of an account's snapshots, now held by an archive file
+
+        Their rows in snapshots, and so every aggregate, stay. Bitmaps
+        stored as deltas against a removed one are stored again, attribute
+        changes superseded before the next snapshot with detail and
+        memberships falling entirely between snapshots with detail are
+        deleted, and the next snapshot's changes are taken again against the
+        one now before it. Membership runs are never shortened, so every
+        snapshot keeping its detail reads exactly the followers it did.
+        Returns the number of memberships deleted. Not committed here.
+        """
+        placeholders = ",".join("?" * len(snapshot_ids))
+        self.cur.execute(f"SELECT DISTINCT account_handle FROM snapshots WHERE id IN ({placeholders})", snapshot_ids)
+        (account_handle,), = self.cur.fetchall()
+        last_id = max(snapshot_ids)
+
+        # Full bitmaps of the snapshots whose deltas are against a removed one, read before their bases go
+        rebased = {}
+        for table in BITMAP_COUNT_COLUMNS:
+            self.cur.execute(f"""
+                        SELECT snapshot_id FROM {table}
+                        WHERE base_snapshot_id IN ({placeholders}) AND snapshot_id NOT IN ({placeholders})
+                        ORDER BY snapshot_id
+                        """, (*snapshot_ids, *snapshot_ids))
+            rebased[table] = [(row[0], self._load_bitmap(table, row[0])) for row in self.cur.fetchall()]
+            self.cur.execute(f"DELETE FROM {table} WHERE snapshot_id IN ({placeholders})", snapshot_ids)
+
+        self.cur.execute(f"DELETE FROM snapshot_changes WHERE snapshot_id IN ({placeholders})", snapshot_ids)
+        self.cur.executemany("UPDATE snapshots SET archive = ? WHERE id = ?",
+                             ((archive, snapshot_id) for snapshot_id in snapshot_ids))
+
+        # Oldest first, so each is XORed against one already stored again
+        for table, bitmaps in rebased.items():
+            for snapshot_id, bitmap in bitmaps:
+                self._save_bitmap(table, snapshot_id, bitmap)
+
+        # Every archived snapshot since the last one with detail, and the next one with detail after it
+        self.cur.execute("DROP TABLE IF EXISTS temp.archived_snapshots")
+        self.cur.execute("CREATE TEMP TABLE archived_snapshots (snapshot_id INTEGER PRIMARY KEY, next_id INTEGER)")
+        self.cur.execute("""
+                    INSERT INTO archived_snapshots (snapshot_id, next_id)
+                    SELECT s.id, (
+                        SELECT MIN(n.id) FROM snapshots n
+                        WHERE n.account_handle = s.account_handle AND n.id > s.id AND n.archive IS NULL
+                    )
+                    FROM snapshots s
+                    WHERE s.account_handle = ? AND s.archive IS NOT NULL AND s.id <= ?
+                    AND s.id > COALESCE((
+                        SELECT MAX(id) FROM snapshots
+                        WHERE account_handle = ? AND id < ? AND archive IS NULL
+                    ), 0)
+                    """, (account_handle, last_id, account_handle, min(snapshot_ids)))
+        self.cur.execute("SELECT MIN(snapshot_id) FROM archived_snapshots")
+        first_id = self.cur.fetchone()[0]
+
+        # A snapshot reads the latest attribute change at or before it, so a change at an archived
+        # snapshot followed by another before the next snapshot with detail is never read
+        self.cur.execute("""
+                    DELETE FROM follower_attributes WHERE (membership_id, snapshot_id) IN (
+                        SELECT a.membership_id, a.snapshot_id
+                        FROM (
+                            SELECT membership_id, snapshot_id,
+                                   LEAD(snapshot_id) OVER (PARTITION BY membership_id ORDER BY snapshot_id) AS next_change
+                            FROM follower_attributes
+                            WHERE membership_id IN (
+                                SELECT id FROM follower_memberships
+                                WHERE account_handle = ? AND start_snapshot_id <= ?
+                                AND (end_snapshot_id IS NULL OR end_snapshot_id > ?)
+                            )
+                        ) a
+                        JOIN archived_snapshots t ON t.snapshot_id = a.snapshot_id
+                        WHERE a.next_change <= t.next_id
+                    )
+                    """, (account_handle, last_id, first_id))
+        self.cur.execute("DROP TABLE temp.archived_snapshots")
+
+        self.cur.execute("""
+                    SELECT m.id FROM follower_memberships m
+                    WHERE m.account_handle = ? AND m.start_snapshot_id <= ? AND m.end_snapshot_id > ?
+                    AND NOT EXISTS (
+                        SELECT 1 FROM snapshots s
+                        WHERE s.account_handle = m.account_handle AND s.archive IS NULL
+                        AND s.id >= m.start_snapshot_id AND s.id < m.end_snapshot_id
+                    )
+                    """, (account_handle, last_id, first_id))
+        dropped = [row[0] for row in self.cur.fetchall()]
+        for batch in _chunks(dropped, 500):
+            placeholders = ",".join("?" * len(batch))
+            self.cur.execute(f"DELETE FROM follower_attributes WHERE membership_id IN ({placeholders})", batch)
+            self.cur.execute(f"DELETE FROM follower_memberships WHERE id IN ({placeholders})", batch)
+
+        self.cur.execute("""
+                    SELECT MIN(id) FROM snapshots
+                    WHERE account_handle = ? AND id > ? AND status = 'complete' AND archive IS NULL
+                    """, (account_handle, last_id))
+        next_id = self.cur.fetchone()[0]
+        if next_id is not None:
+            self.save_snapshot_changes(next_id)
+        return len(dropped)
+
+    @timed(DB_DURATION, operation="restore_snapshot_detail")
+    def restore_snapshot_detail(self, snapshot_id: int, followers: Iterable[tuple], follows: list[tuple] | None):
+        """Put back an archived snapshot's (did, handle, last_posted_at, display_name) followers and
+        (did, handle, display_name) follows, and pin it so retention keeps them
+
+        Only what this snapshot alone reads is added: a follower no run
+        covers gets one ending at the next snapshot, joined up with a run
+        ending here or starting there, and an attribute change here is
+        undone at the next snapshot if that one would otherwise inherit it.
+        Every other snapshot reads the followers it did before. Followers
+        already stored keep their latest handle. Not committed here.
+        """
+        self.cur.execute("SELECT account_handle FROM snapshots WHERE id = ?", (snapshot_id,))
+        account_handle = self.cur.fetchone()[0]
+        self.cur.execute("SELECT MIN(id) FROM snapshots WHERE account_handle = ? AND id > ?", (account_handle, snapshot_id))
+        next_id = self.cur.fetchone()[0]
+
+        for batch in _chunks(list(followers), BULK_CHUNK_SIZE):
+            rows = {row[0]: row for row in batch}
+            follower_ids = self._follower_ids(rows)
+            covering = self._restore_memberships(account_handle, snapshot_id, next_id, list(follower_ids.values()))
+
+            current = self._attributes_at([membership_id for membership_id, _ in covering.values()], snapshot_id)
+            inherited = set()
+            if next_id is not None:
+                for ids in _chunks([membership_id for membership_id, _ in covering.values()], 500):
+                    self.cur.execute(f"""
+                                SELECT membership_id FROM follower_attributes
+                                WHERE snapshot_id = ? AND membership_id IN ({",".join("?" * len(ids))})
+                                """, (next_id, *ids))
+                    inherited.update(row[0] for row in self.cur.fetchall())
+
+            changes = []
+            for did, handle, last_posted_at, display_name in rows.values():
+                membership_id, end_id = covering[follower_ids[did]]
+                previous = current.get(membership_id)
+                if previous == (handle, last_posted_at, display_name):
+                    continue
+                changes.append((membership_id, snapshot_id, handle, display_name, last_posted_at))
+                covers_next = next_id is not None and (end_id is None or end_id > next_id)
+                if previous and covers_next and membership_id not in inherited:
+                    changes.append((membership_id, next_id, previous[0], previous[2], previous[1]))
+            self.cur.executemany("""
+                INSERT OR REPLACE INTO follower_attributes (membership_id, snapshot_id, handle, display_name, last_posted_at)
+                VALUES (?, ?, ?, ?, ?)
+                """, changes)
+
+        self.save_snapshot_bitmap(snapshot_id)
+        if follows is not None:
+            follower_ids = {}
+            for batch in _chunks(follows, BULK_CHUNK_SIZE):
+                follower_ids.update(self._follower_ids({did: (did, handle, None, display_name)
+                                                        for did, handle, display_name in batch}))
+            self._save_bitmap("snapshot_follows", snapshot_id, _bitmap_from_ids(follower_ids.values()))
+
+        self.cur.execute("UPDATE snapshots SET archive = NULL, pinned = 1 WHERE id = ?", (snapshot_id,))
+        self.save_snapshot_changes(snapshot_id)
+        self.cur.execute("""
+                    SELECT MIN(id) FROM snapshots
+                    WHERE account_handle = ? AND id > ? AND status = 'complete' AND archive IS NULL
+                    """, (account_handle, snapshot_id))
+        following_id = self.cur.fetchone()[0]
+        if following_id is not None:
+            self.save_snapshot_changes(following_id)
+
+    def _restore_memberships(self, account_handle: str, snapshot_id: int, next_id: int | None,
+                             follower_ids: list[int]) -> dict[int, tuple]:
+        """Make a run cover a snapshot for each follower, as restore_snapshot_detail describes
+
+        Returns (membership id, end_snapshot_id) by follower id.
+        """
+        covering = self._covering_memberships(account_handle, snapshot_id, follower_ids)
+        uncovered = [follower_id for follower_id in follower_ids if follower_id not in covering]
+
+        ending, starting = {}, {}
+        for batch in _chunks(uncovered, 500):
+            # Unary + keeps the planner on the follower index rather than scanning the account's memberships
+            self.cur.execute(f"""
+                        SELECT id, follower_id, start_snapshot_id, end_snapshot_id, last_seen_snapshot_id
+                        FROM follower_memberships
+                        WHERE +account_handle = ? AND follower_id IN ({",".join("?" * len(batch))})
+                        AND (end_snapshot_id = ? OR start_snapshot_id = ?)
+                        """, (account_handle, *batch, snapshot_id, next_id))
+            for membership_id, follower_id, start_id, end_id, last_seen_id in self.cur.fetchall():
+                if end_id == snapshot_id:
+                    ending[follower_id] = membership_id
+                else:
+                    starting[follower_id] = (membership_id, end_id, last_seen_id)
+
+        for follower_id in uncovered:
+            before, after = ending.get(follower_id), starting.get(follower_id)
+            if before and after:
+                # The run after this snapshot joins the one before it
+                after_id, end_id, last_seen_id = after
+                self.cur.execute("UPDATE follower_attributes SET membership_id = ? WHERE membership_id = ?",
+                                 (before, after_id))
+                self.cur.execute("DELETE FROM follower_memberships WHERE id = ?", (after_id,))
+                self.cur.execute("""
+                    UPDATE follower_memberships SET end_snapshot_id = ?, last_seen_snapshot_id = ? WHERE id = ?
+                    """, (end_id, last_seen_id, before))
+            elif before:
+                self.cur.execute("""
+                    UPDATE follower_memberships SET end_snapshot_id = ?, last_seen_snapshot_id = ? WHERE id = ?
+                    """, (next_id, snapshot_id, before))
+            elif after:
+                self.cur.execute("UPDATE follower_memberships SET start_snapshot_id = ? WHERE id = ?",
+                                 (snapshot_id, after[0]))
+            else:
+                self.cur.execute("""
+                    INSERT INTO follower_memberships (account_handle, follower_id, start_snapshot_id, end_snapshot_id, last_seen_snapshot_id)
+                    VALUES (?, ?, ?, ?, ?)
+                    """, (account_handle, follower_id, snapshot_id, next_id, snapshot_id))
+
+        covering.update(self._covering_memberships(account_handle, snapshot_id, uncovered))
+        return covering
+
+    def _covering_memberships(self, account_handle: str, snapshot_id: int, follower_ids: list[int]) -> dict[int, tuple]:
+        """(membership id, end_snapshot_id) of the run covering a snapshot, by follower id"""
+        covering = {}
+        for batch in _chunks(follower_ids, 500):
+            self.cur.execute(f"""
+                        SELECT follower_id, id, end_snapshot_id FROM follower_memberships
+                        WHERE +account_handle = ? AND follower_id IN ({",".join("?" * len(batch))})
+                        AND start_snapshot_id <= ? AND (end_snapshot_id IS NULL OR end_snapshot_id > ?)
+                        """, (account_handle, *batch, snapshot_id, snapshot_id))
+            covering.update((r[0], r[1:]) for r in self.cur.fetchall())
+        return covering
+
+    def _follower_ids(self, rows: dict[str, tuple]) -> dict[str, int]:
+        """followers.id of (did, handle, last_posted_at, display_name) rows keyed by DID
+
+        Followers not stored yet are added; stored ones keep their latest
+        handle and display name. Not committed here.
+        """
+        follower_ids = {}
+        for batch in _chunks(list(rows), 500):
+            self.cur.execute(f"""
+                        SELECT did, id FROM followers
+                        WHERE did IN ({",".join("?" * len(batch))})
+                        """, batch)
+            follower_ids.update(self.cur.fetchall())
+        missing = {did: row for did, row in rows.items() if did not in follower_ids}
+        if missing:
+            follower_ids.update(self._upsert_followers(missing))
+        return follower_ids
+
+    def delete_orphan_followers(self, keep: set[int]) -> int:
+        """Delete the followers rows no membership refers to, other than keep, from the table and search index
+
+        Accounts that were only ever followed are referred to by follows
+        bitmaps alone, so every id set in a stored one must be in keep.
+        Returns the number deleted. Not committed here.
+        """
+        self.cur.execute("""
+                    SELECT id, handle, display_name FROM followers f
+                    WHERE NOT EXISTS (SELECT 1 FROM follower_memberships m WHERE m.follower_id = f.id)
+                    """)
+        orphans = [row for row in self.cur.fetchall() if row[0] not in keep]
+        self.cur.executemany("""
+            INSERT INTO followers_fts (followers_fts, rowid, handle, display_name) VALUES ('delete', ?, ?, ?)
+            """, orphans)
+        self.cur.executemany("DELETE FROM followers WHERE id = ?", ((row[0],) for row in orphans))
+        return len(orphans)
+
+    def incremental_vacuum_enabled(self) -> bool:
+        """Whether freed pages can be handed back to the filesystem with incremental_vacuum"""
+        self.cur.execute("PRAGMA auto_vacuum")
+        return self.cur.fetchone()[0] == 2
+
+    def enable_incremental_vacuum(self) -> bool:
+        """Switch a database created before incremental vacuum to it, returning whether it had to
+
+        Takes one full VACUUM, which rewrites the whole file, needs as much
+        free disk again and holds the write lock throughout; readers carry
+        on meanwhile, writers wait. Only run on request, never on a schedule.
+        """
+        if self.incremental_vacuum_enabled():
+            return False
+        self.conn.commit()
+        self.cur.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self.cur.execute("VACUUM")
+        return True
+
+    def get_free_pages(self) -> int:
+        """Pages of the database file no longer in use"""
+        self.cur.execute("PRAGMA freelist_count")
+        return self.cur.fetchone()[0]
+
+    def incremental_vacuum(self, pages: int) -> int:
+        """Hand up to pages free pages back to the filesystem, returning how many are still free
+
+        Each call is its own short transaction. The file only shrinks once
+        the WAL is checkpointed.
+        """
+        self.conn.commit()
+        # Frees one page per step, so every row has to be read
+        self.cur.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+        return self.get_free_pages()
+
+    def checkpoint(self) -> bool:
+        """Copy the WAL into the database file and truncate it, returning whether every reader let it finish"""
+        self.conn.commit()
+        self.cur.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return self.cur.fetchone()[0] == 0
+
+    def get_snapshot_series(
+            self,
+            account_handle: str,
+            start: str | None = None,
+            end: str | None = None,
+            max_points: int = 200
+    ):
+        """Chronological (oldest to newest) series of an account's snapshots for charting
+
+        Covers snapshots taken from start up to end (UTC 'YYYY-MM-DD[ HH:MM:SS]',
+        both optional). Raw snapshots are used while they fit in max_points,
+        otherwise the finest day, week or month rollup that fits in
+        SERIES_OVERSAMPLE times as many, thinned to max_points with
+        largest-triangle-three-buckets so peaks and dips survive. Rollup points
+        are dated by the start of their period and carry the values of its
+        latest snapshot. The newest snapshot is always the last point.
+        """
+        start = start or "0000-01-01"
+        end = end or "9999-12-31"
+
+        self.cur.execute("""
+                    SELECT COUNT(*) FROM snapshots
+                    WHERE account_handle = ? AND timestamp >= ? AND timestamp < ? AND status = 'complete'
+                    """, (account_handle, start, end))
+        count = self.cur.fetchone()[0]
+        resolution = None
+        if count > max_points:
+            # Periods are dated by their first day; those starting before end overlap the range
+            self.cur.execute("SELECT CASE WHEN time(?) = '00:00:00' THEN date(?) ELSE date(?, '+1 day') END",
+                             (end, end, end))
+            end = self.cur.fetchone()[0]
+            for resolution, (period_sql, _) in ROLLUP_RESOLUTIONS.items():
+                # Include the period the range starts in, which may begin before start
+                self.cur.execute(f"""
+                            SELECT COUNT(*) FROM snapshot_rollups
+                            WHERE account_handle = ? AND resolution = ?
+                            AND period >= {period_sql.format(column='?')} AND period < ?
+                            """, (account_handle, resolution, start, end))
+                count = self.cur.fetchone()[0]
+                if count <= max_points * SERIES_OVERSAMPLE:
+                    break
+
+        if resolution is None:
+            self.cur.execute("""
+                SELECT timestamp, total_followers, active_count
+                FROM snapshots
+                WHERE account_handle = ? AND timestamp >= ? AND timestamp < ? AND status = 'complete'
+                ORDER BY timestamp, id
+            """, (account_handle, start, end))
+        else:
+            period_sql = ROLLUP_RESOLUTIONS[resolution][0]
+            self.cur.execute(f"""
+                SELECT period, total_followers, active_count
+                FROM snapshot_rollups
+                WHERE account_handle = ? AND resolution = ?
+                AND period >= {period_sql.format(column='?')} AND period < ?
+                ORDER BY period
+            """, (account_handle, resolution, start, end))
+
+        rows = _lttb(self.cur.fetchall(), max_points)
+        return [{"timestamp": r[0], "total_followers": r[1], "active_count": r[2]} for r in rows]
+
+    @timed(DB_DURATION, operation="get_cached_activity")
+    def get_cached_activity(self, dids: list[str]):
+        """Return cached activity entries for the given DIDs, keyed by DID"""
+        entries = {}
+        # Stay well under SQLite's bound parameter limit
+        for batch in _chunks(dids, 500):
+            self.cur.execute(f"""
+                        SELECT did, last_posted_at, posts_count, disabled, checked_at
+                        FROM activity_cache
+                        WHERE did IN ({",".join("?" * len(batch))})
+                        """, batch)
+            for r in self.cur.fetchall():
+                entries[r[0]] = {
+                    "last_posted_at": r[1],
+                    "posts_count": r[2],
+                    "disabled": bool(r[3]),
+                    "checked_at": r[4],
+                }
+        return entries
+
+    @timed(DB_DURATION, operation="save_activity")
+    def save_activity(self, entries: list[tuple]):
+        """Upsert (did, last_posted_at, posts_count, disabled, checked_at) cache entries"""
+        self.cur.executemany("""
+            INSERT INTO activity_cache (did, last_posted_at, posts_count, disabled, checked_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(did) DO UPDATE SET
+                last_posted_at = excluded.last_posted_at,
+                posts_count = excluded.posts_count,
+                disabled = excluded.disabled,
+                checked_at = excluded.checked_at
+            """, entries)
+        self.conn.commit()
+
+    def seed_activity_cache(self, account_handle: str):
+        """Fill an empty activity cache from the account's latest snapshot
+
+        The snapshot time is used as the check time, so the refresh policy
+        treats these entries exactly like lookups made during that run.
+        """
+        self.cur.execute("SELECT 1 FROM activity_cache LIMIT 1")
+        if self.cur.fetchone():
+            return 0
+
+        self.cur.execute("""
+                    SELECT id FROM snapshots
+                    WHERE account_handle = ? AND status = 'complete'
+                    ORDER BY id DESC
+                    LIMIT 1
+                    """, (account_handle,))
+        latest = self.cur.fetchone()
+        if not latest:
+            return 0
+
+        self.cur.execute(f"""
+            INSERT OR IGNORE INTO activity_cache (did, last_posted_at, posts_count, disabled, checked_at)
+            SELECT members.did, members.last_posted_at, NULL, 0, strftime('%Y-%m-%dT%H:%M:%S+00:00', s.timestamp)
+            FROM ({SNAPSHOT_MEMBERS_SQL}) members, snapshots s
+            WHERE s.id = ?
+            """, (latest[0], latest[0]))
+        self.conn.commit()
+        return self.cur.rowcount
+
+
+    def add_follow_events(self, events: list[tuple]):
+        """Record (account_handle, follower_did, event, rkey, time_us) stream events"""
+        self.cur.executemany("""
+            INSERT INTO follow_events (account_handle, follower_did, event, rkey, time_us)
+            VALUES (?, ?, ?, ?, ?)
+            """, events)
+
+    def save_follow_records(self, records: list[tuple]):
+        """Remember (follower_did, rkey, subject_did) follow records"""
+        self.cur.executemany("""
+            INSERT OR REPLACE INTO follow_records (follower_did, rkey, subject_did)
+            VALUES (?, ?, ?)
+            """, records)
+
+    def pop_follow_record(self, follower_did: str, rkey: str):
+        """Forget a deleted follow record, returning the DID it pointed at"""
+        self.cur.execute("""
+                    SELECT subject_did FROM follow_records
+                    WHERE follower_did = ? AND rkey = ?
+                    """, (follower_did, rkey))
+        row = self.cur.fetchone()
+        if not row:
+            return None
+
+        self.cur.execute("""
+            DELETE FROM follow_records WHERE follower_did = ? AND rkey = ?
+            """, (follower_did, rkey))
+        return row[0]
+
+    def has_follow_record(self, follower_did: str, subject_did: str) -> bool:
+        """Whether the record of a follower's follow of subject_did is known"""
+        self.cur.execute("""
+                    SELECT 1 FROM follow_records
+                    WHERE follower_did = ? AND subject_did = ?
+                    """, (follower_did, subject_did))
+        return self.cur.fetchone() is not None
+
+    def is_follower(self, account_handle: str, did: str) -> bool:
+        """Whether a DID follows the account as of its most recent snapshot"""
+        self.cur.execute("""
+                    SELECT 1 FROM follower_memberships m
+                    JOIN followers f ON f.id = m.follower_id
+                    WHERE m.account_handle = ? AND f.did = ? AND m.end_snapshot_id IS NULL
+                    """, (account_handle, did))
+        return self.cur.fetchone() is not None
+
+    def get_stream_cursor(self, name: str):
+        self.cur.execute("SELECT time_us FROM stream_cursors WHERE name = ?", (name,))
+        row = self.cur.fetchone()
+        return row[0] if row else None
+
+    def save_stream_cursor(self, name: str, time_us: int):
+        self.cur.execute("""
+            INSERT INTO stream_cursors (name, time_us) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET time_us = excluded.time_us
+            """, (name, time_us))
+
+    def get_live_changes(self, account_handle: str):
+        """Follows and unfollows streamed in since the account's latest snapshot
+
+        The latest complete snapshot is the baseline; for each DID only its
+        most recent event counts. Returns (new_followers, unfollowed) as
+        did -> handle dicts, falling back to the DID for unknown handles.
+        """
+        self.cur.execute("""
+                    SELECT id, CAST(strftime('%s', timestamp) AS INTEGER) * 1000000 FROM snapshots
+                    WHERE account_handle = ? AND status = 'complete'
+                    ORDER BY id DESC
+                    LIMIT 1
+                    """, (account_handle,))
+        latest = self.cur.fetchone()
+        if not latest:
+            return {}, {}
+
+        self.cur.execute("""
+                    SELECT e.follower_did, e.event, f.handle, EXISTS (
+                        SELECT 1 FROM follower_memberships m
+                        WHERE m.follower_id = f.id AND m.account_handle = e.account_handle
+                        AND m.start_snapshot_id <= ?
+                        AND (m.end_snapshot_id IS NULL OR m.end_snapshot_id > ?)
+                    )
+                    FROM follow_events e
+                    LEFT JOIN followers f ON f.did = e.follower_did
+                    WHERE e.account_handle = ? AND e.time_us >= ?
+                    ORDER BY e.time_us ASC, e.id ASC
+                    """, (latest[0], latest[0], account_handle, latest[1]))
+
+        last_events = {}
+        for did, event, handle, was_follower in self.cur.fetchall():
+            last_events[did] = (event, handle or did, was_follower)
+
+        new_followers = {}
+        unfollowed = {}
+        for did, (event, handle, was_follower) in last_events.items():
+            if event == "follow" and not was_follower:
+                new_followers[did] = handle
+            elif event == "unfollow" and was_follower:
+                unfollowed[did] = handle
+        return new_followers, unfollowed
+
+
+class ReadPool:
+    """Per-process pool of read-only database handles
+
+    Handles are opened on first use and reused across requests, so the
+    schema setup in Database.__enter__ and the cost of a cold page cache
+    are only paid once per handle. Requires the database to exist and be
+    in WAL mode, which opening it with Database() takes care of.
+    """
+
+    def __init__(self, size: int = 4):
+        self.size = size
+        self.idle = queue.LifoQueue()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a read-only Database for the duration of a block"""
+        try:
+            db = self.idle.get_nowait()
+        except queue.Empty:
+            db = Database.open_reader()
+
+        broken = False
+        try:
+            yield db
+        except sqlite3.Error:
+            broken = True
+            raise
+        finally:
+            if broken or self.idle.qsize() >= self.size:
+                db.conn.close()
+            else:
+                self.idle.put(db)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().conn.close()
+            except queue.Empty:
+                break
+
+class DatabaseWriter:
+    """Runs database calls from worker threads on the thread that owns the connection
+
+    SQLite connections cannot be shared between threads, so workers hand
+    their calls to the owner and wait for the result. Calls run one at a
+    time, and a call that fails is rolled back before the next one starts,
+    so each call is its own transaction as long as it ends with a commit.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+        self.owner = threading.get_ident()
+        self.tasks = queue.Queue()
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def _execute(self, fn, args, kwargs):
+        try:
+            return fn(*args, **kwargs)
+        except BaseException:
+            self.db.conn.rollback()
+            raise
+
+    def call(self, fn, *args, **kwargs):
+        """Run fn on the owning thread and return its result"""
+        if threading.get_ident() == self.owner:
+            return self._execute(fn, args, kwargs)
+
+        future = Future()
+        with self._lock:
+            if self.closed:
+                raise RuntimeError("Database writer has stopped")
+            self.tasks.put((future, fn, args, kwargs))
+        return future.result()
+
+    def serve(self, futures):
+        """Run queued calls until every one of the given futures is done"""
+        while True:
+            try:
+                future, fn, args, kwargs = self.tasks.get(timeout=0.1)
+            except queue.Empty:
+                if all(f.done() for f in futures):
+                    return
+                continue
+
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self._execute(fn, args, kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            except BaseException:
+                # Interrupted; release the waiting worker before stopping
+                future.set_exception(RuntimeError("Database writer has stopped"))
+                raise
+
+    def close(self):
+        """Refuse new calls and fail any still waiting"""
+        with self._lock:
+            self.closed = True
+        while True:
+            try:
+                future, *_ = self.tasks.get_nowait()
+            except queue.Empty:
+                break
+            if future.set_running_or_notify_cancel():
+                future.set_exception(RuntimeError("Database writer has stopped"))
+
+def _chunks(items: list, size: int):
+    """Split a list into runs of at most size items"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def _snapshot_from_row(r: tuple) -> dict:
+    """A snapshot as a dict from a row of SNAPSHOT_COLUMNS"""
+    return {
+        "id": r[0],
+        "timestamp": r[1],
+        "account_handle": r[2],
+        "total_followers": r[3],
+        "active_count": r[4],
+        "never_posted_count": r[5],
+        "disabled_count": r[6],
+        "activity": json.loads(r[7]) if r[7] else None,
+        "estimated": r[8] is not None,
+        "sampling": json.loads(r[8]) if r[8] else None,
+        "enabled_count": r[9],
+        "follows_count": r[10],
+        "activity_window_days": r[11],
+        "archive": r[12],
+    }
+
+def _search_query(text: str) -> str:
+    """FTS5 query matching every word of text as a prefix
+
+    Words are quoted, so nothing typed is read as query syntax.
+    """
+    return " ".join(f'"{word}"*' for word in re.findall(r"\w+", text))
+
+def _bitmap_from_ids(ids: Iterable[int]) -> int:
+    """Bitmap with bit i set for every id i"""
+    ids = list(ids)
+    if not ids:
+        return 0
+    bits = bytearray(max(ids) // 8 + 1)
+    for i in ids:
+        bits[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(bits, "little")
+
+def _encode_bitmap(bitmap: int) -> bytes:
+    return zlib.compress(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little"))
+
+def _decode_bitmap(data: bytes) -> int:
+    return int.from_bytes(zlib.decompress(data), "little")
+
+def _lttb(rows: list[tuple], threshold: int) -> list[tuple]:
+    """Thin (timestamp, value, ...) rows to at most threshold with largest-triangle-three-buckets
+
+    The first and last rows are always kept. From each bucket in between,
+    the row kept is the one forming the largest triangle with the row kept
+    before it and the average of the next bucket, which preserves the
+    visual shape of the series far better than taking every nth row.
+    """
+    if threshold < 3 or len(rows) <= threshold:
+        return rows
+
+    xs = [datetime.fromisoformat(row[0]).timestamp() for row in rows]
+    ys = [row[1] for row in rows]
+
+    sampled = [rows[0]]
+    every = (len(rows) - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket, the third corner of the triangle
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, len(rows))
+        avg_x = sum(xs[next_start:next_end]) / (next_end - next_start)
+        avg_y = sum(ys[next_start:next_end]) / (next_end - next_start)
+
+        bucket_start = int(i * every) + 1
+        bucket_end = int((i + 1) * every) + 1
+        best, best_area = bucket_start, -1.0
+        for j in range(bucket_start, bucket_end):
+            area = abs((xs[a] - avg_x) * (ys[j] - ys[a]) - (xs[a] - xs[j]) * (avg_y - ys[a]))
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append(rows[best])
+        a = best
+
+    sampled.append(rows[-1])
+    return sampled
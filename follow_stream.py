@@ -0,0 +1,288 @@
+"""Event-driven follower tracking from the Jetstream firehose"""
+import argparse
+import asyncio
+import json
+import logging
+import signal
+import sys
+import time
+from typing import Optional
+from urllib.parse import urlencode, urlparse, parse_qs
+
+from websockets.asyncio.client import connect
+from websockets.asyncio.server import serve
+from websockets.exceptions import ConnectionClosed
+
+from database import Database
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+FOLLOW_COLLECTION = "app.bsky.graph.follow"
+
+# How often buffered events and the stream cursor are committed, in seconds
+FLUSH_INTERVAL = 2.0
+
+# app.bsky.graph.getRelationships accepts at most 30 accounts per call
+RELATIONSHIPS_BATCH_SIZE = 30
+
+# Most getRelationships calls spent per minute on deletes with unknown record keys, out of
+# the API budget snapshots share; checks beyond it wait for a later flush
+RELATIONSHIP_CALLS_PER_MINUTE = 30
+
+# Rewind a little on reconnect so nothing in flight is lost; duplicates are harmless
+CURSOR_REWIND_US = 5_000_000
+
+class FollowStreamService:
+    """Applies follow and unfollow events for tracked accounts to the database
+
+    Creates carry the followed DID, so they are matched directly. Deletes
+    only carry the record key, so they are matched against follow records
+    seen earlier. A delete with an unseen record key from a follower whose
+    follow record isn't known, usually one who followed before the stream
+    started, is checked with app.bsky.graph.getRelationships when a
+    BlueskyService is available.
+
+    Such a delete is as likely to be the follower unfollowing someone
+    else, so checks are batched RELATIONSHIPS_BATCH_SIZE followers to a
+    call and held to RELATIONSHIP_CALLS_PER_MINUTE calls. A follower
+    confirmed as still following has their record remembered and is never
+    checked again.
+    """
+
+    def __init__(self, db: Database, tracked: dict[str, str], bluesky=None, url: Optional[str] = None):
+        if url is None:
+            from config import config
+            url = config.JETSTREAM_URL
+
+        self.db = db
+        self.tracked = tracked  # did -> account handle
+        self.bluesky = bluesky
+        self.url = url
+        self.cursor_name = f"jetstream:{url}"
+
+        self.pending_events = []
+        self.pending_checks = {}  # (account did, follower did) -> time_us
+        self.check_budget = float(RELATIONSHIP_CALLS_PER_MINUTE)
+        self.check_budget_updated = time.monotonic()
+        self.last_time_us = db.get_stream_cursor(self.cursor_name)
+        self.last_flush = time.monotonic()
+
+        self.events_seen = 0
+        self.follows = 0
+        self.unfollows = 0
+        self.checks = 0
+
+    def subscribe_url(self) -> str:
+        params = {"wantedCollections": FOLLOW_COLLECTION}
+        if self.last_time_us:
+            params["cursor"] = self.last_time_us - CURSOR_REWIND_US
+        return f"{self.url}?{urlencode(params)}"
+
+    def handle_event(self, event: dict):
+        """Apply one Jetstream event"""
+        self.events_seen += 1
+        time_us = event.get("time_us")
+        if time_us:
+            self.last_time_us = max(self.last_time_us or 0, time_us)
+
+        commit = event.get("commit")
+        if event.get("kind") != "commit" or not commit or commit.get("collection") != FOLLOW_COLLECTION:
+            return
+
+        follower_did = event["did"]
+        rkey = commit.get("rkey")
+
+        if commit.get("operation") == "create":
+            subject = (commit.get("record") or {}).get("subject")
+            if subject in self.tracked:
+                self.db.save_follow_records([(follower_did, rkey, subject)])
+                self.pending_events.append((self.tracked[subject], follower_did, "follow", rkey, time_us))
+                self.follows += 1
+
+        elif commit.get("operation") == "delete":
+            subject = self.db.pop_follow_record(follower_did, rkey)
+            if subject in self.tracked:
+                self.pending_events.append((self.tracked[subject], follower_did, "unfollow", rkey, time_us))
+                self.unfollows += 1
+            elif subject is None and self.bluesky:
+                # Followed before we started listening; ask whether they still follow
+                for did, account_handle in self.tracked.items():
+                    if self.db.is_follower(account_handle, follower_did) and not self.db.has_follow_record(follower_did, did):
+                        self.pending_checks.setdefault((did, follower_did), time_us)
+
+    async def check_relationships(self):
+        """Resolve deletes with unknown record keys against the API, as far as the budget allows"""
+        now = time.monotonic()
+        self.check_budget = min(RELATIONSHIP_CALLS_PER_MINUTE,
+                                self.check_budget + (now - self.check_budget_updated) * RELATIONSHIP_CALLS_PER_MINUTE / 60)
+        self.check_budget_updated = now
+
+        by_account = {}
+        for (did, follower_did), time_us in self.pending_checks.items():
+            by_account.setdefault(did, {})[follower_did] = time_us
+
+        for did, followers in by_account.items():
+            others = list(followers)
+            for i in range(0, len(others), RELATIONSHIPS_BATCH_SIZE):
+                if self.check_budget < 1:
+                    logger.debug(f"Relationship check budget spent, {len(self.pending_checks)} checks left for later")
+                    return
+                self.check_budget -= 1
+                batch = others[i:i + RELATIONSHIPS_BATCH_SIZE]
+                for follower_did in batch:
+                    del self.pending_checks[(did, follower_did)]
+                try:
+                    relationships = await asyncio.to_thread(self.bluesky.get_relationships, did, batch)
+                except Exception as e:
+                    logger.warning(f"Failed to check {len(batch)} relationships for {did}: {e}")
+                    continue
+
+                self.checks += len(batch)
+                for follower_did, follow_uri in relationships.items():
+                    if follow_uri:
+                        # Still following; remember the record so its delete is recognised later
+                        self.db.save_follow_records([(follower_did, follow_uri.rsplit("/", 1)[-1], did)])
+                    else:
+                        self.pending_events.append((self.tracked[did], follower_did, "unfollow", None, followers[follower_did]))
+                        self.unfollows += 1
+
+    async def flush(self):
+        """Commit buffered events, the stream cursor and API metrics together"""
+        if self.pending_checks:
+            await self.check_relationships()
+
+        if self.pending_events:
+            self.db.add_follow_events(self.pending_events)
+            self.pending_events = []
+        if self.last_time_us:
+            self.db.save_stream_cursor(self.cursor_name, self.last_time_us)
+        self.db.add_metrics(registry.drain())
+        self.last_flush = time.monotonic()
+
+    async def consume(self, websocket):
+        async for message in websocket:
+            try:
+                self.handle_event(json.loads(message))
+            except (ValueError, KeyError) as e:
+                logger.debug(f"Skipping malformed event: {e}")
+            if time.monotonic() - self.last_flush >= FLUSH_INTERVAL:
+                await self.flush()
+
+    async def run(self, stop: Optional[asyncio.Event] = None, reconnect: bool = True):
+        """Follow the stream until stopped, reconnecting with backoff"""
+        delay = 1.0
+        stop = stop or asyncio.Event()
+        while not stop.is_set():
+            try:
+                async with connect(self.subscribe_url()) as websocket:
+                    logger.info(f"Connected to {self.url}, tracking {len(self.tracked)} accounts")
+                    delay = 1.0
+                    consumer = asyncio.create_task(self.consume(websocket))
+                    stopper = asyncio.create_task(stop.wait())
+                    done, _ = await asyncio.wait({consumer, stopper}, return_when=asyncio.FIRST_COMPLETED)
+                    consumer.cancel()
+                    stopper.cancel()
+                    if consumer in done and consumer.exception():
+                        raise consumer.exception()
+            except (OSError, ConnectionClosed) as e:
+                logger.warning(f"Stream connection lost: {e}")
+            finally:
+                await self.flush()
+
+            if not reconnect or stop.is_set():
+                break
+            logger.info(f"Reconnecting in {delay:.0f}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+
+        logger.info(
+            f"Stream stopped: {self.events_seen} events, {self.follows} follows, "
+            f"{self.unfollows} unfollows, {self.checks} relationship checks"
+        )
+
+async def record(url: str, path: str, count: int):
+    """Save raw follow events from a live stream, for replaying later"""
+    with open(path, "w", encoding="utf-8") as f:
+        async with connect(f"{url}?{urlencode({'wantedCollections': FOLLOW_COLLECTION})}") as websocket:
+            for _ in range(count):
+                f.write(await websocket.recv() + "\n")
+
+async def replay(path: str, host: str, port: int):
+    """Serve recorded events like Jetstream does, honouring the cursor parameter"""
+    with open(path, encoding="utf-8") as f:
+        events = [line.strip() for line in f if line.strip()]
+
+    async def handler(websocket):
+        query = parse_qs(urlparse(websocket.request.path).query)
+        cursor = int(query.get("cursor", ["0"])[0])
+        for line in events:
+            if json.loads(line).get("time_us", 0) > cursor:
+                await websocket.send(line)
+
+    async with serve(handler, host, port):
+        logger.info(f"Replaying {len(events)} events on ws://{host}:{port}/subscribe")
+        await asyncio.get_running_loop().create_future()
+
+def main():
+    parser = argparse.ArgumentParser(description="Track follows and unfollows from the Jetstream firehose")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("run", help="Ingest follow events for the tracked accounts (default)")
+    record_parser = subparsers.add_parser("record", help="Record raw follow events to a file")
+    record_parser.add_argument("path")
+    record_parser.add_argument("--count", type=int, default=1000)
+    replay_parser = subparsers.add_parser("replay", help="Serve recorded events on a local WebSocket")
+    replay_parser.add_argument("path")
+    replay_parser.add_argument("--host", default="127.0.0.1")
+    replay_parser.add_argument("--port", type=int, default=6008)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.command == "replay":
+        asyncio.run(replay(args.path, args.host, args.port))
+        return
+
+    from config import config
+
+    if args.command == "record":
+        asyncio.run(record(config.JETSTREAM_URL, args.path, args.count))
+        return
+
+    from bluesky_service import BlueskyService
+
+    bluesky = BlueskyService()
+    if not bluesky.authenticate():
+        logger.warning("Not authenticated, deletes of follows made before the stream started will be missed")
+        bluesky = None
+
+    resolver = bluesky or BlueskyService()
+    tracked = {}
+    for handle in config.target_handles:
+        did = resolver.resolve_handle(handle)
+        if not did:
+            logger.error(f"Could not resolve handle: {handle}")
+            continue
+        # Events are stored under the handle snapshots are, the one the profile reports
+        profile = resolver.get_profile(did)
+        if not profile:
+            logger.warning(f"Could not fetch the profile of {handle}, storing its events under that handle")
+        tracked[did] = profile.handle if profile else handle
+    if not tracked:
+        sys.exit(1)
+
+    async def ingest(service: FollowStreamService):
+        # Stop cleanly on Ctrl+C or SIGTERM so buffered events are committed
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await service.run(stop)
+
+    with Database() as db:
+        service = FollowStreamService(db, tracked, bluesky)
+        asyncio.run(ingest(service))
+
+
+if __name__ == "__main__":
+    main()
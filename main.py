@@ -1,12 +1,12 @@
 import logging
 import sys
-from tqdm import tqdm
 
 from database import Database
 from config import config
 from bluesky_service import BlueskyService
 from analytics import AnalyticsService
-from snapshot_service import SnapshotService
+from scheduler import SnapshotScheduler
+from metrics import registry
 
 # Configure logging
 logging.basicConfig(
@@ -30,66 +30,48 @@ def main():
         logger.error("Failed to authenticate with Bluesky")
         sys.exit(1)
 
-    # resolve target account
-    logger.info(f"Resolving handle: {config.BSKY_TARGET_HANDLE}")
-    target_did = bluesky.resolve_handle(config.BSKY_TARGET_HANDLE)
-
-    if not target_did:
-        logger.error(f"Could not resolve handle: {config.BSKY_TARGET_HANDLE}")
-        sys.exit(1)
-
-    # Get profile of target
-    logger.info("Fetching profile information")
-    profile = bluesky.get_profile(target_did)
-
-    if not profile:
-        logger.error(f"Could not fetch profile: {config.BSKY_TARGET_HANDLE}")
-        sys.exit(1)
-
-    logger.info(f"Tracking followers for: {profile.handle} ({profile.followers_count} followers)")
-
-    # Fetch all followers with a progress bar
-    print(f"\nFetching followers for {profile.handle}...")
-    pbar = tqdm(total=profile.followers_count, desc="Processing followers", unit="followers")
-
-    def progress_callback(processed, fetched):
-        pbar.n = fetched
-        pbar.refresh()
-
-    followers = bluesky.fetch_all_followers(target_did, progress_callback)
-    pbar.close()
-
-    logger.info(f"Fetched {len(followers)} followers")
-
-    # Calculate statistics
-    logger.info("Calculating statistics")
-    stats = AnalyticsService.calculate_stats(profile.followers_count, followers)
-
     with Database() as db:
-        snapshot_service = SnapshotService(db)
-
-        logger.info("Creating snapshot")
-        snapshot_id = snapshot_service.create_snapshot(profile, followers, stats)
-
-        if not snapshot_id:
-            logger.error("Failed to create snapshot")
-            sys.exit(1)
-
-        # Generate and display report
-        logger.info("Generating report")
-        report = snapshot_service.generate_report(
-            snapshot_id,
-            config.BSKY_TARGET_HANDLE,
-            stats,
-            profile.follows_count
-        )
-
-        if report:
-            print("\n")
-            AnalyticsService.print_report(report)
+        try:
+            scheduler = SnapshotScheduler(bluesky, db)
+
+            # resolve target accounts, largest first
+            jobs = scheduler.plan(config.target_handles)
+
+            if not jobs:
+                logger.error("No accounts to track")
+                sys.exit(1)
+
+            print(f"\nFetching followers for {', '.join(job.profile.handle for job in jobs)}...")
+            logger.info("Creating snapshots")
+            results = scheduler.run(jobs)
+
+            throttling = bluesky.rate_limiter.stats()
+            logger.info(
+                f"API requests: {throttling['requests']} sent, {throttling['retries']} retried, "
+                f"{throttling['rate_limited']} rate limited, "
+                f"{throttling['throttle_seconds'] + throttling['backoff_seconds']:.2f}s spent waiting"
+            )
+        finally:
+            # Add this run's API and database metrics to the totals served at /metrics
+            db.add_metrics(registry.drain())
+
+    # Display a report per account
+    failed = False
+    for result in results:
+        if not result.snapshot_id:
+            logger.error(f"Failed to create snapshot for {result.job.handle}")
+            failed = True
+        elif not result.report:
+            logger.error(f"Failed to generate report for {result.job.handle}")
+            failed = True
         else:
-            logger.error("Failed to generate report")
-            sys.exit(1)
+            print("\n")
+            if len(results) > 1:
+                print(result.job.profile.handle)
+            AnalyticsService.print_report(result.report)
+
+    if failed:
+        sys.exit(1)
 
     logger.info("Follower tracking complete")
 
@@ -0,0 +1,186 @@
+"""Prometheus-style metrics for API calls, database work and snapshot phases"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Per-endpoint Bluesky API metrics
+API_REQUESTS = "bsky_api_requests_total"
+API_DURATION = "bsky_api_request_duration_seconds"
+API_RETRIES = "bsky_api_retries_total"
+API_WAIT = "bsky_api_wait_seconds_total"
+
+# Time spent in database operations
+DB_DURATION = "tracker_db_operation_duration_seconds"
+
+# Wall time per phase of each account's latest snapshot
+SNAPSHOT_PHASE = "tracker_snapshot_phase_seconds"
+
+# Web dashboard page cache lookups
+PAGE_CACHE = "tracker_page_cache_requests_total"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class MetricsRegistry:
+    """Counters, gauges and histograms keyed by name and labels
+
+    Values are plain floats under one lock. Histograms are stored the way
+    Prometheus exposes them, as cumulative _bucket counters plus _sum and
+    _count, so every sample can be persisted and added up as a counter.
+    """
+
+    def __init__(self):
+        self.families = {}  # name -> (type, help)
+        self.values = {}  # (sample name, labels) -> value
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, kind: str, help: str):
+        self.families[name] = (kind, help)
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self.values[key] = self.values.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self.values[(name, _labels(labels))] = value
+
+    def observe(self, name: str, value: float, buckets: tuple = DEFAULT_BUCKETS, **labels):
+        with self._lock:
+            for bound in (*buckets, float("inf")):
+                if value <= bound:
+                    key = (f"{name}_bucket", _labels({**labels, "le": _format_bound(bound)}))
+                    self.values[key] = self.values.get(key, 0.0) + 1
+            for suffix, amount in (("_sum", value), ("_count", 1)):
+                key = (f"{name}{suffix}", _labels(labels))
+                self.values[key] = self.values.get(key, 0.0) + amount
+
+    @contextmanager
+    def time(self, name: str, **labels):
+        """Observe the duration of a block in a histogram"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def samples(self) -> list[tuple[str, str, float]]:
+        """Every sample as (name, labels JSON, value)"""
+        with self._lock:
+            values = dict(self.values)
+        return [(name, json.dumps(dict(labels)), value) for (name, labels), value in values.items()]
+
+    def drain(self) -> list[tuple[str, str, float]]:
+        """Return every sample and start again from zero"""
+        with self._lock:
+            values, self.values = self.values, {}
+        return [(name, json.dumps(dict(labels)), value) for (name, labels), value in values.items()]
+
+    def render(self, samples: list[tuple[str, str, float]]) -> str:
+        """Prometheus text exposition of the given samples, grouped by family
+
+        Samples with the same name and labels, say stored totals and this
+        process's own, are added together.
+        """
+        totals = {}
+        for name, labels, value in samples:
+            key = (name, json.dumps(json.loads(labels), sort_keys=True))
+            totals[key] = totals.get(key, 0.0) + value
+
+        lines = []
+        for family, (kind, help) in self.families.items():
+            family_samples = [
+                (name, labels, value) for (name, labels), value in totals.items()
+                if name == family or name in (f"{family}_bucket", f"{family}_sum", f"{family}_count")
+            ]
+            if not family_samples:
+                continue
+            lines.append(f"# HELP {family} {help}")
+            lines.append(f"# TYPE {family} {kind}")
+            for name, labels, value in sorted(family_samples, key=_sample_order):
+                lines.append(f"{name}{_format_labels(json.loads(labels))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+class PhaseTimer:
+    """Wall time spent in each phase of one snapshot
+
+    Phases may run on several threads at once (activity lookups overlap
+    with page fetches), so the totals can add up to more than the elapsed
+    time of the snapshot.
+    """
+
+    def __init__(self, seconds: dict[str, float] | None = None):
+        self.seconds = dict(seconds or {})
+        self._lock = threading.Lock()
+
+    def add(self, phase: str, seconds: float):
+        with self._lock:
+            self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def to_dict(self) -> dict[str, float]:
+        with self._lock:
+            return {phase: round(seconds, 3) for phase, seconds in self.seconds.items()}
+
+    def summary(self) -> str:
+        return ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.to_dict().items())
+
+def timed(name: str, **labels):
+    """Decorator observing each call's duration in a histogram of the shared registry"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with registry.time(name, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@contextmanager
+def phase(timer: PhaseTimer | None, name: str):
+    """Time a block into an optional PhaseTimer"""
+    if timer is None:
+        yield
+        return
+    with timer.phase(name):
+        yield
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _format_bound(bound: float) -> str:
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+def _sample_order(sample: tuple) -> tuple:
+    name, labels, _ = sample
+    labels = json.loads(labels)
+    le = labels.pop("le", None)
+    bound = float("inf") if le == "+Inf" else float(le) if le else 0.0
+    return (sorted(labels.items()), name.endswith("_count"), name.endswith("_sum"), bound)
+
+# Shared registry for the process
+registry = MetricsRegistry()
+registry.describe(API_REQUESTS, "counter", "Bluesky API requests by endpoint and response status")
+registry.describe(API_DURATION, "histogram", "Bluesky API request latency by endpoint")
+registry.describe(API_RETRIES, "counter", "Bluesky API requests retried, by endpoint and reason")
+registry.describe(API_WAIT, "counter", "Seconds spent waiting on the rate limit budget or backing off before retries")
+registry.describe(DB_DURATION, "histogram", "Duration of database operations")
+registry.describe(SNAPSHOT_PHASE, "gauge", "Wall time per phase of each account's latest snapshot")
+registry.describe(PAGE_CACHE, "counter", "Web page cache lookups since the web process started, by result")
@@ -0,0 +1,249 @@
+"""Shared, header-aware rate limiting for Bluesky API requests"""
+import logging
+import random
+import threading
+import time
+from typing import Optional
+from urllib.parse import urlparse
+
+import httpx
+from atproto_client import exceptions
+from atproto_client.request import Request
+
+from metrics import registry, API_REQUESTS, API_DURATION, API_RETRIES, API_WAIT
+
+logger = logging.getLogger(__name__)
+
+class RateLimiter:
+    """Token bucket shared by every thread issuing API requests"""
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Block until a request may be sent, returning the time spent waiting"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+class RateLimitController:
+    """Paces every API request against the server's advertised budget
+
+    Until the server has sent rate-limit headers, requests are paced by a
+    token bucket at fallback_rate, holding up to fallback_burst requests. Once the ratelimit-remaining and
+    ratelimit-reset headers are known, requests go out as fast as that
+    budget allows and wait for the window to reset only once it is spent.
+    Rate-limited (429), server error (5xx) and network failures are retried
+    with exponential backoff and full jitter.
+    """
+
+    def __init__(self, fallback_rate: float, max_retries: int, base_delay: float, max_delay: float = 60.0,
+                 fallback_burst: Optional[int] = None):
+        self.bucket = RateLimiter(fallback_rate, fallback_burst)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.limit: Optional[int] = None
+        self.remaining: Optional[int] = None
+        self.reset_at: Optional[float] = None
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+        self.requests = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.server_errors = 0
+        self.network_errors = 0
+        self.throttled = 0
+        self.throttle_seconds = 0.0
+        self.backoff_seconds = 0.0
+
+    def acquire(self):
+        """Block until the budget allows another request"""
+        with self._cond:
+            started = time.monotonic()
+            throttled = False
+            while self.remaining is not None:
+                now = time.time()
+                if self.reset_at is not None and now >= self.reset_at:
+                    # The window has rolled over; assume a full budget until a response says otherwise
+                    self.remaining = self.limit
+                    self.reset_at = None
+
+                if self.remaining - self.in_flight > 0:
+                    break
+
+                wait = self.reset_at - now if self.reset_at else 1.0
+                if not throttled:
+                    logger.debug(f"Rate limit budget spent, waiting up to {wait:.2f}s for reset")
+                    throttled = True
+                self._cond.wait(wait)
+
+            if throttled:
+                waited = time.monotonic() - started
+                self.throttled += 1
+                self.throttle_seconds += waited
+                registry.inc(API_WAIT, waited, reason="throttle")
+
+            self.in_flight += 1
+            self.requests += 1
+            if self.remaining is not None:
+                return
+
+        waited = self.bucket.acquire()
+        if waited:
+            with self._cond:
+                self.throttled += 1
+                self.throttle_seconds += waited
+            registry.inc(API_WAIT, waited, reason="throttle")
+
+    def release(self, headers: Optional[dict]):
+        """Finish a request, updating the budget from its response headers"""
+        with self._cond:
+            self.in_flight -= 1
+            if headers:
+                self._update_budget(headers)
+            self._cond.notify_all()
+
+    def _update_budget(self, headers: dict):
+        try:
+            remaining = int(headers["ratelimit-remaining"])
+            reset_at = float(headers["ratelimit-reset"])
+            limit = int(headers.get("ratelimit-limit", remaining))
+        except (KeyError, ValueError):
+            return
+
+        # Responses can arrive out of order, keep the lowest count seen for a window
+        if self.reset_at == reset_at and self.remaining is not None:
+            remaining = min(remaining, self.remaining)
+
+        self.limit = limit
+        self.remaining = remaining
+        self.reset_at = reset_at
+
+    def backoff_delay(self, attempt: int, status: Optional[int], headers: Optional[dict]) -> float:
+        """How long to wait before retrying a failed request"""
+        if status == 429 and headers:
+            retry_after = headers.get("retry-after")
+            if retry_after:
+                try:
+                    return float(retry_after) + random.uniform(0, self.base_delay)
+                except ValueError:
+                    pass
+
+            reset = headers.get("ratelimit-reset")
+            if reset:
+                try:
+                    return max(float(reset) - time.time(), 0) + random.uniform(0, self.base_delay)
+                except ValueError:
+                    pass
+
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def call(self, send, endpoint: str = "unknown"):
+        """Send a request through the budget, retrying transient failures
+
+        Every attempt is counted and timed under `endpoint` in the shared
+        metrics registry.
+        """
+        for attempt in range(self.max_retries):
+            self.acquire()
+            headers = None
+            outcome = "error"
+            started = time.perf_counter()
+            try:
+                response = send()
+                headers = dict(response.headers)
+                outcome = str(response.status_code)
+                return response
+            except (exceptions.RequestException, exceptions.NetworkError, httpx.TransportError) as e:
+                # atproto only wraps some transport errors; a dropped connection comes through from httpx as it is
+                response = getattr(e, "response", None)
+                status = response.status_code if response else None
+                headers = response.headers if response else None
+                outcome = str(status) if status else "network_error"
+
+                with self._cond:
+                    if status == 429:
+                        self.rate_limited += 1
+                        reason = "rate_limited"
+                    elif status is not None and status >= 500:
+                        self.server_errors += 1
+                        reason = "server_error"
+                    elif status is None:
+                        self.network_errors += 1
+                        reason = "network_error"
+                    else:
+                        # Anything else will fail the same way again
+                        raise
+
+                if attempt == self.max_retries - 1:
+                    raise
+
+                delay = self.backoff_delay(attempt, status, headers)
+                logger.warning(f"Request failed ({status or type(e).__name__}), retry {attempt + 1}/{self.max_retries - 1} in {delay:.2f}s")
+            finally:
+                self.release(headers)
+                registry.observe(API_DURATION, time.perf_counter() - started, endpoint=endpoint)
+                registry.inc(API_REQUESTS, endpoint=endpoint, status=outcome)
+
+            with self._cond:
+                self.retries += 1
+                self.backoff_seconds += delay
+            registry.inc(API_RETRIES, endpoint=endpoint, reason=reason)
+            registry.inc(API_WAIT, delay, reason="backoff")
+            time.sleep(delay)
+
+    def stats(self) -> dict:
+        """Throttling and retry counters since the controller was created"""
+        with self._cond:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "server_errors": self.server_errors,
+                "network_errors": self.network_errors,
+                "throttled": self.throttled,
+                "throttle_seconds": round(self.throttle_seconds, 3),
+                "backoff_seconds": round(self.backoff_seconds, 3),
+                "limit": self.limit,
+                "remaining": self.remaining,
+            }
+
+class RateLimitedRequest(Request):
+    """atproto request handler that sends everything through a RateLimitController"""
+
+    def __init__(self, controller: RateLimitController, **kwargs):
+        super().__init__(**kwargs)
+        self.controller = controller
+
+    def _send_request(self, method: str, url: str, **kwargs):
+        # XRPC URLs end in the method NSID, e.g. app.bsky.graph.getFollowers
+        endpoint = urlparse(url).path.rsplit("/", 1)[-1] or "unknown"
+        return self.controller.call(
+            lambda: super(RateLimitedRequest, self)._send_request(method, url, **kwargs),
+            endpoint=endpoint
+        )
+
+    def clone(self) -> "RateLimitedRequest":
+        # Clones share the budget of the original
+        cloned_request = type(self)(self.controller)
+        cloned_request._additional_headers = self._additional_headers.copy()
+        cloned_request._additional_header_sources = self._additional_header_sources.copy()
+        return cloned_request
@@ -0,0 +1,116 @@
+"""Plain-text follower reports
+
+Works on reports as plain dicts (SnapshotReport.model_dump(), or rebuilt
+from the database by the offline CLI) and imports nothing, so printing a
+report never has to load pydantic, the API client or the configuration.
+"""
+
+def format_report(report: dict, window_days: int) -> str:
+    """Format a report as a string; window_days is the activity window active followers were counted in"""
+    stats = report["stats"]
+    lines = [
+        "=" * 50,
+        "FOLLOWER REPORT",
+        "=" * 50,
+        "",
+        f"Total Followers: {stats['total_followers']}",
+        f"Follows: {report['follows_count']}",
+        "",
+        "=" * 50,
+        "FOLLOWER BREAKDOWN",
+        "=" * 50,
+        f"Enabled Accounts: {stats['enabled_count']}",
+        f"Disabled Accounts: {stats['disabled_count']}",
+        f"Active (posted in last {window_days} days): {stats['active_count']}",
+        f"Active Percentage: {stats['active_percentage']:.2f}%",
+        f"Never Posted: {stats['ghost_count']}",
+    ]
+
+    if stats["estimated"]:
+        lines.append(f"Estimated from a sample of {stats['sample_size']} followers, 95% intervals:")
+        for name, label in (("active", "Active"), ("inactive", "Inactive"), ("ghost", "Never Posted"),
+                            ("disabled", "Disabled")):
+            lower, upper = stats["intervals"][name]
+            lines.append(f"  {label}: {lower:.2f}% - {upper:.2f}%")
+    lines.append("")
+
+    relationships = report.get("relationships")
+    if relationships:
+        lines.extend([
+            "=" * 50,
+            "MUTUALS",
+            "=" * 50,
+            f"Mutuals: {relationships['mutuals_count']}",
+            f"Followers Not Followed Back: {relationships['followers_only_count']}",
+            f"Following Who Don't Follow Back: {relationships['following_only_count']}",
+        ])
+        for did, handle in relationships["following_only"].items():
+            lines.append(f"  ! {handle}")
+        if relationships["following_only_count"] > len(relationships["following_only"]):
+            lines.append(f"  ... and {relationships['following_only_count'] - len(relationships['following_only'])} more")
+        lines.append("")
+
+    if report["new_followers"]:
+        lines.extend([
+            "=" * 50,
+            f"NEW FOLLOWERS ({len(report['new_followers'])})",
+            "=" * 50,
+        ])
+        for did, handle in report["new_followers"].items():
+            lines.append(f"  + {handle}")
+        lines.append("")
+
+    if report["new_followers"]:
+        lines.extend([
+            "=" * 50,
+            f"UNFOLLOWS ({len(report['unfollowers'])})",
+            "=" * 50,
+        ])
+        for did, handle in report["unfollowers"].items():
+            lines.append(f"  - {handle}")
+        lines.append("")
+
+    if report["renamed"]:
+        lines.extend([
+            "=" * 50,
+            f"RENAMED ({len(report['renamed'])})",
+            "=" * 50,
+        ])
+        for did, (previous_handle, handle) in report["renamed"].items():
+            lines.append(f"  ~ {previous_handle} -> {handle}")
+        lines.append("")
+
+    if not report["new_followers"] and not report["unfollowers"]:
+        lines.extend([
+            "=" * 50,
+            "CHANGES",
+            "=" * 50,
+            "No new followers or unfollows since last snapshot.",
+            ""
+        ])
+
+    return "\n".join(lines)
+
+def format_diff(before: dict, after: dict, gained: dict[str, str], lost: dict[str, str],
+                gained_count: int, lost_count: int) -> str:
+    """Format the followers gained and lost between two snapshots; gained and lost map did:handle"""
+    lines = [
+        "=" * 50,
+        f"SNAPSHOT {before['id']} -> {after['id']}",
+        "=" * 50,
+        f"{before['timestamp']} -> {after['timestamp']}",
+        f"Total Followers: {before['total_followers']} -> {after['total_followers']}",
+        "",
+    ]
+    for title, symbol, followers, count in (("GAINED", "+", gained, gained_count), ("LOST", "-", lost, lost_count)):
+        lines.extend([
+            "=" * 50,
+            f"{title} ({count})",
+            "=" * 50,
+        ])
+        for did, handle in followers.items():
+            lines.append(f"  {symbol} {handle}")
+        if count > len(followers):
+            lines.append(f"  ... and {count - len(followers)} more")
+        lines.append("")
+    return "\n".join(lines)
@@ -0,0 +1,282 @@
+"""Tiered retention of snapshot follower detail
+
+Aggregates in snapshots are kept forever; what ages out is the follower
+detail behind them: membership runs, attribute changes, stored changes and
+bitmaps. Recent snapshots keep it all, older ones are thinned to one per
+period, and past an optional age none keep it. Detail is written to a
+gzipped NDJSON archive file before it leaves the database, and any single
+snapshot can be restored from one.
+
+    python cli.py prune
+    python cli.py restore 42
+
+Archive files hold up to ARCHIVE_BATCH_SIZE snapshots of one account: the
+first snapshot's followers in full, then for each following snapshot the
+followers gone and the followers added or changed since the one before,
+with each snapshot's follows and changes. A file never depends on another
+or on the database, so files can be moved to cold storage as they are.
+"""
+import gzip
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+import cohorts
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Days snapshots keep all their follower detail
+DEFAULT_FULL_DAYS = 30
+
+# Older snapshots are thinned to the latest one of every this many days
+DEFAULT_THIN_DAYS = 7
+
+# Days after which snapshots keep no follower detail at all; 0 keeps the thinned ones forever
+DEFAULT_ARCHIVE_DAYS = 0
+
+DEFAULT_ARCHIVE_DIR = "archive"
+
+# Snapshots per archive file, each file's snapshots leaving the database in one transaction
+ARCHIVE_BATCH_SIZE = 50
+
+# Free pages handed back to the filesystem per transaction, 4 MiB at SQLite's default page size
+VACUUM_PAGES = 1024
+
+# Version of the archive file layout, written in each file's first line
+ARCHIVE_FORMAT = 1
+
+class RetentionPolicy:
+    """Which of an account's snapshots keep their follower detail in the database
+
+    Snapshots taken in the last full_days keep it. Older ones are thinned
+    to the latest snapshot of each thin_days period, weeks starting on
+    Monday by default, and with archive_days set, snapshots older than that
+    keep none. An account's latest snapshot and snapshots pinned by a
+    restore always keep theirs.
+    """
+
+    def __init__(self, full_days: float = DEFAULT_FULL_DAYS, thin_days: int = DEFAULT_THIN_DAYS,
+                 archive_days: float = DEFAULT_ARCHIVE_DAYS):
+        if full_days < 0:
+            raise ValueError("Full detail days must not be negative")
+        if thin_days < 1:
+            raise ValueError("Thinning period must be at least a day")
+        if archive_days and archive_days < full_days:
+            raise ValueError("Snapshots can't be archived before their full detail period ends")
+        self.full_days = full_days
+        self.thin_days = thin_days
+        self.archive_days = archive_days
+
+    def select(self, snapshots: list[tuple], now: datetime) -> list[int]:
+        """Ids to archive from an account's (id, timestamp, pinned) snapshots with detail, oldest first
+
+        now is a naive UTC datetime, like the stored timestamps.
+        """
+        if not snapshots:
+            return []
+
+        full_since = now - timedelta(days=self.full_days)
+        archive_before = now - timedelta(days=self.archive_days) if self.archive_days else None
+        # Periods are counted from 0001-01-01, a Monday
+        periods = {snapshot_id: (datetime.fromisoformat(timestamp).toordinal() - 1) // self.thin_days
+                   for snapshot_id, timestamp, _ in snapshots}
+        latest_of_period = {period: snapshot_id for snapshot_id, period in periods.items()}
+        latest_id = snapshots[-1][0]
+
+        selected = []
+        for snapshot_id, timestamp, pinned in snapshots:
+            taken = datetime.fromisoformat(timestamp)
+            if pinned or snapshot_id == latest_id or taken >= full_since:
+                continue
+            if latest_of_period[periods[snapshot_id]] == snapshot_id and (archive_before is None or taken >= archive_before):
+                continue
+            selected.append(snapshot_id)
+        return selected
+
+class RetentionService:
+    """Archives old snapshots' follower detail by a policy, restores it on demand, and shrinks the database
+
+    Work is committed in short transactions, one per archive file, so the
+    web interface's readers never wait and writers only briefly do.
+    """
+
+    def __init__(self, db: Database, policy: RetentionPolicy | None = None, archive_dir: str = DEFAULT_ARCHIVE_DIR):
+        self.db = db
+        self.policy = policy or RetentionPolicy()
+        self.archive_dir = archive_dir
+
+    def plan(self, now: datetime | None = None) -> dict[str, list[list[int]]]:
+        """Batches of snapshot ids to archive by account, each up to ARCHIVE_BATCH_SIZE snapshots in a row"""
+        now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+        accounts = {}
+        for snapshot_id, account_handle, timestamp, pinned in self.db.get_detailed_snapshots():
+            accounts.setdefault(account_handle, []).append((snapshot_id, timestamp, pinned))
+
+        plan = {}
+        for account_handle, snapshots in accounts.items():
+            selected = set(self.policy.select(snapshots, now))
+            batches, batch = [], []
+            for snapshot_id, _, _ in snapshots:
+                if snapshot_id in selected:
+                    batch.append(snapshot_id)
+                if batch and (snapshot_id not in selected or len(batch) == ARCHIVE_BATCH_SIZE):
+                    batches.append(batch)
+                    batch = []
+            if batch:
+                batches.append(batch)
+            if batches:
+                plan[account_handle] = batches
+        return plan
+
+    def run(self, now: datetime | None = None, vacuum: bool = True) -> dict:
+        """Archive everything the policy says to, then drop orphaned followers and shrink the file
+
+        Returns how many snapshots, archive files, memberships, followers
+        and free pages were dealt with.
+        """
+        summary = {"snapshots": 0, "archives": 0, "memberships": 0, "followers": 0, "pages": 0}
+        for account_handle, batches in self.plan(now).items():
+            for batch in batches:
+                summary["memberships"] += self.archive(account_handle, batch)
+                summary["snapshots"] += len(batch)
+                summary["archives"] += 1
+        if summary["snapshots"]:
+            summary["followers"] = self.remove_orphans()
+        if vacuum:
+            summary["pages"] = self.vacuum()
+
+        if any(summary.values()):
+            logger.info(f"Retention archived {summary['snapshots']} snapshots to {summary['archives']} files, "
+                        f"deleting {summary['memberships']} memberships and {summary['followers']} followers, "
+                        f"and freed {summary['pages']} pages")
+        return summary
+
+    def archive(self, account_handle: str, snapshot_ids: list[int]) -> int:
+        """Write an account's snapshots to an archive file, then drop their detail from the database
+
+        The file is complete on disk before the transaction removing the
+        detail starts, so a crash in between leaves both. Returns the
+        number of memberships deleted.
+        """
+        path = os.path.join(self.archive_dir, account_handle, f"{snapshot_ids[0]}-{snapshot_ids[-1]}.ndjson.gz")
+        self._write_archive(path, account_handle, snapshot_ids)
+        dropped = self.db.remove_snapshot_detail(snapshot_ids, path)
+        self.db.conn.commit()
+        logger.info(f"Archived {len(snapshot_ids)} snapshots of {account_handle} to {path}")
+        return dropped
+
+    def _write_archive(self, path: str, account_handle: str, snapshot_ids: list[int]):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = path + ".tmp"
+        with open(partial, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6) as archive:
+                def write(record):
+                    archive.write(json.dumps(record).encode() + b"\n")
+
+                write({"archive": ARCHIVE_FORMAT, "account_handle": account_handle, "snapshot_ids": snapshot_ids})
+                since_id = None
+                for snapshot_id in snapshot_ids:
+                    write({"snapshot": self.db.get_snapshot(snapshot_id), "since": since_id})
+                    if since_id is None:
+                        for follower in self.db.iter_snapshot_followers(snapshot_id):
+                            write({"follower": [follower[field] for field in ("did", "handle", "last_posted_at", "display_name")]})
+                    else:
+                        for did in self.db.iter_followers_gone(snapshot_id, since_id):
+                            write({"gone": did})
+                        for row in self.db.iter_followers_since(snapshot_id, since_id):
+                            write({"follower": list(row)})
+
+                    follows = self.db.get_snapshot_follows_bitmap(snapshot_id)
+                    if follows is not None:
+                        write({"follows": self.db.get_follower_rows(cohorts.members(follows))})
+                    new_followers, unfollowers, renamed = self.db.get_follower_changes(snapshot_id)
+                    write({"changes": {"new_followers": new_followers, "unfollowers": unfollowers, "renamed": renamed}})
+                    since_id = snapshot_id
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(partial, path)
+
+    def restore(self, snapshot_id: int):
+        """Put an archived snapshot's follower detail back in the database, pinned so retention keeps it"""
+        snapshot = self.db.get_snapshot(snapshot_id)
+        detail = read_archive(snapshot["archive"], snapshot_id)
+        if detail is None:
+            raise ValueError(f"{snapshot['archive']} does not hold snapshot {snapshot_id}")
+
+        followers = [(did, *values) for did, values in detail["followers"].items()]
+        self.db.restore_snapshot_detail(snapshot_id, followers, detail["follows"])
+        self.db.conn.commit()
+        logger.info(f"Restored {len(followers)} followers of snapshot {snapshot_id} from {snapshot['archive']}")
+
+    def remove_orphans(self) -> int:
+        """Delete the followers no snapshot with detail refers to any more"""
+        # Hold the write lock throughout, so no snapshot can store follows between reading them and deleting
+        self.db.conn.execute("BEGIN IMMEDIATE")
+        followed = 0
+        for snapshot in self.db.get_latest_snapshots():
+            for _, _, bitmap in self.db.iter_snapshot_follows_bitmaps(snapshot["account_handle"]):
+                followed |= bitmap
+        removed = self.db.delete_orphan_followers(set(cohorts.members(followed)))
+        self.db.conn.commit()
+        return removed
+
+    def vacuum(self) -> int:
+        """Hand free pages back to the filesystem, VACUUM_PAGES per transaction; returns how many
+
+        Databases created before incremental vacuum keep their free pages
+        for reuse until converted once with `python cli.py vacuum`.
+        """
+        if not self.db.incremental_vacuum_enabled():
+            logger.info("Free pages are kept for reuse; run `python cli.py vacuum` once to let pruning shrink the file")
+            return 0
+
+        free = freed = self.db.get_free_pages()
+        while free:
+            remaining = self.db.incremental_vacuum(VACUUM_PAGES)
+            if remaining >= free:
+                break
+            free = remaining
+        freed -= free
+        if freed and not self.db.checkpoint():
+            logger.info("Readers kept the WAL from being fully checkpointed; the file shrinks at the next checkpoint")
+        return freed
+
+def read_archive(path: str, snapshot_id: int, with_followers: bool = True) -> dict | None:
+    """A snapshot's detail from an archive file, None if the file doesn't hold it
+
+    Returns the snapshot row, its followers as DID -> (handle,
+    last_posted_at, display_name), its follows as (did, handle,
+    display_name) lists or None if they weren't stored, and its changes as
+    get_follower_changes gave them. Followers are rebuilt by replaying the
+    file up to the snapshot; with_followers=False skips that and leaves
+    them None.
+    """
+    followers = {}
+    detail = None
+    with gzip.open(path, "rt") as lines:
+        for line in lines:
+            if not with_followers and line.startswith(('{"follower"', '{"gone"')):
+                continue
+            record = json.loads(line)
+            if "snapshot" in record:
+                if detail:
+                    break
+                if record["since"] is None:
+                    followers.clear()
+                if record["snapshot"]["id"] == snapshot_id:
+                    detail = {"snapshot": record["snapshot"], "follows": None, "changes": None}
+            elif "follower" in record:
+                did, *values = record["follower"]
+                followers[did] = tuple(values)
+            elif "gone" in record:
+                followers.pop(record["gone"], None)
+            elif detail and "follows" in record:
+                detail["follows"] = record["follows"]
+            elif detail and "changes" in record:
+                detail["changes"] = record["changes"]
+
+    if detail:
+        detail["followers"] = followers if with_followers else None
+    return detail
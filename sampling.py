@@ -0,0 +1,45 @@
+"""Deterministic, rotating follower samples for estimating activity on huge accounts"""
+import hashlib
+
+class ActivitySample:
+    """Followers whose activity is looked up when sampling, chosen by DID
+
+    Every DID hashes to a fixed point in [0, 1), and the sample is the arc
+    of width rate starting at an offset. Membership depends only on the DID,
+    so the same followers are sampled on every page and every resumed run,
+    and the hash spreads the sample evenly through the follower list, so
+    each stratum of it gets its share.
+
+    The offset moves on by rate / rotation each snapshot: consecutive
+    snapshots share all but 1 / rotation of their sample, which keeps
+    estimates stable and lets the activity cache answer most lookups, while
+    the whole sample is replaced every `rotation` snapshots.
+    """
+
+    def __init__(self, rate: float, generation: int = 0, rotation: int = 4):
+        if not 0 < rate <= 1:
+            raise ValueError("Sample rate must be above 0 and at most 1")
+        self.rate = rate
+        self.generation = generation
+        self.rotation = rotation
+        self.offset = (generation * rate / rotation) % 1.0
+
+    def contains(self, did: str) -> bool:
+        """Whether a follower's activity is looked up in this snapshot"""
+        return (_position(did) - self.offset) % 1.0 < self.rate
+
+    def split(self, followers: list) -> tuple[list, list]:
+        """Split a page of followers into (sampled, skipped)"""
+        sampled = []
+        skipped = []
+        for follower in followers:
+            (sampled if self.contains(follower.did) else skipped).append(follower)
+        return sampled, skipped
+
+    def to_dict(self) -> dict:
+        return {"rate": self.rate, "generation": self.generation, "rotation": self.rotation}
+
+def _position(did: str) -> float:
+    """Stable point in [0, 1) for a DID, the same in every process"""
+    digest = hashlib.blake2b(did.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2 ** 64
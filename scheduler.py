@@ -0,0 +1,219 @@
+"""Snapshots several tracked accounts concurrently"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from pydantic import BaseModel, Field
+from tqdm import tqdm
+
+from config import config
+from database import Database, DatabaseWriter
+from metrics import PhaseTimer
+from bluesky_service import BlueskyService, FollowerRecord, ProfileStats
+from analytics import FollowerStats, SnapshotReport
+from snapshot_service import SnapshotInterrupted, SnapshotService
+from activity_cache import ActivityCache
+from sampling import ActivitySample
+
+logger = logging.getLogger(__name__)
+
+class AccountJob(BaseModel):
+    """An account waiting to be snapshotted"""
+    handle: str = Field(..., description="Handle the account was requested by")
+    did: str = Field(..., description="Resolved DID of the account")
+    profile: ProfileStats = Field(..., description="Profile fetched when the run was planned")
+    timings: dict[str, float] = Field(default_factory=dict, description="Seconds spent planning, per phase")
+
+    @property
+    def cost(self) -> int:
+        """Estimated work, one lookup per follower"""
+        return self.profile.followers_count
+
+class AccountResult(BaseModel):
+    """Outcome of snapshotting one account"""
+    job: AccountJob
+    snapshot_id: Optional[int] = Field(default=None, description="Completed snapshot, None if it failed")
+    stats: Optional[FollowerStats] = None
+    report: Optional[SnapshotReport] = None
+
+def interruptible(pages, stop: threading.Event):
+    """Yield pages until stop is set, then raise instead of fetching another
+
+    The snapshot being streamed keeps every page committed so far and its
+    checkpoint, so the next run resumes it.
+    """
+    pages = iter(pages)
+    while not stop.is_set():
+        try:
+            page = next(pages)
+        except StopIteration:
+            return
+        yield page
+    raise SnapshotInterrupted("Stopped before the last page")
+
+class SnapshotScheduler:
+    """Snapshots several accounts at once against one shared API budget
+
+    Every account shares the authenticated session and rate limiter of one
+    BlueskyService, and a single pool of FETCH_CONCURRENCY lookup workers,
+    so adding accounts spreads the same request budget over more work
+    rather than multiplying it. Each account's follows are paged on a
+    worker of their own while its followers are fetched. At most `concurrency` accounts are in
+    flight, largest first, so the biggest jobs never start last and hold
+    up the run on their own.
+
+    All database work is handed to a DatabaseWriter and runs on the thread
+    that called run(), which owns the connection.
+
+    Setting the stop event ends the run early: accounts not yet started are
+    skipped, and snapshots in flight stop after their current page, which
+    leaves them checkpointed for the next run.
+    """
+
+    def __init__(
+            self,
+            bluesky: BlueskyService,
+            db: Database,
+            concurrency: Optional[int] = None,
+            stop: Optional[threading.Event] = None
+    ):
+        self.bluesky = bluesky
+        self.db = db
+        self.concurrency = concurrency or config.ACCOUNT_CONCURRENCY
+        self.stop = stop or threading.Event()
+
+    def plan(self, handles: list[str]) -> list[AccountJob]:
+        """Resolve each handle and order the accounts by estimated cost"""
+        jobs = []
+        for handle in handles:
+            if self.stop.is_set():
+                break
+            logger.info(f"Resolving handle: {handle}")
+            started = time.perf_counter()
+            did = self.bluesky.resolve_handle(handle)
+            resolved = time.perf_counter()
+            if not did:
+                logger.error(f"Could not resolve handle: {handle}")
+                continue
+
+            profile = self.bluesky.get_profile(did)
+            if not profile:
+                logger.error(f"Could not fetch profile: {handle}")
+                continue
+
+            logger.info(f"Tracking followers for: {profile.handle} ({profile.followers_count} followers)")
+            timings = {"resolve_handle": resolved - started, "get_profile": time.perf_counter() - resolved}
+            jobs.append(AccountJob(handle=handle, did=did, profile=profile, timings=timings))
+
+        return sorted(jobs, key=lambda job: job.cost, reverse=True)
+
+    def run(self, jobs: list[AccountJob]) -> list[AccountResult]:
+        """Snapshot every planned account, returning results in plan order"""
+        writer = DatabaseWriter(self.db)
+        lookups = ThreadPoolExecutor(max_workers=config.FETCH_CONCURRENCY)
+        follows = ThreadPoolExecutor(max_workers=self.concurrency)
+        accounts = ThreadPoolExecutor(max_workers=self.concurrency)
+
+        try:
+            # The pool starts jobs in submission order, so larger accounts go first
+            futures = [
+                accounts.submit(self._snapshot_account, job, writer, lookups, follows, position)
+                for position, job in enumerate(jobs)
+            ]
+            writer.serve(futures)
+        finally:
+            writer.close()
+            lookups.shutdown(wait=False, cancel_futures=True)
+            follows.shutdown(wait=False, cancel_futures=True)
+            accounts.shutdown(wait=True, cancel_futures=True)
+
+        results = []
+        for job, future in zip(jobs, futures):
+            if future.exception():
+                logger.error(f"Snapshot of {job.handle} failed: {future.exception()}")
+                results.append(AccountResult(job=job))
+            else:
+                results.append(future.result())
+        return results
+
+    def _snapshot_account(
+            self,
+            job: AccountJob,
+            writer: DatabaseWriter,
+            lookups: ThreadPoolExecutor,
+            follows: ThreadPoolExecutor,
+            position: int
+    ) -> AccountResult:
+        if self.stop.is_set():
+            logger.info(f"Skipping {job.handle}, the run was stopped")
+            return AccountResult(job=job)
+
+        profile = job.profile
+        snapshot_service = SnapshotService(self.db, writer)
+
+        # Pick up an interrupted snapshot instead of starting over
+        checkpoint = snapshot_service.get_checkpoint(profile)
+        initial = checkpoint.saved if checkpoint else 0
+
+        # A resumed snapshot keeps adding to the time spent on it so far
+        timer = PhaseTimer(checkpoint.timings if checkpoint else None)
+        for name, seconds in job.timings.items():
+            timer.add(name, seconds)
+
+        pbar = tqdm(
+            total=profile.followers_count,
+            initial=initial,
+            desc=profile.handle,
+            unit="followers",
+            position=position
+        )
+
+        def progress_callback(processed, fetched):
+            pbar.n = initial + fetched
+            pbar.refresh()
+
+        activity_cache = ActivityCache(
+            self.db,
+            window_days=config.ACTIVITY_WINDOW_DAYS,
+            ttl_hours=config.ACTIVITY_CACHE_TTL_HOURS,
+            margin_days=config.ACTIVITY_REFRESH_MARGIN_DAYS,
+            writer=writer
+        )
+        activity_cache.seed(profile.handle)
+
+        sample = None
+        if config.ACTIVITY_SAMPLE_RATE:
+            # Every completed snapshot rotates part of the sample out; a resumed one keeps its sample
+            generation = len(writer.call(self.db.get_account_snapshot_ids, profile.handle))
+            sample = ActivitySample(config.ACTIVITY_SAMPLE_RATE, generation, config.ACTIVITY_SAMPLE_ROTATION)
+
+        # Follows are paged in the background while followers are
+        followed = follows.submit(self._fetch_follows, job.did, timer)
+
+        # Pages are folded into stats and written as they arrive
+        cursor = checkpoint.cursor if checkpoint else None
+        pages = self.bluesky.iter_followers(job.did, progress_callback, activity_cache, cursor, lookups, timer, sample)
+        pages = interruptible(pages, self.stop)
+        try:
+            snapshot_id, stats = snapshot_service.stream_snapshot(profile, pages, checkpoint, timer, followed)
+        finally:
+            pbar.close()
+
+        if not snapshot_id:
+            return AccountResult(job=job)
+
+        logger.info(
+            f"Activity cache for {profile.handle}: {activity_cache.hits} hits, "
+            f"{activity_cache.misses} lookups ({activity_cache.hit_rate:.2f}% hit rate)"
+        )
+
+        report = snapshot_service.generate_report(snapshot_id, stats, profile.follows_count)
+        return AccountResult(job=job, snapshot_id=snapshot_id, stats=stats, report=report)
+
+    def _fetch_follows(self, did: str, timer: PhaseTimer) -> list[FollowerRecord]:
+        """Every account a DID follows, stopping early like the followers when the run is stopped"""
+        follows = []
+        for page, _ in interruptible(self.bluesky.iter_follows(did, timer), self.stop):
+            follows.extend(page)
+        return follows
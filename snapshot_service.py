@@ -1,55 +1,249 @@
+import json
 import logging
-from typing import Optional
+from concurrent.futures import Future
+from contextlib import nullcontext
+from typing import Iterable, Optional
+from pydantic import BaseModel, Field
 
-from database import Database
-from bluesky_service import FollowerData, ProfileStats
-from analytics import FollowerStats, SnapshotReport
+from config import config
+from database import Database, DatabaseWriter, BULK_CHUNK_SIZE
+from metrics import PhaseTimer
+from bluesky_service import FollowerData, FollowerRecord, ProfileStats
+from analytics import AnalyticsService, FollowerStats, SnapshotReport, StatsAccumulator
 
 logger = logging.getLogger(__name__)
 
+class SnapshotInterrupted(Exception):
+    """Raised in place of the next page when a run is asked to stop"""
+
+class SnapshotCheckpoint(BaseModel):
+    """Resume point of an in-progress snapshot"""
+    snapshot_id: int = Field(..., description="Snapshot being resumed")
+    cursor: Optional[str] = Field(default=None, description="Pagination cursor after the last saved page")
+    saved: int = Field(default=0, ge=0, description="Followers saved so far")
+    counts: dict = Field(default_factory=dict, description="Running statistics so far, as saved by StatsAccumulator.to_dict")
+    timings: dict[str, float] = Field(default_factory=dict, description="Seconds spent per phase so far")
+
+    @property
+    def exhausted(self) -> bool:
+        """Every page was saved, only finalizing is left"""
+        return self.saved > 0 and self.cursor is None
+
 class SnapshotService:
     """Service for creating and managing follower snapshots"""
 
-    def __init__(self, db: Database):
+    def __init__(self, db: Database, writer: Optional[DatabaseWriter] = None):
         self.db = db
+        self.writer = writer
+
+    def _run(self, fn, *args):
+        """Run database work directly, or on the writer's thread when there is one"""
+        if self.writer:
+            return self.writer.call(fn, *args)
+        return fn(*args)
+
+    def begin_snapshot(self, profile: ProfileStats) -> int:
+        """Create the in-progress snapshot row that followers are streamed into"""
+        snapshot_id = self.db.create_snapshot(
+            account_handle=profile.handle,
+            total_followers=profile.followers_count,
+            active_count=0,
+            never_posted_count=0,
+            disabled_count=0,
+            status="in_progress"
+        )
+        logger.info(f"Created snapshot {snapshot_id} for {profile.handle}")
+        return snapshot_id
+
+    def get_checkpoint(self, profile: ProfileStats) -> Optional[SnapshotCheckpoint]:
+        """Find an interrupted snapshot for the account that can be resumed"""
+        snapshot = self._run(self.db.get_in_progress_snapshot, profile.handle)
+        if not snapshot:
+            return None
+
+        progress = json.loads(snapshot["progress"]) if snapshot["progress"] else {}
+        return SnapshotCheckpoint(
+            snapshot_id=snapshot["id"],
+            cursor=snapshot["cursor"],
+            saved=progress.get("saved", 0),
+            counts=progress.get("counts", {}),
+            timings=progress.get("timings", {})
+        )
+
+    def add_followers(
+            self,
+            snapshot_id: int,
+            followers: list[FollowerRecord],
+            cursor: Optional[str] = None,
+            saved: int = 0,
+            accumulator: Optional[StatsAccumulator] = None,
+            timer: Optional[PhaseTimer] = None
+    ):
+        """Write a page of followers to a snapshot and commit it
+
+        When an accumulator is given, the checkpoint is committed in the same
+        transaction, so a resumed run never loses or double counts a page.
+        The timer's phases so far are checkpointed with it.
+        """
+        self.db.add_followers(snapshot_id, [
+            (follower.did, follower.handle, follower.last_posted_at, follower.display_name)
+            for follower in followers
+        ])
+        if accumulator:
+            progress = {"saved": saved, "counts": accumulator.to_dict()}
+            if timer:
+                progress["timings"] = timer.to_dict()
+            progress = json.dumps(progress)
+            self.db.save_checkpoint(snapshot_id, cursor, progress)
+        self.db.conn.commit()
+
+    def finalize_snapshot(
+            self,
+            snapshot_id: int,
+            profile: ProfileStats,
+            stats: FollowerStats,
+            follows: Optional[list[FollowerRecord]] = None
+    ):
+        """Record final statistics, and the accounts followed when given, once every follower has been written"""
+        # Anyone not seen in this snapshot has unfollowed
+        self.db.close_memberships(snapshot_id)
+        # Diff once here so reports and the dashboard never have to
+        self.db.save_snapshot_changes(snapshot_id)
+        self.db.save_snapshot_bitmap(snapshot_id)
+        if follows is not None:
+            self.db.save_snapshot_follows(snapshot_id, [
+                (follow.did, follow.handle, follow.display_name) for follow in follows
+            ])
+        self.db.update_snapshot_stats(
+            snapshot_id,
+            total_followers=profile.followers_count,
+            active_count=stats.active_count,
+            never_posted_count=stats.ghost_count,
+            disabled_count=stats.disabled_count,
+            activity_histogram=json.dumps(stats.activity),
+            sampling=json.dumps({"sample_size": stats.sample_size, "intervals": stats.intervals}) if stats.estimated else None,
+            enabled_count=stats.enabled_count,
+            follows_count=profile.follows_count,
+            activity_window_days=config.ACTIVITY_WINDOW_DAYS
+        )
+        self.db.complete_snapshot(snapshot_id)
+
+    def save_timings(self, snapshot_id: int, timer: PhaseTimer):
+        """Persist the phase timings of a snapshot with its row"""
+        self._run(self.db.save_snapshot_timings, snapshot_id, json.dumps(timer.to_dict()))
+        logger.info(f"Snapshot {snapshot_id} timings: {timer.summary()}")
+
+    def stream_snapshot(
+            self,
+            profile: ProfileStats,
+            pages: Iterable[tuple[list[FollowerRecord], Optional[str]]],
+            checkpoint: Optional[SnapshotCheckpoint] = None,
+            timer: Optional[PhaseTimer] = None,
+            follows: Optional[Future] = None
+    ) -> tuple[Optional[int], Optional[FollowerStats]]:
+        """Create a snapshot from (followers, next_cursor) pages as they arrive
+
+        Statistics are folded page by page and every page is committed with
+        a checkpoint before the next is fetched, so memory is bounded by the
+        page size. If fetching fails the snapshot stays in progress, and
+        passing its checkpoint later carries on where it stopped.
+
+        follows is a Future of the account's follows, fetched alongside the
+        followers; they are stored when the snapshot completes. Follows are
+        not checkpointed, so a resumed snapshot needs them fetched again. If
+        they fail the snapshot completes without them, but if the run was
+        stopped while they were paged it stays in progress.
+
+        Time spent writing and finalizing is added to the timer's db_writes
+        and finalize phases, and the timer is saved with the snapshot.
+        """
+        timer = timer or PhaseTimer(checkpoint.timings if checkpoint else None)
+        snapshot_id = None
+        try:
+            if checkpoint:
+                snapshot_id = checkpoint.snapshot_id
+                accumulator = StatsAccumulator.from_dict(checkpoint.counts)
+                saved = checkpoint.saved
+                logger.info(f"Resuming snapshot {snapshot_id} after {saved} followers")
+            else:
+                snapshot_id = self._run(self.begin_snapshot, profile)
+                accumulator = StatsAccumulator.for_followers(profile.followers_count)
+                saved = 0
+
+            if not (checkpoint and checkpoint.exhausted):
+                for page, cursor in pages:
+                    accumulator.add(page)
+                    saved += len(page)
+                    with timer.phase("db_writes"):
+                        self._run(self.add_followers, snapshot_id, page, cursor, saved, accumulator, timer)
+                    logger.debug(f"Committed {len(page)} followers ({saved} total)")
+
+            stats = accumulator.result(profile.followers_count)
+            followed = self._wait_for_follows(snapshot_id, follows) if follows else None
+            with timer.phase("finalize"):
+                self._run(self.finalize_snapshot, snapshot_id, profile, stats, followed)
+            self.save_timings(snapshot_id, timer)
+
+            logger.info(f"Saved {saved} followers to snapshot {snapshot_id}")
+            return snapshot_id, stats
+
+        except Exception as e:
+            # A writer rolls back its own failed calls
+            if not self.writer:
+                self.db.conn.rollback()
+            if snapshot_id:
+                logger.error(f"Snapshot {snapshot_id} interrupted, progress saved for the next run: {e}")
+            else:
+                logger.error(f"Failed to create snapshot: {e}")
+            return None, None
+
+    def _wait_for_follows(self, snapshot_id: int, follows: Future) -> Optional[list[FollowerRecord]]:
+        try:
+            return follows.result()
+        except SnapshotInterrupted:
+            # Completing now would lose this snapshot's follows for good; the next run fetches them again
+            raise
+        except Exception as e:
+            logger.warning(f"Snapshot {snapshot_id} completes without follows, they could not be fetched: {e}")
+            return None
 
     def create_snapshot(
             self,
             profile: ProfileStats,
-            followers: list[FollowerData],
-            stats: FollowerStats
+            followers: Iterable[FollowerData | FollowerRecord],
+            stats: FollowerStats,
+            chunk_size: Optional[int] = None,
+            defer_indexes: bool = False
     ) -> Optional[int]:
-        """Create a new snapshot with follower data"""
+        """Create a new snapshot with follower data in bulk
+
+        Followers may be any iterable, including a generator. By default
+        the whole snapshot is written in one transaction; pass chunk_size
+        to commit every chunk_size followers instead. defer_indexes drops
+        the secondary membership indexes for the load and rebuilds them at
+        the end, which pays off for very large first snapshots.
+        """
+        timer = PhaseTimer()
         try:
-            snapshot_id = self.db.create_snapshot(
-                account_handle=profile.handle,
-                total_followers=profile.followers_count,
-                active_count=stats.active_count,
-                never_posted_count=stats.ghost_count,
-                disabled_count=stats.disabled_count
+            snapshot_id = self.begin_snapshot(profile)
+
+            rows = (
+                (follower.did, follower.handle, follower.last_posted_at, follower.display_name)
+                for follower in followers
             )
+            with timer.phase("db_writes"), self.db.deferred_indexes() if defer_indexes else nullcontext():
+                saved = self.db.bulk_add_followers(
+                    snapshot_id,
+                    rows,
+                    chunk_size=chunk_size or BULK_CHUNK_SIZE,
+                    commit_chunks=chunk_size is not None
+                )
+
+            with timer.phase("finalize"):
+                self.finalize_snapshot(snapshot_id, profile, stats)
+            self.save_timings(snapshot_id, timer)
 
-            logger.info(f"Created snapshot {snapshot_id} for {profile.handle}")
-
-            # Add in batches for better error recovery
-            batch_size = 100
-            for i in range(0, len(followers), batch_size):
-                batch = followers[i:i + batch_size]
-
-                for follower in batch:
-                    self.db.add_follower(
-                        snapshot_id=snapshot_id,
-                        did=follower.did,
-                        handle=follower.handle,
-                        last_posted_at=follower.last_posted_at,
-                        display_name=follower.display_name
-                    )
-                
-                # commit each batch
-                self.db.conn.commit()
-                logger.debug(f"Committed batch {i // batch_size + 1} ({len(batch)} followers)")
-
-            logger.info(f"Saved {len(followers)} followers to snapshot {snapshot_id}")
+            logger.info(f"Saved {saved} followers to snapshot {snapshot_id}")
             return snapshot_id
 
         except Exception as e:
@@ -60,19 +254,21 @@ class SnapshotService:
     def generate_report(
             self,
             snapshot_id: int,
-            account_handle: str,
             stats: FollowerStats,
             follows_count: int
     ) -> Optional[SnapshotReport]:
         """Generate a report comparing this snapshot to the previous one"""
         try:
-            new_followers, unfollows = self.db.get_follower_changes(snapshot_id, account_handle)
+            new_followers, unfollows, renamed = self._run(self.db.get_follower_changes, snapshot_id)
+            relationships = self._run(AnalyticsService.relationships, self.db, snapshot_id)
 
             return SnapshotReport(
                 stats=stats,
                 new_followers=new_followers,
                 unfollowers=unfollows,
-                follows_count=follows_count
+                renamed=renamed,
+                follows_count=follows_count,
+                relationships=relationships
             )
         except Exception as e:
             logger.error(f"Failed to generate report: {e}")
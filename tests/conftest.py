@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+# config loads at import and requires credentials; tests never log in
+os.environ.setdefault("BSKY_HANDLE", "tracker.test")
+os.environ.setdefault("BSKY_APP_PASSWORD", "app-password")
+os.environ.setdefault("BSKY_TARGET_HANDLE", "account.test")
+
+import database
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """Point the database at a fresh file in a temporary directory"""
+    path = tmp_path / "followers_cache.db"
+    monkeypatch.setattr(database, "DB_PATH", str(path))
+    return path
+
+
+@pytest.fixture
+def take_snapshots():
+    """Store complete snapshots of the same followers for account.test, one on each 'YYYY-MM-DD' day"""
+    def take(db: database.Database, days: list[str], dids: list[str]):
+        for day in days:
+            snapshot_id = db.create_snapshot("account.test", len(dids), 0, 0, 0, status="in_progress")
+            db.add_followers(snapshot_id, [(did, f"{did[8:]}.test", None, None) for did in dids])
+            db.close_memberships(snapshot_id)
+            db.save_snapshot_changes(snapshot_id)
+            db.save_snapshot_bitmap(snapshot_id)
+            db.cur.execute("UPDATE snapshots SET timestamp = ? WHERE id = ?", (f"{day} 12:00:00", snapshot_id))
+            db.complete_snapshot(snapshot_id)
+    return take
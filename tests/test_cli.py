@@ -0,0 +1,39 @@
+import sqlite3
+import sys
+
+import pytest
+
+import cli
+from database import Database
+
+
+def run_cli(monkeypatch, *args):
+    monkeypatch.setattr(sys, "argv", ["cli.py", *args])
+    cli.main()
+
+
+def test_reports_need_an_existing_database(db_path, monkeypatch):
+    with pytest.raises(SystemExit, match="No database"):
+        run_cli(monkeypatch, "list")
+    assert not db_path.exists()
+
+
+def test_reports_open_the_database_read_only(db_path, monkeypatch, capsys):
+    with Database() as db:
+        snapshot_id = db.create_snapshot("account.test", 0, 0, 0, 0)
+        db.complete_snapshot(snapshot_id)
+    before = db_path.read_bytes()
+
+    run_cli(monkeypatch, "list")
+    assert "account.test" in capsys.readouterr().out
+
+    monkeypatch.setattr(cli.Database, "__enter__", lambda self: pytest.fail("reports must not open the database for writing"))
+    run_cli(monkeypatch, "show", str(snapshot_id))
+    assert capsys.readouterr().out
+    assert db_path.read_bytes() == before
+
+
+def test_reports_refuse_an_older_schema(db_path, monkeypatch):
+    sqlite3.connect(db_path).execute("CREATE TABLE snapshots (id INTEGER PRIMARY KEY)").connection.close()
+    with pytest.raises(SystemExit, match="older version"):
+        run_cli(monkeypatch, "list")
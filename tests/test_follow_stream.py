@@ -0,0 +1,111 @@
+import asyncio
+import json
+import socket
+
+import pytest
+from websockets.asyncio.client import connect
+
+import follow_stream
+from database import Database
+from follow_stream import FollowStreamService, replay
+
+ACCOUNT_DID = "did:plc:account"
+OTHER_DID = "did:plc:someoneelse"
+
+
+def follow(did: str, rkey: str, subject: str, time_us: int) -> dict:
+    return {"did": did, "time_us": time_us, "kind": "commit", "commit": {
+        "operation": "create", "collection": follow_stream.FOLLOW_COLLECTION, "rkey": rkey,
+        "record": {"$type": follow_stream.FOLLOW_COLLECTION, "subject": subject}}}
+
+
+def unfollow(did: str, rkey: str, time_us: int) -> dict:
+    return {"did": did, "time_us": time_us, "kind": "commit", "commit": {
+        "operation": "delete", "collection": follow_stream.FOLLOW_COLLECTION, "rkey": rkey}}
+
+
+class FakeBluesky:
+    """Answers relationship checks from a fixed map of follower DID -> follow record URI"""
+
+    def __init__(self, follow_uris: dict[str, str]):
+        self.follow_uris = follow_uris
+        self.calls = []
+
+    def get_relationships(self, did: str, others: list[str]) -> dict:
+        self.calls.append((did, others))
+        return {other: self.follow_uris.get(other) for other in others}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def stream_from_replay(service: FollowStreamService, path: str):
+    port = free_port()
+    server = asyncio.create_task(replay(path, "127.0.0.1", port))
+    service.url = f"ws://127.0.0.1:{port}/subscribe"
+    for _ in range(100):
+        try:
+            async with connect(service.url):
+                break
+        except OSError:
+            await asyncio.sleep(0.05)
+    try:
+        await service.run(reconnect=False)
+    finally:
+        server.cancel()
+
+
+def test_replayed_events_are_stored(db_path, tmp_path, take_snapshots):
+    events = [
+        follow("did:plc:new", "new1", ACCOUNT_DID, 1),
+        follow("did:plc:new", "other", OTHER_DID, 2),
+        unfollow("did:plc:new", "new1", 3),
+        # Followed before the stream started, and gone when checked
+        unfollow("did:plc:gone", "old1", 4),
+        # Followed before the stream started, and unfollowed someone else
+        unfollow("did:plc:stays", "old2", 5),
+        # Follow record already known, so this delete is of some other follow
+        unfollow("did:plc:known", "old3", 6),
+        # Not a follower at all
+        unfollow("did:plc:stranger", "old4", 7),
+    ]
+    path = tmp_path / "events.jsonl"
+    path.write_text("".join(json.dumps(event) + "\n" for event in events))
+
+    with Database() as db:
+        take_snapshots(db, ["2024-01-01"], ["did:plc:gone", "did:plc:stays", "did:plc:known"])
+        db.save_follow_records([("did:plc:known", "known1", ACCOUNT_DID)])
+        db.conn.commit()
+
+        bluesky = FakeBluesky({"did:plc:stays": f"at://did:plc:stays/{follow_stream.FOLLOW_COLLECTION}/stays1"})
+        service = FollowStreamService(db, {ACCOUNT_DID: "account.test"}, bluesky, url="ws://unused")
+        asyncio.run(stream_from_replay(service, str(path)))
+
+        db.cur.execute("SELECT account_handle, follower_did, event, rkey, time_us FROM follow_events ORDER BY time_us")
+        assert db.cur.fetchall() == [
+            ("account.test", "did:plc:new", "follow", "new1", 1),
+            ("account.test", "did:plc:new", "unfollow", "new1", 3),
+            ("account.test", "did:plc:gone", "unfollow", None, 4),
+        ]
+        assert bluesky.calls == [(ACCOUNT_DID, ["did:plc:gone", "did:plc:stays"])]
+        assert db.has_follow_record("did:plc:stays", ACCOUNT_DID)
+        assert db.get_stream_cursor(service.cursor_name) == 7
+
+
+def test_relationship_checks_are_held_to_the_budget(db_path, monkeypatch):
+    monkeypatch.setattr(follow_stream, "RELATIONSHIP_CALLS_PER_MINUTE", 1)
+    with Database() as db:
+        bluesky = FakeBluesky({})
+        service = FollowStreamService(db, {ACCOUNT_DID: "account.test"}, bluesky, url="ws://unused")
+        service.pending_checks = {(ACCOUNT_DID, f"did:plc:{n}"): n for n in range(follow_stream.RELATIONSHIPS_BATCH_SIZE + 1)}
+
+        asyncio.run(service.check_relationships())
+        assert len(bluesky.calls) == 1
+        assert len(service.pending_checks) == 1
+
+        # Nothing is left over budget until the next call's worth has accrued
+        asyncio.run(service.check_relationships())
+        assert len(bluesky.calls) == 1
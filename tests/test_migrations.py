@@ -0,0 +1,109 @@
+import sqlite3
+
+import pytest
+
+import database
+from database import Database, SCHEMA_VERSION
+
+# Schema and data as the first release of the tracker stored them, a full copy of the
+# followers per snapshot
+BASELINE_SCHEMA = """
+    CREATE TABLE snapshots (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        account_handle TEXT,
+        total_followers INTEGER,
+        active_count INTEGER,
+        never_posted_count INTEGER,
+        disabled_count INTEGER
+    );
+    CREATE TABLE snapshot_followers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        snapshot_id INTEGER,
+        did TEXT,
+        handle TEXT,
+        last_posted_at TEXT,
+        display_name TEXT,
+        FOREIGN KEY (snapshot_id) REFERENCES snapshots(id)
+    );
+    CREATE INDEX idx_snapshot_followers ON snapshot_followers(snapshot_id, did);
+"""
+
+BASELINE_FOLLOWERS = {
+    1: [("did:plc:one", "one.test", "2024-01-01T00:00:00Z", "One"),
+        ("did:plc:two", "two.test", None, "Two")],
+    2: [("did:plc:one", "uno.test", "2024-01-01T00:00:00Z", "One"),
+        ("did:plc:three", "three.test", None, None)],
+}
+
+
+@pytest.fixture
+def baseline_db(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.executescript(BASELINE_SCHEMA)
+    for snapshot_id, followers in BASELINE_FOLLOWERS.items():
+        conn.execute("""
+            INSERT INTO snapshots (id, account_handle, total_followers, active_count, never_posted_count, disabled_count)
+            VALUES (?, 'account.test', 2, 1, 1, 0)
+            """, (snapshot_id,))
+        conn.executemany("""
+            INSERT INTO snapshot_followers (snapshot_id, did, handle, last_posted_at, display_name)
+            VALUES (?, ?, ?, ?, ?)
+            """, [(snapshot_id, *follower) for follower in followers])
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+def user_version(path) -> int:
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def check_upgraded(path):
+    assert user_version(path) == SCHEMA_VERSION
+    with Database() as db:
+        for snapshot_id, followers in BASELINE_FOLLOWERS.items():
+            stored = sorted(tuple(follower[field] for field in ("did", "handle", "last_posted_at", "display_name"))
+                            for follower in db.iter_snapshot_followers(snapshot_id))
+            assert stored == sorted(followers)
+            assert db.get_snapshot_bitmap(snapshot_id).bit_count() == len(followers)
+
+        new_followers, unfollowers, renamed = db.get_follower_changes(2)
+        assert new_followers == {"did:plc:three": "three.test"}
+        assert unfollowers == {"did:plc:two": "two.test"}
+        assert renamed == {"did:plc:one": ("one.test", "uno.test")}
+        assert db.get_snapshot(1)["archive"] is None
+
+
+def test_upgrade_from_baseline(baseline_db):
+    with Database():
+        pass
+    check_upgraded(baseline_db)
+
+
+def test_failed_upgrade_resumes_at_failed_step(baseline_db, monkeypatch):
+    def fail(self):
+        raise RuntimeError("interrupted")
+
+    monkeypatch.setattr(Database, "_backfill_snapshot_bitmaps", fail)
+    with pytest.raises(RuntimeError):
+        with Database():
+            pass
+    # Every step before the bitmap backfill (version 7) is kept
+    assert user_version(baseline_db) == 6
+
+    monkeypatch.undo()
+    monkeypatch.setattr(database, "DB_PATH", str(baseline_db))
+    with Database():
+        pass
+    check_upgraded(baseline_db)
+
+
+def test_new_database(db_path):
+    with Database() as db:
+        assert db.get_latest_snapshots() == []
+    assert user_version(db_path) == SCHEMA_VERSION
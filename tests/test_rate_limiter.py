@@ -0,0 +1,86 @@
+import time
+
+import httpx
+import pytest
+from atproto_client import exceptions
+
+from benchmarks.fake_server import FakeAtprotoServer, FakeGraph, TARGET_DID
+from rate_limiter import RateLimitController, RateLimitedRequest
+
+MAX_RETRIES = 3
+
+
+@pytest.fixture
+def server():
+    with FakeAtprotoServer(FakeGraph(10)) as server:
+        yield server
+
+
+def controller() -> RateLimitController:
+    # A fallback bucket that never throttles, so only the server's budget does
+    return RateLimitController(fallback_rate=1000, max_retries=MAX_RETRIES, base_delay=0.01)
+
+
+def get_profile(request: RateLimitedRequest, server: FakeAtprotoServer):
+    return request.get(f"{server.url}/xrpc/app.bsky.actor.getProfile", params={"actor": TARGET_DID})
+
+
+def test_rate_limited_request_waits_for_reset(server):
+    server.rate_limit, server.window = 1, 1.0
+    # Spend the window's budget behind the controller's back
+    reset = int(httpx.get(f"{server.url}/xrpc/app.bsky.actor.getProfile",
+                          params={"actor": TARGET_DID}).headers["ratelimit-reset"])
+
+    limiter = controller()
+    response = get_profile(RateLimitedRequest(limiter), server)
+
+    assert response.status_code == 200
+    assert time.time() >= reset
+    assert limiter.rate_limited == 1
+    assert limiter.retries == 1
+
+
+def test_remaining_budget_throttles_requests(server):
+    server.rate_limit, server.window = 3, 1.0
+    limiter = controller()
+    request = RateLimitedRequest(limiter)
+
+    responses = [get_profile(request, server) for _ in range(server.rate_limit + 1)]
+
+    # The last request waited for the window to reset instead of being rejected
+    assert all(response.status_code == 200 for response in responses)
+    assert server.rate_limited == 0
+    assert limiter.throttled == 1
+    assert limiter.rate_limited == 0
+
+
+@pytest.mark.parametrize("fault, counter", [(503, "server_errors"), ("disconnect", "network_errors")])
+def test_transient_failures_are_retried(server, fault, counter):
+    limiter = controller()
+    server.inject(*[fault] * (MAX_RETRIES - 1))
+
+    assert get_profile(RateLimitedRequest(limiter), server).status_code == 200
+    assert getattr(limiter, counter) == MAX_RETRIES - 1
+    assert limiter.retries == MAX_RETRIES - 1
+
+
+@pytest.mark.parametrize("fault", [500, "disconnect"])
+def test_retries_stop_at_max_retries(server, fault):
+    limiter = controller()
+    server.inject(*[fault] * MAX_RETRIES)
+
+    with pytest.raises((exceptions.RequestException, httpx.TransportError)):
+        get_profile(RateLimitedRequest(limiter), server)
+    assert server.requests == MAX_RETRIES
+    assert limiter.retries == MAX_RETRIES - 1
+
+
+@pytest.mark.parametrize("status", [400, 401])
+def test_client_errors_are_not_retried(server, status):
+    limiter = controller()
+    server.inject(status)
+
+    with pytest.raises(exceptions.RequestErrorBase):
+        get_profile(RateLimitedRequest(limiter), server)
+    assert server.requests == 1
+    assert limiter.retries == 0
@@ -0,0 +1,36 @@
+from datetime import datetime
+
+import pytest
+
+from database import Database
+from retention import RetentionPolicy, RetentionService
+
+
+def test_run_never_rebuilds_the_database(db_path, tmp_path, monkeypatch, take_snapshots):
+    with Database() as db:
+        db.conn.execute("PRAGMA auto_vacuum = NONE")
+        db.conn.execute("VACUUM")
+        take_snapshots(db, ["2024-01-01", "2024-01-02", "2024-01-03"], ["did:plc:one", "did:plc:two"])
+
+        monkeypatch.setattr(db, "enable_incremental_vacuum", lambda: pytest.fail("retention ran a full VACUUM"))
+        service = RetentionService(db, RetentionPolicy(full_days=0, thin_days=7), str(tmp_path / "archive"))
+        summary = service.run(datetime(2024, 2, 1))
+
+        assert summary["snapshots"] == 2
+        assert summary["pages"] == 0
+        assert not db.incremental_vacuum_enabled()
+
+
+def test_run_hands_pages_back_with_incremental_vacuum(db_path, tmp_path, take_snapshots):
+    with Database() as db:
+        assert db.incremental_vacuum_enabled()
+        # Each day's followers are new, so archiving drops every membership but the last day's
+        for day in range(1, 4):
+            take_snapshots(db, [f"2024-01-0{day}"], [f"did:plc:{day}-{n}" for n in range(2000)])
+
+        service = RetentionService(db, RetentionPolicy(full_days=0, thin_days=7), str(tmp_path / "archive"))
+        summary = service.run(datetime(2024, 2, 1))
+
+        assert summary["snapshots"] == 2
+        assert summary["pages"] > 0
+        assert db.get_free_pages() == 0
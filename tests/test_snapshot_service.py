@@ -0,0 +1,64 @@
+from concurrent.futures import Future
+
+import pytest
+
+from analytics import FollowerStats
+from bluesky_service import FollowerRecord, ProfileStats
+from database import Database
+from snapshot_service import SnapshotInterrupted, SnapshotService
+
+PROFILE = ProfileStats(did="did:plc:account", handle="account.test", followers_count=2, follows_count=1)
+
+STATS = FollowerStats(total_followers=2, enabled_count=2, disabled_count=0, active_count=1,
+                      ghost_count=1, active_percentage=50.0)
+
+
+def take_snapshot(service: SnapshotService, dids: list[str]) -> int:
+    snapshot_id = service.begin_snapshot(PROFILE)
+    service.add_followers(snapshot_id, [FollowerRecord(did=did, handle=f"{did[8:]}.test") for did in dids])
+    return snapshot_id
+
+
+def test_finalize_commits_once_with_completion(db_path, monkeypatch):
+    with Database() as db:
+        service = SnapshotService(db)
+        service.finalize_snapshot(take_snapshot(service, ["did:plc:one", "did:plc:two"]), PROFILE, STATS)
+        snapshot_id = take_snapshot(service, ["did:plc:one", "did:plc:three"])
+
+        def fail(snapshot_id):
+            raise RuntimeError("interrupted")
+
+        monkeypatch.setattr(db, "complete_snapshot", fail)
+        with pytest.raises(RuntimeError):
+            service.finalize_snapshot(snapshot_id, PROFILE, STATS,
+                                      [FollowerRecord(did="did:plc:one", handle="one.test")])
+        db.conn.rollback()
+
+        # Nothing finalize wrote outlives the failed completion
+        assert db.get_in_progress_snapshot(PROFILE.handle)["id"] == snapshot_id
+        db.cur.execute("SELECT active_count FROM snapshots WHERE id = ?", (snapshot_id,))
+        assert db.cur.fetchone()[0] == 0
+        assert db.get_follower_changes(snapshot_id) == ({}, {}, {})
+        assert db.get_snapshot_bitmap(snapshot_id) is None
+        assert db.get_snapshot_follows_bitmap(snapshot_id) is None
+
+
+def test_stop_while_paging_follows_leaves_snapshot_in_progress(db_path):
+    pages = [([FollowerRecord(did="did:plc:one", handle="one.test"),
+               FollowerRecord(did="did:plc:two", handle="two.test")], None)]
+    follows = Future()
+    follows.set_exception(SnapshotInterrupted("Stopped before the last page"))
+
+    with Database() as db:
+        service = SnapshotService(db)
+        assert service.stream_snapshot(PROFILE, pages, follows=follows) == (None, None)
+
+        checkpoint = service.get_checkpoint(PROFILE)
+        assert checkpoint.exhausted
+
+        # The next run only has the follows left to fetch
+        follows = Future()
+        follows.set_result([FollowerRecord(did="did:plc:one", handle="one.test")])
+        snapshot_id, _ = service.stream_snapshot(PROFILE, [], checkpoint, follows=follows)
+        assert snapshot_id == checkpoint.snapshot_id
+        assert db.get_snapshot_follows_bitmap(snapshot_id).bit_count() == 1
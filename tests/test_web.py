@@ -0,0 +1,44 @@
+from datetime import datetime
+
+import pytest
+
+from database import Database, ReadPool
+from retention import RetentionPolicy, RetentionService
+
+
+@pytest.fixture
+def client(db_path, tmp_path, monkeypatch, take_snapshots):
+    with Database() as db:
+        take_snapshots(db, ["2024-01-01", "2024-01-02", "2024-01-03"], ["did:plc:one", "did:plc:two"])
+        # Archives the first two snapshots' followers
+        RetentionService(db, RetentionPolicy(full_days=0, thin_days=7), str(tmp_path / "archive")).run(datetime(2024, 2, 1))
+
+    # web opens the database at import, so only import it once it points at the test's
+    import web
+    monkeypatch.setattr(web, "read_pool", ReadPool())
+    monkeypatch.setattr(web, "page_cache", web.PageCache())
+    yield web.app.test_client()
+    web.read_pool.close()
+
+
+@pytest.mark.parametrize("path", [
+    "/api/snapshots/1/followers",
+    "/api/snapshots/1/export",
+    "/api/snapshots/1/diff/3",
+    "/api/snapshots/3/diff/2",
+])
+def test_archived_followers_are_gone(client, path):
+    response = client.get(path)
+    assert response.status_code == 410
+    assert b"cli.py restore" in response.data
+
+
+@pytest.mark.parametrize("path", ["/api/snapshots/9/followers", "/api/snapshots/3/diff/9"])
+def test_missing_snapshots_are_not_found(client, path):
+    assert client.get(path).status_code == 404
+
+
+def test_diff_of_snapshots_with_followers(client):
+    response = client.get("/api/snapshots/3/diff/3")
+    assert response.status_code == 200
+    assert response.json["gained_count"] == response.json["lost_count"] == 0
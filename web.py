@@ -1,27 +1,302 @@
-from flask import Flask, render_template, jsonify, request, abort
-from database import Database
+import csv
+import io
+import json
+import threading
+from datetime import datetime
+
+import cohorts
+from flask import Flask, Response, render_template, jsonify, request, abort, make_response, stream_with_context
+from database import Database, ReadPool, EXPORT_FIELDS
+from metrics import registry, PAGE_CACHE, SNAPSHOT_PHASE
 
 app = Flask(__name__, template_folder="templates", static_folder="static")
 
+# Create and migrate the schema once at startup; requests only ever read
+with Database():
+    pass
+
+read_pool = ReadPool()
+
+# Largest page the followers API will return
+MAX_PAGE_SIZE = 1000
+
+# Recent follow cohorts shown on the dashboard
+DASHBOARD_COHORTS = 6
+
+# Accounts not following back listed on the dashboard
+DASHBOARD_RELATIONSHIPS = 100
+
+
+class PageCache:
+    """Rendered responses for the current data version
+
+    Everything rendered for an older version is dropped as soon as a newer
+    one is seen, so the cache never holds more than one copy of each page.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.pages = {}
+        self.lock = threading.Lock()
+
+    def get_or_render(self, version: tuple, key: str, render):
+        with self.lock:
+            if version != self.version:
+                self.version = version
+                self.pages = {}
+            page = self.pages.get(key)
+
+        registry.inc(PAGE_CACHE, result="miss" if page is None else "hit")
+        if page is None:
+            page = render()
+            with self.lock:
+                if version == self.version:
+                    self.pages[key] = page
+        return page
+
+
+page_cache = PageCache()
+
+
+def cached_response(db: Database, key: str, render, mimetype: str = "text/html"):
+    """Serve a rendered page from cache, answering 304 when the client's copy is current"""
+    version = db.get_data_version()
+    etag = "-".join(str(part) for part in version)
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+    else:
+        response = make_response(page_cache.get_or_render(version, key, render))
+        response.mimetype = mimetype
+    response.set_etag(etag)
+    # Always revalidate; a 304 costs one small query
+    response.cache_control.no_cache = True
+    return response
+
+
+def render_dashboard(db: Database) -> str:
+    stats = db.get_last_snapshot()
+    new_followers, unfollows, renamed = db.get_follower_changes(stats['id'])
+    timeseries = db.get_snapshot_series(stats["account_handle"])
+    live_new_followers, live_unfollows = db.get_live_changes(stats["account_handle"])
+    cohort_report = cohorts.report(db, stats["account_handle"], DASHBOARD_COHORTS)
+    relationships = cohorts.relationship_report(db, stats["id"], DASHBOARD_RELATIONSHIPS)
+    return render_template("dashboard.html",
+                            followers = stats["total_followers"],
+                            active = stats["active_count"],
+                            never_posted = stats["never_posted_count"],
+                            disabled = stats["disabled_count"],
+                            handle = stats["account_handle"],
+                            last_updated = stats["timestamp"],
+                            new_followers = new_followers,
+                            unfollows = unfollows,
+                            renamed = renamed,
+                            activity = stats["activity"],
+                            sampling = stats["sampling"],
+                            live_new_followers = live_new_followers,
+                            live_unfollows = live_unfollows,
+                            timeseries = timeseries,
+                            churn = cohort_report["churn"][-1] if cohort_report["churn"] else None,
+                            cohorts = cohort_report["cohorts"],
+                            returning = len(cohort_report["returning"]),
+                            relationships = relationships)
+
 
 @app.route("/")
 def dashboard():
-    with Database() as db:
-        stats = db.get_last_snapshot()
-        new_followers, unfollows = db.get_follower_changes(stats['id'], stats["account_handle"])
-        timeseries = db.get_snapshot_series(stats["account_handle"])
-        return render_template("dashboard.html",
-                                followers = stats["total_followers"],
-                                active = stats["active_count"],
-                                never_posted = stats["never_posted_count"],
-                                disabled = stats["disabled_count"],
-                                handle = stats["account_handle"],
-                                last_updated = stats["timestamp"],
-                                new_followers = new_followers,
-                                unfollows = unfollows,
-                                timeseries = timeseries)
-
-
-# @app.route("/snapshots")
-# def snapshots():
-#     pass
\ No newline at end of file
+    with read_pool.connection() as db:
+        return cached_response(db, "dashboard", lambda: render_dashboard(db))
+
+
+def int_arg(name: str, default: int, maximum: int) -> int:
+    """Read a positive integer query parameter, rejecting anything else with a 400"""
+    value = request.args.get(name, default)
+    try:
+        value = int(value)
+    except ValueError:
+        abort(400, f"{name} must be an integer")
+    if value < 0:
+        abort(400, f"{name} must not be negative")
+    return min(value, maximum)
+
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus scrape target
+
+    API and database totals are stored by each snapshot run, phase timings
+    come from every account's latest snapshot, and page cache counters
+    belong to this process.
+    """
+    with read_pool.connection() as db:
+        samples = db.get_metrics()
+        timings = db.get_latest_snapshot_timings()
+
+    for handle, phases in timings.items():
+        for phase, seconds in json.loads(phases).items():
+            samples.append((SNAPSHOT_PHASE, json.dumps({"account": handle, "phase": phase}), seconds))
+    samples.extend(registry.samples())
+
+    return Response(registry.render(samples), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/api/snapshots")
+def api_snapshots():
+    limit = int_arg("limit", 30, MAX_PAGE_SIZE)
+    with read_pool.connection() as db:
+        return cached_response(db, f"api:snapshots:{limit}",
+                               lambda: jsonify(snapshots=db.get_recent_snapshots(limit)).get_data(),
+                               mimetype="application/json")
+
+
+# Most points a series request may ask for
+MAX_SERIES_POINTS = 2000
+
+
+def time_arg(name: str):
+    """Read an optional 'YYYY-MM-DD[ HH:MM:SS]' UTC query parameter, rejecting anything else with a 400"""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value).strftime("%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        abort(400, f"{name} must be an ISO 8601 date or time")
+
+
+@app.route("/api/accounts/<handle>/series")
+def api_account_series(handle: str):
+    start = time_arg("start")
+    end = time_arg("end")
+    max_points = max(int_arg("points", 200, MAX_SERIES_POINTS), 3)
+    with read_pool.connection() as db:
+        return cached_response(db, f"api:series:{handle}:{start}:{end}:{max_points}",
+                               lambda: jsonify(series=db.get_snapshot_series(handle, start, end, max_points)).get_data(),
+                               mimetype="application/json")
+
+
+@app.route("/api/accounts/<handle>/cohorts")
+def api_account_cohorts(handle: str):
+    max_cohorts = max(int_arg("cohorts", 12, MAX_PAGE_SIZE), 1)
+
+    def render():
+        report = cohorts.report(db, handle, max_cohorts)
+        followers = db.get_followers_by_id(report["returning"])
+        report["returning"] = [{"did": did, "handle": follower_handle} for did, follower_handle in followers.values()]
+        return jsonify(report).get_data()
+
+    with read_pool.connection() as db:
+        return cached_response(db, f"api:cohorts:{handle}:{max_cohorts}", render, mimetype="application/json")
+
+
+def require_followers(snapshot: dict | None):
+    """404 unless the snapshot exists, 410 if retention archived its followers"""
+    if not snapshot:
+        abort(404)
+    if snapshot["archive"]:
+        abort(410, f"The followers of snapshot {snapshot['id']} are archived, "
+                   f"restore them with `python cli.py restore {snapshot['id']}`")
+
+
+@app.route("/api/snapshots/<int:before_id>/diff/<int:after_id>")
+def api_snapshot_diff(before_id: int, after_id: int):
+    """Followers gained and lost between any two snapshots"""
+    limit = int_arg("limit", MAX_PAGE_SIZE, MAX_PAGE_SIZE)
+    with read_pool.connection() as db:
+        require_followers(db.get_snapshot(before_id))
+        require_followers(db.get_snapshot(after_id))
+        before = db.get_snapshot_bitmap(before_id)
+        after = db.get_snapshot_bitmap(after_id)
+        if before is None or after is None:
+            abort(404)
+
+        result = {}
+        for name, bitmap in zip(("gained", "lost"), cohorts.diff(before, after)):
+            ids = cohorts.members(bitmap)
+            followers = db.get_followers_by_id(ids[:limit])
+            result[f"{name}_count"] = len(ids)
+            result[name] = [{"did": followers[i][0], "handle": followers[i][1]} for i in ids[:limit]]
+
+    return jsonify(result)
+
+
+@app.route("/api/snapshots/<int:snapshot_id>/relationships")
+def api_snapshot_relationships(snapshot_id: int):
+    """Mutuals, followers not followed back and accounts not following back at a snapshot"""
+    limit = int_arg("limit", MAX_PAGE_SIZE, MAX_PAGE_SIZE)
+
+    def render():
+        report = cohorts.relationship_report(db, snapshot_id, limit)
+        if report is None:
+            abort(404)
+        for name in ("mutuals", "followers_only", "following_only"):
+            report[name] = [{"did": did, "handle": handle} for did, handle in report[name].items()]
+        return jsonify(report).get_data()
+
+    with read_pool.connection() as db:
+        return cached_response(db, f"api:relationships:{snapshot_id}:{limit}", render, mimetype="application/json")
+
+
+# Most results a follower search may ask for
+MAX_SEARCH_RESULTS = 50
+
+
+@app.route("/api/search")
+def api_search():
+    """Followers whose handle or display name starts with the words typed, with their follow history
+
+    Not page cached, since every keystroke of a typeahead is a new query.
+    """
+    query = request.args.get("q", "")
+    account = request.args.get("account") or None
+    limit = int_arg("limit", 20, MAX_SEARCH_RESULTS)
+    with read_pool.connection() as db:
+        return jsonify(results=db.search_followers(query, account, limit))
+
+
+@app.route("/api/snapshots/<int:snapshot_id>/followers")
+def api_snapshot_followers(snapshot_id: int):
+    limit = max(int_arg("limit", 200, MAX_PAGE_SIZE), 1)
+    cursor = int_arg("cursor", 0, 2 ** 63 - 1)
+    with read_pool.connection() as db:
+        require_followers(db.get_snapshot(snapshot_id))
+        followers, next_cursor = db.get_snapshot_followers_page(snapshot_id, cursor, limit)
+
+    return jsonify(
+        followers=followers,
+        next_cursor=str(next_cursor) if next_cursor is not None else None
+    )
+
+
+@app.route("/api/snapshots/<int:snapshot_id>/export")
+def api_snapshot_export(snapshot_id: int):
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in ("ndjson", "csv"):
+        abort(400, "format must be ndjson or csv")
+
+    with read_pool.connection() as db:
+        require_followers(db.get_snapshot(snapshot_id))
+
+    def generate_rows():
+        # Rows are read a page at a time while the response is being sent
+        with read_pool.connection() as db:
+            if export_format == "ndjson":
+                for follower in db.iter_snapshot_followers(snapshot_id):
+                    yield json.dumps(follower) + "\n"
+                return
+
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+            writer.writeheader()
+            for follower in db.iter_snapshot_followers(snapshot_id):
+                writer.writerow(follower)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue()
+
+    mimetype = "application/x-ndjson" if export_format == "ndjson" else "text/csv"
+    return Response(
+        stream_with_context(generate_rows()),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=snapshot-{snapshot_id}.{export_format}"}
+    )